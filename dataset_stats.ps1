@@ -0,0 +1,54 @@
+### PowerShell Script to Execute dataset_stats.py inside a Docker Container
+###
+### Usage:
+### ./dataset_stats.ps1 -TrainData "data.jsonl" -BaseModel "unsloth/Llama-3.2-1B-Instruct-bnb-4bit" -ChatTemplate "llama-3.1" -MaxSeqLength 1024
+### ./dataset_stats.ps1 -SeqLengths "512 1024 2048" -BatchSizes "1 2 4 8" -OutputJson "/app/dataset_stats.json"
+param (
+    [string]$TrainData,
+    [string]$BaseModel,
+    [string]$ChatTemplate,
+    [int]$MaxSeqLength,
+    [string]$SeqLengths,
+    [string]$BatchSizes,
+    [int]$Workers,
+    [string]$OutputJson
+)
+
+# Define container name
+$ContainerName = "kolo_container"
+
+# Check if the container is running
+$containerRunning = docker ps --format "{{.Names}}" | Select-String -Pattern "$ContainerName"
+
+if (-Not $containerRunning) {
+    Write-Host "Error: Container '$ContainerName' is not running." -ForegroundColor Red
+    exit 1
+}
+
+# Build command string dynamically
+$command = "source /opt/conda/bin/activate kolo_env && cd /app && python /app/dataset_stats.py"
+
+if ($TrainData) { $command += " --train_data '$TrainData'" }
+if ($BaseModel) { $command += " --base_model '$BaseModel'" }
+if ($ChatTemplate) { $command += " --chat_template '$ChatTemplate'" }
+if ($MaxSeqLength) { $command += " --max_seq_length $MaxSeqLength" }
+if ($SeqLengths) { $command += " --seq_lengths $SeqLengths" }
+if ($BatchSizes) { $command += " --batch_sizes $BatchSizes" }
+if ($Workers) { $command += " --workers $Workers" }
+if ($OutputJson) { $command += " --output_json '$OutputJson'" }
+
+# Execute the python script inside the container
+try {
+    Write-Host "Executing dataset_stats.py inside container: $ContainerName..."
+    docker exec -it $ContainerName /bin/bash -c $command
+
+    if ($?) {
+        Write-Host "Script executed successfully!" -ForegroundColor Green
+    }
+    else {
+        Write-Host "Failed to execute script." -ForegroundColor Red
+    }
+}
+catch {
+    Write-Host "An error occurred: $_" -ForegroundColor Red
+}
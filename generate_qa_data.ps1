@@ -8,6 +8,9 @@
 .EXAMPLE
     .\generate_qa_data.ps1 -OpenAI_API_KEY "your_api_key_here" -GroupWorkers 8 -AnswerWorkers 4
     .\generate_qa_data.ps1 -GroupWorkers 8 -AnswerWorkers 4
+    .\generate_qa_data.ps1 -OpenAI_API_KEY "your_api_key_here" -Mode batch
+    .\generate_qa_data.ps1 -Plan
+    .\generate_qa_data.ps1 -Mode worker -Workers 4
 #>
 
 [CmdletBinding()]
@@ -16,7 +19,17 @@ param(
     [string]$OpenAI_API_KEY,
     
     [Parameter(Mandatory = $false, HelpMessage = "Max workers for processing.")]
-    [int]$Threads = 8
+    [int]$Threads = 8,
+
+    [Parameter(Mandatory = $false, HelpMessage = "online (default), batch (OpenAI Batch API) or worker (shared work queue).")]
+    [ValidateSet("online", "batch", "worker")]
+    [string]$Mode = "online",
+
+    [Parameter(Mandatory = $false, HelpMessage = "Worker processes to start in worker mode.")]
+    [int]$Workers = 1,
+
+    [Parameter(Mandatory = $false, HelpMessage = "Print the predicted calls, tokens and wall time, then exit.")]
+    [switch]$Plan
 )
 
 # Define the container name
@@ -31,7 +44,10 @@ if (-Not $containerRunning) {
 }
 
 # Build the command string to execute inside the container.
-$baseCommand = "source /opt/conda/bin/activate kolo_env && python /app/generate_qa_data.py --threads $Threads"
+$baseCommand = "source /opt/conda/bin/activate kolo_env && python /app/generate_qa_data.py --threads $Threads --mode $Mode --workers $Workers"
+if ($Plan) {
+    $baseCommand = "$baseCommand --plan"
+}
 
 if ($OpenAI_API_KEY) {
     $command = "export OPENAI_API_KEY='$OpenAI_API_KEY'; $baseCommand"
@@ -1,80 +1,480 @@
 import os
 import re
+import json
 import yaml
 import argparse
-import requests
+import asyncio
+import threading
 import hashlib
 import logging
 import random
 import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Tuple, Mapping
 
+from SyntheticDataGeneration.EndpointPool import EndpointPool
+from SyntheticDataGeneration.Metrics import Metrics
+from SyntheticDataGeneration.RateLimiter import RateLimiter
+from SyntheticDataGeneration.ResponseCache import ResponseCache
+from SyntheticDataGeneration.TextParser import TextParser
 from SyntheticDataGeneration.Utils import Utils
 
+# Try importing httpx (installed alongside the OpenAI client)
+try:
+    import httpx
+    # httpx logs every request at INFO, which drowns out the generation logs.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+except ImportError:
+    httpx = None
+    Utils.logger.warning("httpx package not installed; ollama provider will not work.")
+
 # Try importing the OpenAI client
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI, APITimeoutError
 except ImportError:
-    OpenAI = None
+    AsyncOpenAI = None
+    APITimeoutError = None
     Utils.logger.warning("OpenAI package not installed; openai provider will not work.")
 
+class StreamCollector:
+    """Accumulates a streamed completion and tells when max_questions complete question lines have arrived."""
+
+    def __init__(self, max_questions: Optional[int]):
+        self.max_questions = max_questions
+        self.parts: List[str] = []
+        self.chunks = 0
+        self.questions = 0
+        self._line = ""
+
+    def feed(self, delta: str) -> bool:
+        """Adds a piece of the completion. Returns True once enough questions have been received."""
+        self.parts.append(delta)
+        self.chunks += 1
+        if not self.max_questions:
+            return False
+        self._line += delta
+        if "\n" not in delta:
+            return False
+        complete, _, self._line = self._line.rpartition("\n")
+        self.questions += len(TextParser.parse_questions(complete))
+        return self.questions >= self.max_questions
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
 class APIClient:
-    def __init__(self, provider: str, model: str, global_ollama_url: Optional[str] = None, openai_client: Optional[OpenAI] = None):
+    # Pooled keep-alive clients shared by every APIClient: event loop -> provider -> client.
+    _pools: Dict[asyncio.AbstractEventLoop, Dict[str, Any]] = {}
+    _pools_lock = threading.Lock()
+    # Background event loop backing the synchronous call_api wrapper.
+    _sync_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        global_ollama_url: Optional[str] = None,
+        openai_api_key: Optional[str] = None,
+        max_connections: int = 100,
+        rate_limiter: Optional[RateLimiter] = None,
+        options: Optional[Dict[str, Any]] = None,
+        cache: Optional[ResponseCache] = None,
+        openai_base_url: Optional[str] = None,
+        endpoint_pool: Optional[EndpointPool] = None,
+        metrics: Optional[Metrics] = None,
+        max_tokens: Optional[int] = None,
+        max_questions: Optional[int] = None,
+        stream: Optional[bool] = None
+    ):
         self.provider = provider.lower()
         self.model = model
         self.global_ollama_url = global_ollama_url
-        self.openai_client = openai_client
+        self.openai_api_key = openai_api_key
+        self.max_connections = max_connections
+        self.rate_limiter = rate_limiter
+        self.options = dict(options or {})
+        if max_tokens:
+            # Completion token cap, under each provider's own option name.
+            self.options.setdefault("num_predict" if self.provider == "ollama" else "max_tokens", max_tokens)
+        # Question lists are cut after max_questions questions; streaming stops the generation right there.
+        self.max_questions = max_questions
+        self.stream = bool(max_questions) if stream is None else stream
+        # Responses cut at a different max_questions are different responses.
+        self.cache_options = dict(self.options, max_questions=max_questions) if max_questions else self.options
+        self.cache = cache
+        self.openai_base_url = openai_base_url
+        self.endpoint_pool = endpoint_pool
+        self.metrics = metrics
+        # Provider-side prompt cache usage, for judging prefix reuse.
+        self._usage_lock = threading.Lock()
+        self.prompt_stats = {"requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "cache_hit_requests": 0, "prompt_eval_seconds": 0.0}
 
-    def call_api(self, prompt: str) -> Optional[str]:
-        max_retries = 5
-        backoff_factor = 1
+    def _create_pool(self) -> Any:
         if self.provider == "openai":
-            if not self.openai_client:
+            if AsyncOpenAI is None or httpx is None:
+                return None
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            # Retries are handled in _with_retries so that 429s reach the shared rate limiter.
+            return AsyncOpenAI(
+                api_key=self.openai_api_key, base_url=self.openai_base_url, max_retries=0,
+                http_client=httpx.AsyncClient(limits=limits, timeout=600)
+            )
+        if self.provider == "ollama":
+            if httpx is None:
+                return None
+            # Keep-alive limits are per client, so leave room for a full set of connections to every endpoint.
+            connections = self.max_connections * (len(self.endpoint_pool.endpoints) if self.endpoint_pool else 1)
+            limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+            return httpx.AsyncClient(limits=limits, timeout=60)
+        return None
+
+    def _get_pool(self) -> Any:
+        loop = asyncio.get_running_loop()
+        with APIClient._pools_lock:
+            pools = APIClient._pools.setdefault(loop, {})
+            if self.provider not in pools:
+                pools[self.provider] = self._create_pool()
+            return pools[self.provider]
+
+    @classmethod
+    async def aclose_pools(cls) -> None:
+        """Closes the pooled clients that belong to the running event loop."""
+        loop = asyncio.get_running_loop()
+        with cls._pools_lock:
+            pools = cls._pools.pop(loop, {})
+        for client in pools.values():
+            if client is None:
+                continue
+            if hasattr(client, "aclose"):
+                await client.aclose()
+            else:
+                await client.close()
+
+    @classmethod
+    def run_sync(cls, coro):
+        """Runs a coroutine on the shared background loop and blocks until it finishes."""
+        with cls._pools_lock:
+            if cls._sync_loop is None:
+                cls._sync_loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._sync_loop.run_forever, name="APIClientLoop", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, cls._sync_loop).result()
+
+    def call_api(self, prompt: str, salt: str = "") -> Optional[str]:
+        return APIClient.run_sync(self.acall_api(prompt, salt))
+
+    async def acall_api(self, prompt: str, salt: str = "") -> Optional[str]:
+        """
+        Returns the completion for prompt, from the response cache when possible.
+        Calls that should produce distinct outputs for the same prompt (e.g. group
+        iterations) must pass distinct salts.
+        """
+        if not self.cache:
+            return self._limit_questions(await self._call_provider(prompt))
+        cache_key = ResponseCache.make_key(self.provider, self.model, self.cache_options, prompt, salt)
+        cached = await self.cache.aget(cache_key)
+        if cached is not None:
+            if self.metrics:
+                self.metrics.inc("qa_response_cache_hits_total", provider=self.provider, model=self.model)
+            return cached
+        response = self._limit_questions(await self._call_provider(prompt))
+        if response:
+            await self.cache.aput(cache_key, response)
+        return response
+
+    def _limit_questions(self, text: Optional[str]) -> Optional[str]:
+        if not text or not self.max_questions:
+            return text
+        return TextParser.truncate_questions(text, self.max_questions)
+
+    async def _call_provider(self, prompt: str) -> Optional[str]:
+        if self.provider == "openai":
+            if AsyncOpenAI is None:
                 Utils.logger.error("OpenAI client not initialized.")
                 return None
-            attempt = 0
-            while attempt <= max_retries:
-                try:
-                    response = self.openai_client.chat.completions.create(
-                        messages=[{"role": "user", "content": prompt}],
-                        model=self.model
-                    )
-                    return response.choices[0].message.content
-                except Exception as e:
-                    Utils.logger.error(f"OpenAI API error on attempt {attempt+1}/{max_retries}: {e}")
-                    if attempt == max_retries:
-                        return None
-                    sleep_time = backoff_factor * (2 ** attempt) + random.uniform(0, 1)
-                    Utils.logger.info(f"Retrying OpenAI API call in {sleep_time:.2f} seconds...")
-                    time.sleep(sleep_time)
-                    attempt += 1
+            return await self._with_retries("OpenAI", self._request_openai, prompt)
         elif self.provider == "ollama":
-            if not self.global_ollama_url:
+            if not self.global_ollama_url and not self.endpoint_pool:
                 Utils.logger.error("Global Ollama URL not provided.")
                 return None
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {}
-            }
-            attempt = 0
-            while attempt <= max_retries:
-                try:
-                    response = requests.post(self.global_ollama_url, json=payload, timeout=60)
-                    response.raise_for_status()
-                    result = response.json()
-                    return result.get("response", "").strip()
-                except Exception as e:
-                    Utils.logger.error(f"Ollama API error on attempt {attempt+1}/{max_retries}: {e}")
-                    if attempt == max_retries:
-                        return None
-                    sleep_time = backoff_factor * (2 ** attempt) + random.uniform(0, 1)
-                    Utils.logger.info(f"Retrying Ollama API call in {sleep_time:.2f} seconds...")
-                    time.sleep(sleep_time)
-                    attempt += 1
+            if httpx is None:
+                Utils.logger.error("Ollama client not initialized.")
+                return None
+            return await self._with_retries("Ollama", self._request_ollama, prompt)
         else:
             Utils.logger.error(f"Unknown provider specified: {self.provider}")
-            return None
\ No newline at end of file
+            return None
+
+    @staticmethod
+    def _is_timeout(e: Exception) -> bool:
+        return ((httpx is not None and isinstance(e, httpx.TimeoutException)) or
+                (APITimeoutError is not None and isinstance(e, APITimeoutError)))
+
+    @staticmethod
+    def _is_endpoint_failure(e: Exception) -> bool:
+        # Connection errors, timeouts and 5xx (other than a busy 503) count against the endpoint's health.
+        if httpx is not None and isinstance(e, httpx.TransportError):
+            return True
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        return status is not None and status >= 500 and status != 503
+
+    async def _with_retries(self, label: str, request, prompt: str) -> Optional[str]:
+        max_retries = 5
+        backoff_factor = 1
+        limiter = self.rate_limiter
+        estimated_tokens = limiter.estimate_tokens(prompt) if limiter else 0
+        attempt = 0
+        while attempt <= max_retries:
+            if limiter:
+                await limiter.acquire(estimated_tokens)
+            actual_tokens, headers, error = None, None, None
+            start = time.monotonic()
+            try:
+                text, actual_tokens, headers = await request(prompt)
+            except Exception as e:
+                # Both httpx.HTTPStatusError and openai.APIStatusError carry the HTTP response.
+                error = e
+                actual_tokens = 0
+                headers = getattr(getattr(e, "response", None), "headers", None)
+            finally:
+                if limiter:
+                    limiter.release(estimated_tokens, actual_tokens, headers)
+            if self.metrics:
+                self.metrics.observe(
+                    "qa_api_request_seconds", time.monotonic() - start,
+                    provider=self.provider, model=self.model, outcome="ok" if error is None else "error"
+                )
+            if error is None:
+                if limiter:
+                    limiter.on_success()
+                return text
+
+            status = getattr(getattr(error, "response", None), "status_code", None)
+            Utils.logger.error(f"{label} API error on attempt {attempt+1}/{max_retries}: {error}")
+            if self.metrics:
+                self.metrics.inc(
+                    "qa_api_errors_total", provider=self.provider, model=self.model,
+                    status=status or ("timeout" if self._is_timeout(error) else type(error).__name__)
+                )
+            if attempt == max_retries:
+                if self.metrics:
+                    self.metrics.inc("qa_api_failures_total", provider=self.provider, model=self.model)
+                return None
+            # Full jitter keeps workers that failed together from retrying together.
+            sleep_time = random.uniform(0, backoff_factor * (2 ** attempt))
+            if status in (429, 503) or self._is_timeout(error):
+                retry_after = RateLimiter.retry_after_seconds(headers)
+                if limiter:
+                    # The limiter pauses every caller for retry_after, so only add jitter here.
+                    limiter.on_throttle(retry_after, f"{label} returned {status or 'timeout'}")
+                    if retry_after:
+                        sleep_time = random.uniform(0, backoff_factor)
+                elif retry_after:
+                    sleep_time = retry_after + random.uniform(0, backoff_factor)
+            Utils.logger.info(f"Retrying {label} API call in {sleep_time:.2f} seconds...")
+            if self.metrics:
+                self.metrics.inc("qa_api_retries_total", provider=self.provider, model=self.model)
+            await asyncio.sleep(sleep_time)
+            attempt += 1
+
+    def _record_usage(
+        self, prompt_tokens: int, completion_tokens: int, cached_tokens: Optional[int], prompt_eval_seconds: float = 0.0
+    ) -> None:
+        if self.metrics:
+            self.metrics.inc("qa_prompt_tokens_total", prompt_tokens or 0, provider=self.provider, model=self.model)
+            self.metrics.inc("qa_completion_tokens_total", completion_tokens or 0, provider=self.provider, model=self.model)
+        with self._usage_lock:
+            stats = self.prompt_stats
+            stats["requests"] += 1
+            stats["prompt_tokens"] += prompt_tokens or 0
+            stats["prompt_eval_seconds"] += prompt_eval_seconds
+            if cached_tokens:
+                stats["cached_prompt_tokens"] += cached_tokens
+                stats["cache_hit_requests"] += 1
+
+    def prompt_cache_summary(self) -> str:
+        with self._usage_lock:
+            stats = dict(self.prompt_stats)
+        if not stats["requests"]:
+            return f"{self.provider}:{self.model}: no requests."
+        if self.provider == "openai":
+            token_rate = stats["cached_prompt_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+            return (
+                f"{self.provider}:{self.model}: prompt cache hit rate {stats['cache_hit_requests'] / stats['requests']:.1%} of requests, "
+                f"{token_rate:.1%} of prompt tokens."
+            )
+        return (
+            f"{self.provider}:{self.model}: {stats['prompt_tokens'] / stats['requests']:.0f} prompt tokens evaluated per request, "
+            f"mean prompt eval (time to first token) {stats['prompt_eval_seconds'] / stats['requests'] * 1000:.0f} ms."
+        )
+
+    async def _request_openai(self, prompt: str) -> Tuple[Optional[str], Optional[int], Mapping]:
+        client = self._get_pool()
+        if self.stream:
+            return await self._stream_openai(client, prompt)
+        raw = await client.chat.completions.with_raw_response.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model,
+            **self.options
+        )
+        response = raw.parse()
+        total_tokens = None
+        if response.usage:
+            total_tokens = response.usage.total_tokens
+            details = getattr(response.usage, "prompt_tokens_details", None)
+            self._record_usage(
+                response.usage.prompt_tokens, response.usage.completion_tokens, getattr(details, "cached_tokens", None) or 0
+            )
+        return response.choices[0].message.content, total_tokens, raw.headers
+
+    async def _stream_openai(self, client: Any, prompt: str) -> Tuple[Optional[str], Optional[int], Mapping]:
+        raw = await client.chat.completions.with_raw_response.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model,
+            stream=True,
+            stream_options={"include_usage": True},
+            **self.options
+        )
+        collector = StreamCollector(self.max_questions)
+        usage = None
+        stream = raw.parse()
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content and collector.feed(chunk.choices[0].delta.content):
+                    # Closing the stream early ends the generation and its billing.
+                    break
+        finally:
+            await stream.close()
+        if usage:
+            details = getattr(usage, "prompt_tokens_details", None)
+            self._record_usage(usage.prompt_tokens, usage.completion_tokens, getattr(details, "cached_tokens", None) or 0)
+            return collector.text(), usage.total_tokens, raw.headers
+        # Cut off before the usage chunk: each content chunk is about one token.
+        self._record_usage(len(prompt) // 4, collector.chunks, 0)
+        return collector.text(), len(prompt) // 4 + collector.chunks, raw.headers
+
+    async def _request_ollama(self, prompt: str) -> Tuple[Optional[str], Optional[int], Mapping]:
+        client = self._get_pool()
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": self.stream,
+            "options": self.options
+        }
+        if not self.endpoint_pool:
+            return await self._post_ollama(client, self.global_ollama_url, payload)
+        # Prompts start with the group's file content, so the head of the prompt identifies its prefix.
+        endpoint = self.endpoint_pool.acquire(affinity=hash(prompt[:1024]))
+        start = time.monotonic()
+        # A cancelled request is not the endpoint's fault; it only has to give back its slot.
+        ok = True
+        try:
+            return await self._post_ollama(client, endpoint.url, payload)
+        except Exception as e:
+            ok = not self._is_endpoint_failure(e)
+            raise
+        finally:
+            self.endpoint_pool.release(endpoint, ok, time.monotonic() - start)
+
+    async def _post_ollama(self, client: Any, url: str, payload: Dict[str, Any]) -> Tuple[Optional[str], Optional[int], Mapping]:
+        if not payload["stream"]:
+            response = await client.post(url, json=payload)
+            response.raise_for_status()
+            result = response.json()
+            text = result.get("response", "")
+        else:
+            collector = StreamCollector(self.max_questions)
+            result = {}
+            async with client.stream("POST", url, json=payload) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("done"):
+                        result = chunk
+                        break
+                    if collector.feed(chunk.get("response", "")):
+                        # Leaving the block closes the connection, which makes Ollama stop generating.
+                        break
+            text = collector.text()
+            if not result:
+                # Cut off before the final statistics: each chunk is one token.
+                result = {"prompt_eval_count": len(payload["prompt"]) // 4, "eval_count": collector.chunks}
+        total_tokens = result.get("prompt_eval_count", 0) + result.get("eval_count", 0)
+        # Ollama only evaluates the part of the prompt that is not already in its KV cache, so
+        # prompt_eval_count/duration shrink (and time-to-first-token drops) when the prefix is reused.
+        self._record_usage(
+            result.get("prompt_eval_count", 0), result.get("eval_count", 0), None, result.get("prompt_eval_duration", 0) / 1e9
+        )
+        return text.strip(), total_tokens, response.headers
+
+    async def acall_batch(self, requests: List[Tuple[str, str, str]], poll_interval: float = 30.0) -> Dict[str, str]:
+        """
+        Runs (custom_id, prompt, salt) requests through the OpenAI Batch API and
+        returns {custom_id: completion} for the requests that succeeded. Cached
+        prompts are answered locally and only the misses are submitted.
+        """
+        if self.provider != "openai" or AsyncOpenAI is None:
+            Utils.logger.error(f"Batch mode requires the openai provider (got '{self.provider}').")
+            return {}
+        results: Dict[str, str] = {}
+        cache_keys: Dict[str, str] = {}
+        lines = []
+        for custom_id, prompt, salt in requests:
+            if self.cache:
+                cache_keys[custom_id] = ResponseCache.make_key(self.provider, self.model, self.cache_options, prompt, salt)
+                cached = await self.cache.aget(cache_keys[custom_id])
+                if cached is not None:
+                    results[custom_id] = cached
+                    continue
+            lines.append(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": self.model, "messages": [{"role": "user", "content": prompt}], **self.options}
+            }, ensure_ascii=False))
+        if not lines:
+            return results
+
+        client = self._get_pool()
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        submitted = len(lines)
+        del lines
+        batch_file = await client.files.create(file=("batch_requests.jsonl", payload), purpose="batch")
+        del payload
+        batch = await client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+        Utils.logger.info(f"Submitted batch {batch.id} with {submitted} requests.")
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(poll_interval)
+            batch = await client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts:
+                Utils.logger.info(f"Batch {batch.id}: {batch.status}, {counts.completed}/{counts.total} completed, {counts.failed} failed.")
+        if batch.status != "completed":
+            Utils.logger.error(f"Batch {batch.id} ended with status '{batch.status}'; ingesting any partial output.")
+
+        failed = submitted
+        if batch.output_file_id:
+            content = await client.files.content(batch.output_file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                text = self._limit_questions(response["body"]["choices"][0]["message"]["content"])
+                if not text:
+                    continue
+                custom_id = record["custom_id"]
+                results[custom_id] = text
+                failed -= 1
+                if self.cache:
+                    await self.cache.aput(cache_keys[custom_id], text)
+        if failed:
+            Utils.logger.error(f"Batch {batch.id}: {failed} of {submitted} requests did not return a completion.")
+        return results
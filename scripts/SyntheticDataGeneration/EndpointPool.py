@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any
+from urllib.parse import urlsplit, urlunsplit
+
+from SyntheticDataGeneration.Utils import Utils
+
+# Try importing httpx (installed alongside the OpenAI client)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.next_probe = 0.0
+        self.probing = False
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+class EndpointPool:
+    """
+    Routes requests across several Ollama endpoints by least outstanding
+    requests. Prompts sharing a prefix stick to the endpoint that served
+    them last unless it is noticeably busier than the least loaded one, which
+    keeps that node's KV cache warm.
+
+    An endpoint that fails max_failures times in a row is taken out of
+    rotation and probed every probe_interval seconds until it answers again.
+    """
+
+    def __init__(self, urls: List[str], max_failures: int = 3, probe_interval: float = 15.0, affinity_slack: int = 1):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.max_failures = max_failures
+        self.probe_interval = probe_interval
+        self.affinity_slack = affinity_slack
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self._affinity: "OrderedDict[int, Endpoint]" = OrderedDict()
+        self._affinity_size = 10000
+        self._probes = set()
+
+    def acquire(self, affinity: Optional[int] = None) -> Endpoint:
+        with self.lock:
+            now = time.monotonic()
+            for endpoint in self.endpoints:
+                if not endpoint.healthy and not endpoint.probing and now >= endpoint.next_probe:
+                    endpoint.probing = True
+                    probe = asyncio.get_running_loop().create_task(self._probe(endpoint))
+                    self._probes.add(probe)
+                    probe.add_done_callback(self._probes.discard)
+            candidates = [e for e in self.endpoints if e.healthy]
+            if not candidates:
+                # Nothing is healthy; keep trying everything rather than failing outright.
+                candidates = self.endpoints
+            chosen = min(candidates, key=lambda e: e.outstanding)
+            if affinity is not None:
+                sticky = self._affinity.get(affinity)
+                if sticky in candidates and sticky.outstanding <= chosen.outstanding + self.affinity_slack:
+                    chosen = sticky
+                self._affinity[affinity] = chosen
+                self._affinity.move_to_end(affinity)
+                if len(self._affinity) > self._affinity_size:
+                    self._affinity.popitem(last=False)
+            chosen.outstanding += 1
+            return chosen
+
+    def release(self, endpoint: Endpoint, ok: bool, elapsed: float) -> None:
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.busy_seconds += elapsed
+            if ok:
+                endpoint.completed += 1
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.failed += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.healthy and endpoint.consecutive_failures >= self.max_failures:
+                endpoint.healthy = False
+                endpoint.next_probe = time.monotonic() + self.probe_interval
+                Utils.logger.warning(f"Endpoint {endpoint.url} failed {endpoint.consecutive_failures} times; removed from rotation.")
+
+    @staticmethod
+    def _probe_url(url: str) -> str:
+        # /api/tags is a cheap Ollama endpoint that only answers once the server is up.
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme, parts.netloc, "/api/tags", "", ""))
+
+    async def _probe(self, endpoint: Endpoint) -> None:
+        ok = False
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                response = await client.get(self._probe_url(endpoint.url))
+                ok = response.status_code < 500
+        except Exception:
+            ok = False
+        with self.lock:
+            endpoint.probing = False
+            if ok:
+                endpoint.healthy = True
+                endpoint.consecutive_failures = 0
+                Utils.logger.info(f"Endpoint {endpoint.url} is healthy again; returned to rotation.")
+            else:
+                endpoint.next_probe = time.monotonic() + self.probe_interval
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return [
+                {
+                    "url": e.url,
+                    "healthy": e.healthy,
+                    "outstanding": e.outstanding,
+                    "completed": e.completed,
+                    "failed": e.failed,
+                    "requests_per_second": e.completed / elapsed,
+                    "mean_latency": e.busy_seconds / max(e.completed + e.failed, 1),
+                }
+                for e in self.endpoints
+            ]
+
+    def summary(self) -> List[str]:
+        return [
+            f"{s['url']}: {s['completed']} completed, {s['failed']} failed, {s['requests_per_second']:.2f} req/s, "
+            f"mean latency {s['mean_latency']:.2f}s{'' if s['healthy'] else ' (unhealthy)'}"
+            for s in self.stats()
+        ]
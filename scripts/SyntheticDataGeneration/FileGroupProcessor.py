@@ -2,21 +2,29 @@ import os
 import re
 import yaml
 import argparse
-import requests
+import asyncio
+import copy
 import hashlib
 import logging
 import random
 import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Tuple
 
 from SyntheticDataGeneration.ApiClient import APIClient
 from SyntheticDataGeneration.FileManager import FileManager
+from SyntheticDataGeneration.Metrics import Metrics
+from SyntheticDataGeneration.QuestionDeduplicator import QuestionDeduplicator, DedupTurn
+from SyntheticDataGeneration.ResultStore import ResultStore
 from SyntheticDataGeneration.Utils import Utils
 from SyntheticDataGeneration.TextParser import TextParser
+from SyntheticDataGeneration.TaskScheduler import TaskScheduler
+from SyntheticDataGeneration.TokenCounter import TokenCounter
 
 class FileGroupProcessor:
+    # Prompt templates already reported for not starting with {file_content}.
+    _warned_templates = set()
+
     def __init__(
         self,
         group_name: str,
@@ -26,8 +34,11 @@ class FileGroupProcessor:
         output_base_path: Path,
         question_api_client: APIClient,
         answer_api_client: APIClient,
-        thread_count: int,
-        file_manager: FileManager
+        scheduler: Optional[TaskScheduler],
+        file_manager: FileManager,
+        result_store: ResultStore,
+        deduplicator: Optional[QuestionDeduplicator] = None,
+        metrics: Optional[Metrics] = None
     ):
         self.group_name = group_name
         self.group_config = group_config
@@ -36,8 +47,17 @@ class FileGroupProcessor:
         self.output_base_path = output_base_path
         self.question_api_client = question_api_client
         self.answer_api_client = answer_api_client
-        self.thread_count = thread_count
+        self.scheduler = scheduler
         self.file_manager = file_manager
+        self.result_store = result_store
+        self.deduplicator = deduplicator
+        self.metrics = metrics
+        # Questions are deduplicated across all iterations and windows of a group, or across the whole run.
+        dedup_scope = config.get("global", {}).get("dedup", {}).get("scope", "group")
+        self.dedup_scope = "" if dedup_scope == "run" else group_config.get("source_group", group_name)
+        # Distinct per iteration (and optionally per user-chosen salt) so repeated
+        # iterations of a group do not all share one response cache entry.
+        self.cache_salt = f"{group_config.get('cache_salt', '')}:{group_config.get('iteration', 1)}"
 
         # Extract configuration sections
         self.file_headers = config.get("FileHeaders", [])
@@ -47,13 +67,6 @@ class FileGroupProcessor:
         self.answer_instruction_lists = config.get("AnswerInstructionList", [])
         self.generate_question_lists = config.get("GenerateQuestionLists", [])
 
-        # Prepare output directories
-        self.questions_dir = self.output_base_path / "qa_generation_output" / "questions"
-        self.answers_dir = self.output_base_path / "qa_generation_output" / "answers"
-        self.debug_dir = self.output_base_path / "qa_generation_output" / "debug"
-        for d in [self.questions_dir, self.answers_dir, self.debug_dir]:
-            d.mkdir(parents=True, exist_ok=True)
-
     def resolve_templates(self) -> bool:
         file_header_name = self.group_config.get("file_header", "")
         file_header_obj = Utils.get_item_by_name(self.file_headers, file_header_name)
@@ -72,6 +85,15 @@ class FileGroupProcessor:
             Utils.logger.error(f"No answer prompt found for name '{answer_prompt_name}'.")
             return False
         self.answer_prompt_template = answer_prompt_obj["description"]
+
+        # Providers cache prompt prefixes (Ollama's KV cache, OpenAI prompt caching), which only
+        # helps when the large shared file content comes first.
+        for template_name, template in ((question_prompt_name, self.question_prompt_template), (answer_prompt_name, self.answer_prompt_template)):
+            if not template.lstrip().startswith("{file_content}") and template_name not in FileGroupProcessor._warned_templates:
+                FileGroupProcessor._warned_templates.add(template_name)
+                Utils.logger.warning(
+                    f"Prompt '{template_name}' does not start with {{file_content}}; provider prompt caching will rarely hit."
+                )
         return True
 
     def collect_instructions_and_seeds(self):
@@ -102,139 +124,198 @@ class FileGroupProcessor:
     def generate_file_content(self, file_list: List[str], for_questions: bool = True) -> str:
         return self.file_manager.build_files_content(file_list, self.file_header_template)
 
-    def generate_question_task(
-        self, q_seed_idx: int, instr_idx: int, seed_text: str, instruction: str, combined_content: str, file_list: List[str]
-    ) -> Optional[str]:
+    def for_window(self, window_idx: int, file_list: List[str]) -> "FileGroupProcessor":
+        """Returns a copy of this processor for one content window, stored under its own group name."""
+        window = copy.copy(self)
+        window.group_name = f"{self.group_name}_part{window_idx}"
+        window.file_list = file_list
+        return window
+
+    def prepare(self) -> List[Tuple["FileGroupProcessor", str]]:
+        """
+        Resolves templates, instructions and seeds. Returns (processor, combined file content)
+        for each content window of the group, or an empty list to skip the group.
+        """
+        if not self.resolve_templates():
+            return []
+        self.collect_instructions_and_seeds()
+        self.file_list = self.group_config.get("files", [])
+        if not self.all_question_seeds or not self.all_question_instructions:
+            Utils.logger.warning(f"[Group: {self.group_name}] No question seeds or instructions found.")
+            return []
+        global_config = self.config.get("global", {})
+        max_tokens = self.group_config.get("max_content_tokens", global_config.get("max_content_tokens"))
+        if not max_tokens:
+            # Build file content once; FileManager memoizes it across groups and iterations.
+            return [(self, self.generate_file_content(self.file_list))]
+
+        counter = TokenCounter.get(global_config.get("tokenizer", "cl100k_base"))
+        # By default a tenth of the window is repeated, so text cut at a window edge keeps some context.
+        overlap_tokens = self.group_config.get("content_overlap_tokens", global_config.get("content_overlap_tokens", int(max_tokens) // 10))
+        windows = self.file_manager.build_content_windows(
+            self.file_list, self.file_header_template, int(max_tokens), int(overlap_tokens), counter
+        )
+        if len(windows) == 1:
+            return [(self, windows[0][0])]
+        Utils.logger.info(f"[Group: {self.group_name}] Content exceeds {max_tokens} tokens; processing {len(windows)} windows.")
+        return [(self.for_window(i, file_list), content) for i, (content, file_list) in enumerate(windows, start=1)]
+
+    def question_tasks(self):
+        for q_seed_idx, seed_text in enumerate(self.all_question_seeds, start=1):
+            for instr_idx, instruction in enumerate(self.all_question_instructions, start=1):
+                yield q_seed_idx, instr_idx, seed_text, instruction
+
+    def build_question_prompt(self, seed_text: str, instruction: str, combined_content: str, file_list: List[str]) -> str:
         file_name_list_str = ", ".join(file_list)
-        final_prompt = self.question_prompt_template.format(
+        return self.question_prompt_template.format(
             file_content=combined_content,
             generate_question=seed_text,
             instruction=instruction,
             file_name_list=file_name_list_str
         )
-        out_filename = f"questions_{self.group_name}_seed{q_seed_idx}_instr{instr_idx}.txt"
-        debug_filename = f"debug_{self.group_name}_seed{q_seed_idx}_instr{instr_idx}_questions.txt"
-        questions_path = self.questions_dir / out_filename
-        debug_path = self.debug_dir / debug_filename
-
-        if questions_path.exists():
-            question_text = self.file_manager.read_text(questions_path).strip()
-            Utils.logger.info(f"[Group: {self.group_name}] Using existing questions file: {out_filename}")
-        else:
-            question_text = self.question_api_client.call_api(final_prompt)
-            if not question_text:
-                Utils.logger.error(f"[Group: {self.group_name}] Failed to generate questions (seed={q_seed_idx}, instr={instr_idx}).")
-                return None
-            self.file_manager.write_text(questions_path, question_text)
-            self.file_manager.write_text(debug_path, final_prompt)
+
+    def question_key(self, q_seed_idx: int, instr_idx: int) -> Tuple[str, int, int]:
+        return (self.group_name, q_seed_idx, instr_idx)
+
+    def read_existing_questions(self, q_seed_idx: int, instr_idx: int) -> Optional[str]:
+        question_text = self.result_store.get_questions(self.question_key(q_seed_idx, instr_idx))
+        if question_text is not None:
+            Utils.logger.info(f"[Group: {self.group_name}] Using existing questions (seed={q_seed_idx}, instr={instr_idx}).")
         return question_text
 
-    def generate_answer(
-        self, q_seed_idx: int, instr_idx: int, question_number: int, question_text: str,
-        answer_instruction: str, combined_content: str
-    ):
-        final_prompt = self.answer_prompt_template.format(
+    def record_task(self, stage: str, outcome: str) -> None:
+        if self.metrics:
+            self.metrics.inc("qa_tasks_total", stage=stage, outcome=outcome)
+
+    def save_questions(self, q_seed_idx: int, instr_idx: int, question_text: str, final_prompt: str) -> None:
+        start = time.monotonic()
+        self.result_store.put_questions(self.question_key(q_seed_idx, instr_idx), question_text, final_prompt)
+        if self.metrics:
+            self.metrics.observe("qa_store_write_seconds", time.monotonic() - start, stage="question")
+
+    async def generate_question_task(
+        self, q_seed_idx: int, instr_idx: int, seed_text: str, instruction: str, combined_content: str, file_list: List[str]
+    ) -> Optional[str]:
+        # Store reads may wait on other workers' locks, so they run off the event loop.
+        question_text = await asyncio.to_thread(self.read_existing_questions, q_seed_idx, instr_idx)
+        if question_text is not None:
+            self.record_task("question", "skipped")
+            return question_text
+        final_prompt = self.build_question_prompt(seed_text, instruction, combined_content, file_list)
+        question_text = await self.question_api_client.acall_api(final_prompt, self.cache_salt)
+        if not question_text:
+            Utils.logger.error(f"[Group: {self.group_name}] Failed to generate questions (seed={q_seed_idx}, instr={instr_idx}).")
+            self.record_task("question", "failed")
+            return None
+        self.save_questions(q_seed_idx, instr_idx, question_text, final_prompt)
+        self.record_task("question", "generated")
+        return question_text
+
+    def unique_questions(self, text_block: str) -> List[Tuple[int, str]]:
+        """Parses a question block into (question number, question), leaving out near-duplicates of earlier questions."""
+        questions = []
+        for q_num, q_text in enumerate(TextParser.parse_questions(text_block), start=1):
+            if self.deduplicator and not self.deduplicator.add_if_new(self.dedup_scope, q_text, len(self.all_answer_instructions)):
+                Utils.logger.debug(f"[Group: {self.group_name}] Skipping near-duplicate question: {q_text}")
+                continue
+            questions.append((q_num, q_text))
+        return questions
+
+    def build_answer_prompt(self, question_text: str, answer_instruction: str, combined_content: str) -> str:
+        return self.answer_prompt_template.format(
             file_content=combined_content,
             instruction=answer_instruction,
             question=question_text
         )
-        ans_instr_hash = Utils.get_hash(answer_instruction)[:8]
-        answer_filename = f"answer_{self.group_name}_seed{q_seed_idx}_instr{instr_idx}_q{question_number}_{ans_instr_hash}.txt"
-        debug_filename = f"debug_{self.group_name}_answer_seed{q_seed_idx}_instr{instr_idx}_q{question_number}_{ans_instr_hash}.txt"
-        meta_filename = f"answer_{self.group_name}_seed{q_seed_idx}_instr{instr_idx}_q{question_number}_{ans_instr_hash}.meta"
 
-        answer_file_path = self.answers_dir / answer_filename
-        answer_debug_path = self.debug_dir / debug_filename
-        meta_file_path = self.answers_dir / meta_filename
+    def answer_key(self, q_seed_idx: int, instr_idx: int, question_number: int, answer_instruction: str) -> Tuple[str, int, int, int, str]:
+        return (self.group_name, q_seed_idx, instr_idx, question_number, Utils.get_hash(answer_instruction)[:8])
 
+    def answer_is_current(self, q_seed_idx: int, instr_idx: int, question_number: int, answer_instruction: str, final_prompt: str) -> bool:
         current_hash = Utils.get_hash(final_prompt)
-        regenerate = True
-        if answer_file_path.exists():
-            if meta_file_path.exists():
-                stored_hash = self.file_manager.read_text(meta_file_path).strip()
-                if stored_hash == current_hash:
-                    Utils.logger.info(
-                        f"[Group: {self.group_name}] Answer for (seed={q_seed_idx}, instr={instr_idx}, q={question_number}) is up to date."
-                    )
-                    regenerate = False
-                else:
-                    Utils.logger.info(f"[Group: {self.group_name}] Changed prompt detected, regenerating answer.")
-            else:
-                self.file_manager.write_text(meta_file_path, current_hash)
-                regenerate = False
-
-        if not regenerate:
-            return
-
-        answer_text = self.answer_api_client.call_api(final_prompt)
-        if not answer_text:
-            Utils.logger.error(
-                f"[Group: {self.group_name}] Failed to generate answer for (seed={q_seed_idx}, instr={instr_idx}, q={question_number})."
+        stored_hash = self.result_store.answer_hash(self.answer_key(q_seed_idx, instr_idx, question_number, answer_instruction), current_hash)
+        if stored_hash is None:
+            return False
+        if stored_hash == current_hash:
+            Utils.logger.info(
+                f"[Group: {self.group_name}] Answer for (seed={q_seed_idx}, instr={instr_idx}, q={question_number}) is up to date."
             )
-            return
-        self.file_manager.write_text(answer_file_path, answer_text)
-        self.file_manager.write_text(answer_debug_path, final_prompt)
-        self.file_manager.write_text(meta_file_path, current_hash)
-        Utils.logger.info(f"[Group: {self.group_name}] Saved answer -> {answer_file_path}")
+            return True
+        Utils.logger.info(f"[Group: {self.group_name}] Changed prompt detected, regenerating answer.")
+        return False
 
-    def process(self):
-        if not self.resolve_templates():
-            return
-        self.collect_instructions_and_seeds()
-        file_list = self.group_config.get("files", [])
-        if not self.all_question_seeds or not self.all_question_instructions:
-            Utils.logger.warning(f"[Group: {self.group_name}] No question seeds or instructions found.")
-            return
+    def save_answer(
+        self, q_seed_idx: int, instr_idx: int, question_number: int, answer_instruction: str, answer_text: str, final_prompt: str
+    ) -> None:
+        start = time.monotonic()
+        self.result_store.put_answer(
+            self.answer_key(q_seed_idx, instr_idx, question_number, answer_instruction),
+            answer_text, final_prompt, Utils.get_hash(final_prompt)
+        )
+        if self.metrics:
+            self.metrics.observe("qa_store_write_seconds", time.monotonic() - start, stage="answer")
+        Utils.logger.info(f"[Group: {self.group_name}] Saved answer (seed={q_seed_idx}, instr={instr_idx}, q={question_number}).")
 
-        # Build file content (could be slightly different for questions/answers)
-        combined_content_questions = self.generate_file_content(file_list, for_questions=True)
-        combined_content_answers = self.generate_file_content(file_list, for_questions=False)
+    async def generate_answer(
+        self, q_seed_idx: int, instr_idx: int, question_number: int, question_text: str,
+        answer_instruction: str, combined_content: str
+    ) -> bool:
+        final_prompt = self.build_answer_prompt(question_text, answer_instruction, combined_content)
+        if await asyncio.to_thread(self.answer_is_current, q_seed_idx, instr_idx, question_number, answer_instruction, final_prompt):
+            self.record_task("answer", "skipped")
+            return True
 
-        # --- Question Generation ---
-        question_tasks = []
-        question_collections = {}  # (q_seed_idx, instr_idx) -> List[str]
-        for q_seed_idx, seed_text in enumerate(self.all_question_seeds, start=1):
-            for instr_idx, instruction in enumerate(self.all_question_instructions, start=1):
-                question_tasks.append((q_seed_idx, instr_idx, seed_text, instruction))
+        answer_text = await self.answer_api_client.acall_api(final_prompt, self.cache_salt)
+        if not answer_text:
+            Utils.logger.error(
+                f"[Group: {self.group_name}] Failed to generate answer for (seed={q_seed_idx}, instr={instr_idx}, q={question_number})."
+            )
+            self.record_task("answer", "failed")
+            return False
+        self.save_answer(q_seed_idx, instr_idx, question_number, answer_instruction, answer_text, final_prompt)
+        self.record_task("answer", "generated")
+        return True
 
-        def handle_question(task):
-            q_seed_idx, instr_idx, seed_text, instruction = task
-            text_block = self.generate_question_task(q_seed_idx, instr_idx, seed_text, instruction, combined_content_questions, file_list)
+    async def run_question_block(
+        self, combined_content: str, prefix_key: str, q_seed_idx: int, instr_idx: int, seed_text: str, instruction: str,
+        turn: Optional[DedupTurn] = None
+    ) -> bool:
+        """
+        Generates (or reads) one question block and answers it. Answer tasks stream into the
+        queue as soon as the block is parsed, so answers start while other question calls
+        are still running. turn (from DedupTurns) makes the block deduplicate after the blocks
+        before it, whatever order the question calls finish in. Returns False if the questions
+        or any answer failed.
+        """
+        try:
+            text_block = await self.scheduler.run(
+                self.question_api_client, TaskScheduler.QUESTION, prefix_key, self.generate_question_task,
+                q_seed_idx, instr_idx, seed_text, instruction, combined_content, self.file_list
+            )
             if not text_block:
-                return (q_seed_idx, instr_idx, [])
-            parsed = TextParser.parse_questions(text_block)
-            return (q_seed_idx, instr_idx, parsed)
-
-        inner_workers = self.thread_count if self.thread_count > 1 else 1
-        if inner_workers > 1:
-            with ThreadPoolExecutor(max_workers=inner_workers) as pool:
-                futures = {pool.submit(handle_question, t): t for t in question_tasks}
-                for f in as_completed(futures):
-                    q_seed_idx, instr_idx, q_list = f.result()
-                    question_collections[(q_seed_idx, instr_idx)] = q_list
-        else:
-            for t in question_tasks:
-                q_seed_idx, instr_idx, q_list = handle_question(t)
-                question_collections[(q_seed_idx, instr_idx)] = q_list
-
-        # --- Answer Generation ---
-        answer_tasks = []
-        for (q_seed_idx, instr_idx), q_list in question_collections.items():
-            if not q_list:
-                continue
-            for q_num, q_text in enumerate(q_list, start=1):
-                for answer_instruction in self.all_answer_instructions:
-                    answer_tasks.append((q_seed_idx, instr_idx, q_num, q_text, answer_instruction))
-
-        def handle_answer(task):
-            q_seed_idx, instr_idx, q_num, q_text, answer_instruction = task
-            self.generate_answer(q_seed_idx, instr_idx, q_num, q_text, answer_instruction, combined_content_answers)
-
-        if inner_workers > 1:
-            with ThreadPoolExecutor(max_workers=inner_workers) as pool:
-                futures = [pool.submit(handle_answer, t) for t in answer_tasks]
-                for f in as_completed(futures):
-                    f.result()
-        else:
-            for t in answer_tasks:
-                handle_answer(t)
\ No newline at end of file
+                return False
+            if turn is not None:
+                await turn.wait()
+            questions = self.unique_questions(text_block)
+        finally:
+            # Also on failure or cancellation, so later blocks are not held up.
+            if turn is not None:
+                turn.end()
+        answer_futures = []
+        for q_num, q_text in questions:
+            for answer_instruction in self.all_answer_instructions:
+                answer_futures.append(await self.scheduler.submit(
+                    self.answer_api_client, TaskScheduler.ANSWER, prefix_key, self.generate_answer,
+                    q_seed_idx, instr_idx, q_num, q_text, answer_instruction, combined_content
+                ))
+        return all(await asyncio.gather(*answer_futures))
+
+    def work_item_id(self, prefix_key: str, q_seed_idx: int, instr_idx: int, seed_text: str, instruction: str) -> str:
+        """
+        Names one question block (with its answers) in the shared work queue. The fingerprint
+        changes with the content, prompts and instructions, so edited inputs become new items.
+        """
+        fingerprint = Utils.get_hash("\n".join([
+            prefix_key, seed_text, instruction, self.question_prompt_template, self.answer_prompt_template, *self.all_answer_instructions
+        ]))[:12]
+        return f"{self.group_name}/seed{q_seed_idx}/instr{instr_idx}/{fingerprint}"
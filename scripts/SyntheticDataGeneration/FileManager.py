@@ -2,29 +2,102 @@ import os
 import re
 import yaml
 import argparse
-import requests
+import threading
 import hashlib
 import logging
 import random
 import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Tuple
+from SyntheticDataGeneration.TokenCounter import TokenCounter
 from SyntheticDataGeneration.Utils import Utils
 
 class FileManager:
-    def __init__(self, base_dir: Path):
+    def __init__(self, base_dir: Path, watch_mtime: bool = False, mtime_check_interval: float = 5.0):
         self.base_dir = base_dir
+        # Filename -> candidate paths, built once on the first lookup that misses the direct path.
+        self.watch_mtime = watch_mtime
+        self.mtime_check_interval = mtime_check_interval
+        self._index: Optional[Dict[str, List[Path]]] = None
+        self._dir_mtimes: Dict[str, float] = {}
+        self._last_mtime_check = 0.0
+        self._index_lock = threading.Lock()
+        self._reported_ambiguous = set()
+        # (header template, file list) -> (file stamps, combined content), shared by all groups and iterations.
+        self._content_cache: Dict[Tuple[str, Tuple[str, ...]], Tuple[Tuple, str]] = {}
+        self._content_lock = threading.Lock()
+        # (header template, file list, budget, overlap, tokenizer) -> (combined content, windows).
+        self._window_cache: Dict[Tuple, Tuple[str, List[Tuple[str, List[str]]]]] = {}
+        # Memo key -> lock held while that entry is built, so concurrent callers build it once.
+        self._build_locks: Dict[Tuple, threading.Lock] = {}
+
+    def _build_index(self) -> None:
+        index: Dict[str, List[Path]] = {}
+        dir_mtimes: Dict[str, float] = {}
+        for root, _, files in os.walk(self.base_dir):
+            try:
+                dir_mtimes[root] = os.stat(root).st_mtime
+            except OSError:
+                continue
+            for name in files:
+                index.setdefault(name, []).append(Path(root) / name)
+        for paths in index.values():
+            paths.sort()
+        self._index = index
+        self._dir_mtimes = dir_mtimes
+        self._last_mtime_check = time.monotonic()
+        Utils.logger.info(f"Indexed {sum(len(p) for p in index.values())} files under {self.base_dir}.")
+
+    def _index_is_stale(self) -> bool:
+        # Adding or removing a file changes its directory's mtime, so statting directories is enough.
+        now = time.monotonic()
+        if now - self._last_mtime_check < self.mtime_check_interval:
+            return False
+        self._last_mtime_check = now
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def invalidate_index(self) -> None:
+        with self._index_lock:
+            self._index = None
+
+    def _lookup(self, name: str) -> List[Path]:
+        with self._index_lock:
+            if self._index is None or (self.watch_mtime and self._index_is_stale()):
+                self._build_index()
+            return self._index.get(name, [])
 
     def find_file(self, relative_path: str) -> Optional[Path]:
         possible_path = self.base_dir / relative_path
         if possible_path.exists():
             return possible_path
-        target_name = Path(relative_path).name
-        for path in self.base_dir.rglob(target_name):
-            if path.is_file():
-                return path
-        return None
+        candidates = self._lookup(Path(relative_path).name)
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        # Prefer candidates whose trailing path components match the requested path.
+        suffix_parts = Path(relative_path).parts
+        matches = [p for p in candidates if p.parts[-len(suffix_parts):] == suffix_parts] or candidates
+        if len(matches) > 1 and self._first_ambiguity_report(relative_path):
+            Utils.logger.warning(
+                f"Ambiguous file '{relative_path}': {len(matches)} matches under {self.base_dir} "
+                f"({', '.join(str(p.relative_to(self.base_dir)) for p in matches)}). Using {matches[0]}."
+            )
+        return matches[0]
+
+    def _first_ambiguity_report(self, relative_path: str) -> bool:
+        # Checked and recorded under the index lock, so that concurrent lookups warn only once.
+        with self._index_lock:
+            if relative_path in self._reported_ambiguous:
+                return False
+            self._reported_ambiguous.add(relative_path)
+            return True
 
     def read_text(self, file_path: Path) -> str:
         return file_path.read_text(encoding="utf-8")
@@ -33,14 +106,119 @@ class FileManager:
         file_path.parent.mkdir(parents=True, exist_ok=True)
         file_path.write_text(text, encoding="utf-8")
 
+    @staticmethod
+    def _stamp(file_path: Optional[Path]) -> Tuple:
+        try:
+            stat = file_path.stat()
+            return (str(file_path), stat.st_mtime_ns, stat.st_size)
+        except (AttributeError, OSError):
+            return (None, None, None)
+
+    def _build_lock(self, key: Tuple) -> threading.Lock:
+        with self._content_lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
     def build_files_content(self, file_list: List[str], file_header_template: str) -> str:
-        combined = ""
-        for rel_path in file_list:
-            file_path = self.find_file(rel_path)
-            if file_path and file_path.exists():
-                content = self.read_text(file_path)
-                combined += file_header_template.format(file_name=rel_path) + "\n"
-                combined += content + "\n\n"
+        """
+        Returns the headers and contents of file_list concatenated. The result is
+        memoized on the file list, header template and file mtimes, so every caller
+        with the same inputs gets the same string object until a file changes.
+        """
+        key = (file_header_template, tuple(file_list))
+        resolved = [(rel_path, self.find_file(rel_path)) for rel_path in file_list]
+        stamps = tuple(self._stamp(file_path) for _, file_path in resolved)
+        with self._content_lock:
+            cached = self._content_cache.get(key)
+        if cached is not None and cached[0] == stamps:
+            return cached[1]
+
+        with self._build_lock(key):
+            # Another caller may have built it while this one waited.
+            with self._content_lock:
+                cached = self._content_cache.get(key)
+            if cached is not None and cached[0] == stamps:
+                return cached[1]
+            parts = []
+            for rel_path, file_path in resolved:
+                if file_path and file_path.exists():
+                    parts.append(file_header_template.format(file_name=rel_path))
+                    parts.append("\n")
+                    parts.append(self.read_text(file_path))
+                    parts.append("\n\n")
+                else:
+                    Utils.logger.warning(f"{rel_path} not found in {self.base_dir} or its subdirectories.")
+            combined = "".join(parts)
+            with self._content_lock:
+                self._content_cache[key] = (stamps, combined)
+        return combined
+
+    def build_content_windows(
+        self, file_list: List[str], file_header_template: str, max_tokens: int, overlap_tokens: int, counter: TokenCounter
+    ) -> List[Tuple[str, List[str]]]:
+        """
+        Splits the combined content of file_list into windows of at most max_tokens,
+        returned as (content, file names) pairs. Whole files are packed together while
+        they fit; a file larger than the budget is cut into windows overlapping by
+        overlap_tokens (at most half a window), each starting with the file header.
+        Windows of whole files do not overlap: they only break between files, so no
+        text is cut, and repeating part of a neighbouring file would add a fragment
+        without its context.
+        """
+        combined = self.build_files_content(file_list, file_header_template)
+        key = (file_header_template, tuple(file_list), max_tokens, overlap_tokens, counter.name)
+        with self._content_lock:
+            cached = self._window_cache.get(key)
+        # build_files_content returns the same object until a file changes.
+        if cached is not None and cached[0] is combined:
+            return cached[1]
+
+        with self._build_lock(key):
+            with self._content_lock:
+                cached = self._window_cache.get(key)
+            if cached is not None and cached[0] is combined:
+                return cached[1]
+            if counter.count(combined) <= max_tokens:
+                windows = [(combined, list(file_list))]
             else:
-                Utils.logger.warning(f"{rel_path} not found in {self.base_dir} or its subdirectories.")
-        return combined
\ No newline at end of file
+                windows = []
+                parts: List[str] = []
+                names: List[str] = []
+                used = 0
+
+                def flush():
+                    nonlocal parts, names, used
+                    if parts:
+                        windows.append(("".join(parts), names))
+                    parts, names, used = [], [], 0
+
+                for rel_path in file_list:
+                    file_path = self.find_file(rel_path)
+                    if not file_path or not file_path.exists():
+                        continue
+                    header = file_header_template.format(file_name=rel_path) + "\n"
+                    body = self.read_text(file_path)
+                    block_tokens = counter.count(header + body + "\n\n")
+                    if block_tokens <= max_tokens:
+                        if used + block_tokens > max_tokens:
+                            flush()
+                        parts.extend([header, body, "\n\n"])
+                        names.append(rel_path)
+                        used += block_tokens
+                        continue
+
+                    flush()
+                    body_budget = max(max_tokens - counter.count(header) - 1, 1)
+                    step = max(body_budget - min(overlap_tokens, body_budget // 2), 1)
+                    offsets = counter.token_offsets(body)
+                    for start in range(0, len(offsets), step):
+                        end = start + body_budget
+                        chunk = body[offsets[start]:offsets[end]] if end < len(offsets) else body[offsets[start]:]
+                        windows.append((header + chunk + "\n\n", [rel_path]))
+                        if end >= len(offsets):
+                            break
+                flush()
+                Utils.logger.info(f"Split {len(file_list)} files into {len(windows)} windows of at most {max_tokens} tokens.")
+
+            with self._content_lock:
+                self._window_cache[key] = (combined, windows)
+        return windows
@@ -0,0 +1,195 @@
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple, Callable, Iterable
+
+from SyntheticDataGeneration.Utils import Utils
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Metrics:
+    """
+    Counters, gauges and histograms for a generation run. They can be scraped
+    in Prometheus text format over HTTP while the run is going, and are written
+    as a JSON summary when it ends.
+
+    Gauges are read on demand from sources registered with add_gauge_source,
+    which return (name, labels, value) tuples.
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+    # Histograms measuring something much faster than a provider call.
+    BUCKETS = {
+        "qa_store_write_seconds": (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+    }
+
+    HELP = {
+        "qa_api_request_seconds": ("histogram", "Latency of individual provider requests, including failed attempts."),
+        "qa_api_errors_total": ("counter", "Failed provider requests by HTTP status (or error type)."),
+        "qa_api_retries_total": ("counter", "Provider requests retried after an error."),
+        "qa_api_failures_total": ("counter", "Calls that failed after exhausting their retries."),
+        "qa_prompt_tokens_total": ("counter", "Prompt tokens reported by the provider."),
+        "qa_completion_tokens_total": ("counter", "Completion tokens reported by the provider."),
+        "qa_response_cache_hits_total": ("counter", "Calls answered from the response cache."),
+        "qa_tasks_total": ("counter", "Question and answer tasks by outcome: generated, skipped (existing output is current) or failed."),
+        "qa_store_write_seconds": ("histogram", "Time spent saving results to the result store."),
+        "qa_queue_depth": ("gauge", "Tasks waiting in the scheduler queue."),
+        "qa_in_flight": ("gauge", "Tasks currently running."),
+    }
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> ([bucket counts..., +Inf count], [sum])
+        self.histograms: Dict[Tuple[str, Labels], Tuple[List[int], List[float]]] = {}
+        self.gauge_sources: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = (name, self._labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, self._labels(labels))
+        bounds = self.BUCKETS.get(name, self.LATENCY_BUCKETS)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = ([0] * (len(bounds) + 1), [0.0])
+            counts, total = self.histograms[key]
+            counts[bisect.bisect_left(bounds, value)] += 1
+            total[0] += value
+
+    def add_gauge_source(self, source: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]) -> None:
+        self.gauge_sources.append(source)
+
+    def _gauges(self) -> List[Tuple[str, Labels, float]]:
+        gauges = []
+        for source in self.gauge_sources:
+            for name, labels, value in source():
+                gauges.append((name, self._labels(labels), value))
+        return gauges
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ""
+        escaped = []
+        for k, v in items:
+            v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{k}="{v}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(counts), total[0]) for key, (counts, total) in self.histograms.items()}
+        samples: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(counters.items()):
+            samples.setdefault(name, []).append(f"{name}{self._format_labels(labels)} {value:g}")
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS.get(name, self.LATENCY_BUCKETS) + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{self._format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        for name, labels, value in self._gauges():
+            samples.setdefault(name, []).append(f"{name}{self._format_labels(labels)} {value:g}")
+
+        out = []
+        for name, lines in samples.items():
+            metric_type, help_text = self.HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {metric_type}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+    @staticmethod
+    def _quantile(bounds: Tuple[float, ...], counts: List[int], q: float) -> Optional[float]:
+        # Linear interpolation inside the bucket, as Prometheus' histogram_quantile does.
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if i == len(bounds):
+                    return bounds[-1]
+                lower = bounds[i - 1] if i else 0.0
+                return lower + (bounds[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return bounds[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns every counter with its rate over the run, histogram quantiles and current gauges."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(counts), total[0]) for key, (counts, total) in self.histograms.items()}
+        result: Dict[str, Any] = {"elapsed_seconds": round(elapsed, 3), "counters": {}, "histograms": {}, "gauges": {}}
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value, "per_second": value / elapsed})
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            count = sum(counts)
+            bounds = self.BUCKETS.get(name, self.LATENCY_BUCKETS)
+            result["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else None,
+                "p50": self._quantile(bounds, counts, 0.5),
+                "p90": self._quantile(bounds, counts, 0.9),
+                "p99": self._quantile(bounds, counts, 0.99),
+            })
+        for name, labels, value in self._gauges():
+            result["gauges"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return result
+
+    def write_summary(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.summary(), indent=2), encoding="utf-8")
+        Utils.logger.info(f"Run metrics written to {path}")
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> None:
+        """Serves render() at /metrics from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True).start()
+        Utils.logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def close(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
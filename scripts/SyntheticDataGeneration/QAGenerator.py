@@ -1,22 +1,29 @@
 import os
+import asyncio
 from pathlib import Path
-from typing import Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Tuple, Iterable, Callable, Optional
 
 from SyntheticDataGeneration.ApiClient import APIClient
+from SyntheticDataGeneration.EndpointPool import EndpointPool
 from SyntheticDataGeneration.FileManager import FileManager
 from SyntheticDataGeneration.FileGroupProcessor import FileGroupProcessor
+from SyntheticDataGeneration.Metrics import Metrics
+from SyntheticDataGeneration.QuestionDeduplicator import QuestionDeduplicator, DedupTurns
+from SyntheticDataGeneration.RateLimiter import RateLimiter
+from SyntheticDataGeneration.ResponseCache import ResponseCache
+from SyntheticDataGeneration.ResultStore import ResultStore
+from SyntheticDataGeneration.TaskScheduler import TaskScheduler
 from SyntheticDataGeneration.Utils import Utils
-
-# Try importing the OpenAI client
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
-    Utils.logger.warning("OpenAI package not installed; openai provider will not work.")
+from SyntheticDataGeneration.WorkQueue import WorkQueue
 
 class QAGeneratorEngine:
-    def __init__(self, config: Dict[str, Any], output_base_path: Path, thread_count: int):
+    def __init__(
+        self, config: Dict[str, Any], output_base_path: Path, thread_count: int, shared_storage: bool = False, read_only: bool = False
+    ):
+        """
+        shared_storage: the output databases may be opened by several hosts at once (worker mode).
+        read_only: the engine only plans and must not create or change any file; the response cache is not opened.
+        """
         self.config = config
         self.output_base_path = output_base_path
         self.thread_count = thread_count
@@ -27,32 +34,83 @@ class QAGeneratorEngine:
         self.global_ollama_url = global_config.get("ollama_url", "http://localhost:11434/api/generate")
         self.file_groups_config = config.get("file_groups", {})
 
+        # Run metrics, optionally served for Prometheus and always summarized at the end.
+        self.metrics_config = global_config.get("metrics", {})
+        self.metrics = Metrics()
+
+        # Opt-in response cache shared by both clients, across groups and runs.
+        cache_config = global_config.get("cache", {})
+        self.response_cache = None
+        if cache_config.get("enabled", False) and not read_only:
+            cache_path = output_base_path / cache_config.get("path", "qa_generation_output/llm_cache.sqlite")
+            self.response_cache = ResponseCache(
+                cache_path, int(cache_config.get("max_size_mb", 1024)) * 1024 * 1024, shared=shared_storage
+            )
+
         # Providers configuration
         question_provider_config = config.get("providers", {}).get("question", {})
         answer_provider_config = config.get("providers", {}).get("answer", {})
 
-        openai_client = None
-        if (question_provider_config.get("provider", "").lower() == "openai" or
-            answer_provider_config.get("provider", "").lower() == "openai"):
-            if OpenAI is None:
-                Utils.logger.error("OpenAI client cannot be initialized because the package is missing.")
-            else:
-                api_key = os.environ.get("OPENAI_API_KEY")
-                openai_client = OpenAI(api_key=api_key)
+        # One limiter per provider, shared by the question and answer clients.
+        rate_limit_config = config.get("rate_limits", {})
+        provider_concurrency: Dict[str, int] = {}
+        for provider_config in (question_provider_config, answer_provider_config):
+            provider = provider_config.get("provider", "").lower()
+            concurrency = provider_config.get("max_concurrency", thread_count)
+            provider_concurrency[provider] = max(provider_concurrency.get(provider, 0), concurrency)
+        rate_limiters = {
+            provider: RateLimiter.from_config(provider, rate_limit_config.get(provider, {}), concurrency)
+            for provider, concurrency in provider_concurrency.items()
+        }
 
+        # Ollama endpoint pools, shared by clients that list the same endpoints so outstanding counts are global.
+        self.endpoint_pools: Dict[Tuple[str, ...], EndpointPool] = {}
+        for provider_config in (question_provider_config, answer_provider_config):
+            endpoints = tuple(provider_config.get("endpoints", []))
+            if endpoints and endpoints not in self.endpoint_pools:
+                self.endpoint_pools[endpoints] = EndpointPool(list(endpoints), probe_interval=global_config.get("endpoint_probe_interval", 15))
+
+        openai_api_key = os.environ.get("OPENAI_API_KEY")
         self.question_api_client = APIClient(
             provider=question_provider_config.get("provider", ""),
             model=question_provider_config.get("model", ""),
             global_ollama_url=self.global_ollama_url,
-            openai_client=openai_client
+            openai_api_key=openai_api_key,
+            max_connections=question_provider_config.get("max_concurrency", thread_count),
+            rate_limiter=rate_limiters[question_provider_config.get("provider", "").lower()],
+            options=question_provider_config.get("options", {}),
+            cache=self.response_cache,
+            openai_base_url=question_provider_config.get("base_url"),
+            endpoint_pool=self.endpoint_pools.get(tuple(question_provider_config.get("endpoints", []))),
+            metrics=self.metrics,
+            max_tokens=question_provider_config.get("max_tokens"),
+            max_questions=question_provider_config.get("max_questions"),
+            stream=question_provider_config.get("stream")
         )
         self.answer_api_client = APIClient(
             provider=answer_provider_config.get("provider", ""),
             model=answer_provider_config.get("model", ""),
             global_ollama_url=self.global_ollama_url,
-            openai_client=openai_client
+            openai_api_key=openai_api_key,
+            max_connections=answer_provider_config.get("max_concurrency", thread_count),
+            rate_limiter=rate_limiters[answer_provider_config.get("provider", "").lower()],
+            options=answer_provider_config.get("options", {}),
+            cache=self.response_cache,
+            openai_base_url=answer_provider_config.get("base_url"),
+            endpoint_pool=self.endpoint_pools.get(tuple(answer_provider_config.get("endpoints", []))),
+            metrics=self.metrics,
+            max_tokens=answer_provider_config.get("max_tokens"),
+            stream=answer_provider_config.get("stream")
+        )
+        self.provider_configs = [question_provider_config, answer_provider_config]
+        self.file_manager = FileManager(self.full_base_dir, watch_mtime=global_config.get("watch_input_changes", False))
+        self.result_store = ResultStore.create(
+            global_config, output_base_path, self.file_manager, shared=shared_storage, read_only=read_only
         )
-        self.file_manager = FileManager(self.full_base_dir)
+        dedup_config = global_config.get("dedup", {})
+        self.deduplicator = None
+        if dedup_config.get("enabled", False):
+            self.deduplicator = QuestionDeduplicator(threshold=dedup_config.get("threshold", 0.8))
 
     def expand_file_groups(self) -> Dict[str, Dict[str, Any]]:
         expanded = {}
@@ -60,28 +118,289 @@ class QAGeneratorEngine:
             iterations = g_config.get("iterations", 1)
             for i in range(1, iterations + 1):
                 key = f"{group_name}_{i}"
-                expanded[key] = g_config
+                expanded[key] = dict(g_config, iteration=i, source_group=group_name)
         return expanded
 
-    def run(self):
+    def run(self, mode: str = "online"):
+        if self.metrics_config.get("port"):
+            self.metrics.serve(int(self.metrics_config["port"]), self.metrics_config.get("host", "0.0.0.0"))
+        summary_path = self.output_base_path / self.metrics_config.get("summary_path", "qa_generation_output/run_metrics.json")
+        try:
+            if mode == "batch":
+                asyncio.run(self.arun_batch())
+            elif mode == "worker":
+                worker_id = WorkQueue.new_worker_id()
+                # Every worker writes its own summary next to the others.
+                summary_path = summary_path.with_name(f"{summary_path.stem}_{worker_id}{summary_path.suffix}")
+                asyncio.run(self.arun_worker(worker_id))
+            else:
+                asyncio.run(self.arun())
+        finally:
+            self.metrics.write_summary(summary_path)
+            self.metrics.close()
+
+    def create_processors(self, scheduler: Optional[TaskScheduler], scratch_dedup: bool = False) -> List[FileGroupProcessor]:
+        """scratch_dedup gives the processors a fresh deduplicator, so that the engine's dedup state is left untouched."""
+        deduplicator = self.deduplicator
+        if scratch_dedup and deduplicator is not None:
+            deduplicator = QuestionDeduplicator(threshold=deduplicator.threshold, num_perm=deduplicator.num_perm)
+        return [
+            FileGroupProcessor(
+                group_name=group_name,
+                group_config=group_conf,
+                config=self.config,
+                full_base_dir=self.full_base_dir,
+                output_base_path=self.output_base_path,
+                question_api_client=self.question_api_client,
+                answer_api_client=self.answer_api_client,
+                scheduler=scheduler,
+                file_manager=self.file_manager,
+                result_store=self.result_store,
+                deduplicator=deduplicator,
+                metrics=self.metrics
+            )
+            for group_name, group_conf in self.expand_file_groups().items()
+        ]
+
+    def create_scheduler(self) -> TaskScheduler:
+        # One cap per provider and model, shared by the question and answer stages of every group.
+        scheduler = TaskScheduler(self.thread_count)
+        for provider_config in self.provider_configs:
+            if "max_concurrency" in provider_config:
+                scheduler.set_limit(provider_config.get("provider", ""), provider_config.get("model", ""), provider_config["max_concurrency"])
+        return scheduler
+
+    async def arun(self):
         expanded_groups = self.expand_file_groups()
         total_groups = len(expanded_groups)
-        Utils.logger.info(f"Starting processing of {total_groups} file groups with up to {self.thread_count} threads...")
-        with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
-            futures = []
-            for group_name, group_conf in expanded_groups.items():
-                processor = FileGroupProcessor(
-                    group_name=group_name,
-                    group_config=group_conf,
-                    config=self.config,
-                    full_base_dir=self.full_base_dir,
-                    output_base_path=self.output_base_path,
-                    question_api_client=self.question_api_client,
-                    answer_api_client=self.answer_api_client,
-                    thread_count=self.thread_count,
-                    file_manager=self.file_manager
+        Utils.logger.info(f"Starting processing of {total_groups} file groups with up to {self.thread_count} requests per provider and model...")
+        scheduler = self.create_scheduler()
+        self.metrics.add_gauge_source(scheduler.gauges)
+        try:
+            prepared = await asyncio.gather(*(asyncio.to_thread(p.prepare) for p in self.create_processors(scheduler)))
+            # Turns are handed out in task order, so which near-duplicate is kept does not depend on timing.
+            turns = DedupTurns() if self.deduplicator else None
+            blocks = []
+            for windows in prepared:
+                for window, content in windows:
+                    # Every prompt of a window starts with the same content, so it is the scheduling affinity key.
+                    prefix_key = Utils.get_hash(content)
+                    for task in window.question_tasks():
+                        turn = turns.next(window.dedup_scope) if turns else None
+                        blocks.append(DedupTurns.start(window.run_question_block(content, prefix_key, *task, turn=turn), turn))
+            await asyncio.gather(*blocks)
+        finally:
+            await scheduler.close()
+            await APIClient.aclose_pools()
+            if self.response_cache:
+                self.response_cache.close()
+            self.result_store.close()
+        if self.response_cache:
+            Utils.logger.info(f"Response cache: {self.response_cache.hits} hits, {self.response_cache.misses} misses.")
+        if self.deduplicator:
+            Utils.logger.info(f"Question dedup: {self.deduplicator.summary()}")
+        for label, api_client in (("Question", self.question_api_client), ("Answer", self.answer_api_client)):
+            Utils.logger.info(f"{label} provider prompt cache: {api_client.prompt_cache_summary()}")
+        for pool in self.endpoint_pools.values():
+            for line in pool.summary():
+                Utils.logger.info(f"Endpoint {line}")
+        Utils.logger.info("All file groups have been processed successfully.")
+
+    async def arun_worker(self, worker_id: str):
+        """
+        Online generation that takes its question blocks from a shared work queue, so any
+        number of worker processes, on any host that mounts the output volume, can share a run.
+        Each item is one question block with all of its answers.
+        """
+        queue_config = self.config.get("global", {}).get("work_queue", {})
+        prefetch = int(queue_config.get("prefetch", self.thread_count))
+        poll_interval = float(queue_config.get("poll_interval", 10))
+        heartbeat_interval = float(queue_config.get("lease_seconds", 300)) / 3
+        scheduler = self.create_scheduler()
+        self.metrics.add_gauge_source(scheduler.gauges)
+
+        items: Dict[str, Tuple[FileGroupProcessor, str, str, Tuple[int, int, str, str]]] = {}
+        for processor in self.create_processors(scheduler):
+            for window, content in await asyncio.to_thread(processor.prepare):
+                prefix_key = Utils.get_hash(content)
+                for task in window.question_tasks():
+                    items[window.work_item_id(prefix_key, *task)] = (window, content, prefix_key, task)
+        # Workers started with the same config and input share a run id and therefore the same items.
+        run_id = Utils.get_hash("\n".join(sorted(items)))[:16]
+        work_queue = await asyncio.to_thread(
+            WorkQueue,
+            self.output_base_path / queue_config.get("path", "qa_generation_output/work_queue.sqlite"),
+            run_id,
+            float(queue_config.get("lease_seconds", 300)),
+            int(queue_config.get("max_attempts", 3)),
+            worker_id
+        )
+        added = await asyncio.to_thread(work_queue.enqueue, list(items))
+        Utils.logger.info(
+            f"Worker {work_queue.worker_id}: {len(items)} question blocks in run {work_queue.run_id} ({added} newly queued)."
+        )
+
+        running: Dict[str, asyncio.Task] = {}
+        # Within this worker, blocks deduplicate in the order they were leased.
+        turns = DedupTurns() if self.deduplicator else None
+        finished = 0
+        last_heartbeat = asyncio.get_running_loop().time()
+        try:
+            while True:
+                if len(running) < prefetch:
+                    for item_id in await asyncio.to_thread(work_queue.lease, prefetch - len(running)):
+                        window, content, prefix_key, task = items[item_id]
+                        turn = turns.next(window.dedup_scope) if turns else None
+                        running[item_id] = DedupTurns.start(window.run_question_block(content, prefix_key, *task, turn=turn), turn)
+                if not running:
+                    if await asyncio.to_thread(work_queue.remaining) == 0:
+                        break
+                    # Other workers hold the rest; wait for them to finish or for their leases to expire.
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+                done, _ = await asyncio.wait(running.values(), timeout=min(poll_interval, heartbeat_interval), return_when=asyncio.FIRST_COMPLETED)
+                for item_id, task in list(running.items()):
+                    if task not in done:
+                        continue
+                    del running[item_id]
+                    succeeded = not task.cancelled() and task.exception() is None and task.result()
+                    if not task.cancelled() and task.exception() is not None:
+                        Utils.logger.error(f"Work queue item {item_id} raised: {task.exception()}")
+                    if not await asyncio.to_thread(work_queue.complete, item_id, bool(succeeded)):
+                        Utils.logger.warning(f"Work queue: lease on {item_id} was lost before it finished.")
+                    finished += 1
+
+                if running and asyncio.get_running_loop().time() - last_heartbeat >= heartbeat_interval:
+                    last_heartbeat = asyncio.get_running_loop().time()
+                    for item_id in await asyncio.to_thread(work_queue.heartbeat, list(running)):
+                        # Another worker took it over; stop so the block is not worked on twice.
+                        Utils.logger.warning(f"Work queue: lost the lease on {item_id}; abandoning it.")
+                        running.pop(item_id).cancel()
+        finally:
+            for task in running.values():
+                task.cancel()
+            await asyncio.gather(*running.values(), return_exceptions=True)
+            await scheduler.close()
+            await APIClient.aclose_pools()
+            if self.response_cache:
+                self.response_cache.close()
+            self.result_store.close()
+            counts = work_queue.counts()
+            work_queue.close()
+        Utils.logger.info(
+            f"Worker {work_queue.worker_id} finished {finished} question blocks. Run {work_queue.run_id}: "
+            f"{counts.get('done', 0)} done, {counts.get('failed', 0)} failed, {counts.get('pending', 0) + counts.get('leased', 0)} remaining."
+        )
+        if self.deduplicator:
+            Utils.logger.info(f"Question dedup (this worker only): {self.deduplicator.summary()}")
+
+    async def _run_batches(self, api_client: APIClient, requests: Iterable[Tuple[str, str, str]], ingest: Callable[[str, str], None]) -> None:
+        """
+        Splits requests into Batch API jobs bounded by request count and payload size,
+        keeps up to max_concurrent_batches of them in flight, and passes every
+        completion to ingest(custom_id, text).
+        """
+        batch_config = self.config.get("batch", {})
+        max_requests = batch_config.get("max_requests", 50000)
+        max_bytes = int(batch_config.get("max_size_mb", 180)) * 1024 * 1024
+        poll_interval = batch_config.get("poll_interval", 30)
+        in_flight = asyncio.Semaphore(batch_config.get("max_concurrent_batches", 4))
+        jobs = []
+
+        async def run_job(chunk: List[Tuple[str, str, str]]):
+            try:
+                results = await api_client.acall_batch(chunk, poll_interval)
+            finally:
+                in_flight.release()
+            for custom_id, text in results.items():
+                ingest(custom_id, text)
+
+        async def submit(chunk: List[Tuple[str, str, str]]):
+            await in_flight.acquire()
+            jobs.append(asyncio.create_task(run_job(chunk)))
+
+        chunk, chunk_bytes = [], 0
+        for request in requests:
+            size = len(request[1].encode("utf-8"))
+            if chunk and (len(chunk) >= max_requests or chunk_bytes + size > max_bytes):
+                await submit(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(request)
+            chunk_bytes += size
+        if chunk:
+            await submit(chunk)
+        await asyncio.gather(*jobs)
+
+    async def arun_batch(self):
+        """Generates all questions through the Batch API, then all answers, saving them to the result store."""
+        processors = []
+        for processor in self.create_processors(scheduler=None):
+            processors.extend(await asyncio.to_thread(processor.prepare))
+        Utils.logger.info(f"Starting batch processing of {len(processors)} file groups and windows...")
+
+        try:
+            # --- Question stage ---
+            question_targets: Dict[str, Tuple[FileGroupProcessor, int, int, str]] = {}
+
+            def question_requests():
+                for processor, combined_content in processors:
+                    for q_seed_idx, instr_idx, seed_text, instruction in processor.question_tasks():
+                        if processor.result_store.get_questions(processor.question_key(q_seed_idx, instr_idx)) is not None:
+                            processor.record_task("question", "skipped")
+                            continue
+                        final_prompt = processor.build_question_prompt(seed_text, instruction, combined_content, processor.file_list)
+                        custom_id = f"q-{len(question_targets)}"
+                        question_targets[custom_id] = (processor, q_seed_idx, instr_idx, final_prompt)
+                        yield custom_id, final_prompt, processor.cache_salt
+
+            def ingest_questions(custom_id: str, text: str):
+                processor, q_seed_idx, instr_idx, final_prompt = question_targets.pop(custom_id)
+                processor.save_questions(q_seed_idx, instr_idx, text, final_prompt)
+                processor.record_task("question", "generated")
+
+            await self._run_batches(self.question_api_client, question_requests(), ingest_questions)
+            for processor, q_seed_idx, instr_idx, _ in question_targets.values():
+                Utils.logger.error(f"[Group: {processor.group_name}] Failed to generate questions (seed={q_seed_idx}, instr={instr_idx}).")
+                processor.record_task("question", "failed")
+
+            # --- Answer stage ---
+            answer_targets: Dict[str, Tuple[FileGroupProcessor, str, int, int, int, str, str]] = {}
+
+            def answer_requests():
+                for processor, combined_content in processors:
+                    for q_seed_idx, instr_idx, _, _ in processor.question_tasks():
+                        text_block = processor.read_existing_questions(q_seed_idx, instr_idx)
+                        if not text_block:
+                            continue
+                        for q_num, q_text in processor.unique_questions(text_block):
+                            for answer_instruction in processor.all_answer_instructions:
+                                final_prompt = processor.build_answer_prompt(q_text, answer_instruction, combined_content)
+                                if processor.answer_is_current(q_seed_idx, instr_idx, q_num, answer_instruction, final_prompt):
+                                    processor.record_task("answer", "skipped")
+                                    continue
+                                custom_id = f"a-{len(answer_targets)}"
+                                # Keep only the task description (the content is shared); the prompt is rebuilt on ingest.
+                                answer_targets[custom_id] = (processor, combined_content, q_seed_idx, instr_idx, q_num, q_text, answer_instruction)
+                                yield custom_id, final_prompt, processor.cache_salt
+
+            def ingest_answers(custom_id: str, text: str):
+                processor, combined_content, q_seed_idx, instr_idx, q_num, q_text, answer_instruction = answer_targets.pop(custom_id)
+                final_prompt = processor.build_answer_prompt(q_text, answer_instruction, combined_content)
+                processor.save_answer(q_seed_idx, instr_idx, q_num, answer_instruction, text, final_prompt)
+                processor.record_task("answer", "generated")
+
+            await self._run_batches(self.answer_api_client, answer_requests(), ingest_answers)
+            for processor, _, q_seed_idx, instr_idx, q_num, _, _ in answer_targets.values():
+                Utils.logger.error(
+                    f"[Group: {processor.group_name}] Failed to generate answer for (seed={q_seed_idx}, instr={instr_idx}, q={q_num})."
                 )
-                futures.append(executor.submit(processor.process))
-            for future in as_completed(futures):
-                future.result()
+                processor.record_task("answer", "failed")
+        finally:
+            await APIClient.aclose_pools()
+            if self.response_cache:
+                self.response_cache.close()
+            self.result_store.close()
+        if self.deduplicator:
+            Utils.logger.info(f"Question dedup: {self.deduplicator.summary()}")
         Utils.logger.info("All file groups have been processed successfully.")
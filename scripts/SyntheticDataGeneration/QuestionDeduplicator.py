@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import random
+import re
+import threading
+from typing import Coroutine, Dict, List, Optional, Tuple
+
+class QuestionDeduplicator:
+    """
+    Drops questions that are near-duplicates of one already kept in the same scope.
+
+    Questions are shingled into word trigrams and summarized with a MinHash
+    signature; LSH banding finds candidates, which count as duplicates when
+    their estimated Jaccard similarity reaches threshold. The first question
+    seen is the one that is kept, so concurrent callers take turns through
+    DedupTurns to make that order deterministic.
+    """
+
+    _MERSENNE_PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        rng = random.Random(seed)
+        self.perms = [(rng.randrange(1, self._MERSENNE_PRIME), rng.randrange(0, self._MERSENNE_PRIME)) for _ in range(num_perm)]
+        self.bands, self.rows = self._band_layout(threshold, num_perm)
+        self.lock = threading.Lock()
+        # (scope, band index, band hash) -> signatures of kept questions in that bucket
+        self.buckets: Dict[Tuple[str, int, int], List[Tuple[int, ...]]] = {}
+        self.checked = 0
+        self.duplicates = 0
+        self.saved_answer_calls = 0
+
+    @staticmethod
+    def _band_layout(threshold: float, num_perm: int) -> Tuple[int, int]:
+        # Choose bands x rows so the LSH S-curve (1/b)^(1/r) sits a little below the threshold, favouring recall.
+        layouts = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+        return min(layouts, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold * 0.85))
+
+    @staticmethod
+    def shingles(text: str) -> set:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < 3:
+            return {" ".join(words)}
+        return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+            for shingle in self.shingles(text)
+        ]
+        prime = self._MERSENNE_PRIME
+        return tuple(min((a * h + b) % prime for h in hashes) for a, b in self.perms)
+
+    def similarity(self, sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+        return sum(x == y for x, y in zip(sig_a, sig_b)) / self.num_perm
+
+    def add_if_new(self, scope: str, text: str, answer_calls: int = 0) -> bool:
+        """
+        Returns True and remembers the question if it is not a near-duplicate within scope.
+        Otherwise returns False and counts answer_calls as saved.
+        """
+        sig = self.signature(text)
+        keys = [
+            (scope, band, hash(sig[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+        with self.lock:
+            self.checked += 1
+            for key in keys:
+                for other in self.buckets.get(key, ()):
+                    if self.similarity(sig, other) >= self.threshold:
+                        self.duplicates += 1
+                        self.saved_answer_calls += answer_calls
+                        return False
+            for key in keys:
+                self.buckets.setdefault(key, []).append(sig)
+            return True
+
+    def summary(self) -> str:
+        return (
+            f"{self.duplicates} of {self.checked} questions were near-duplicates "
+            f"(threshold {self.threshold}); saved {self.saved_answer_calls} answer calls."
+        )
+
+
+class DedupTurn:
+    """
+    One block's place in a scope's deduplication order. A turn counts as done only once it
+    has ended and every earlier turn is done, so a block that ends early (failed, or
+    cancelled before it ran) never lets later blocks overtake the ones before it.
+    """
+
+    def __init__(self, previous: Optional["DedupTurn"]):
+        self.previous = previous
+        self.next: Optional["DedupTurn"] = None
+        self.ended = False
+        self.done = asyncio.Event()
+        if previous is not None:
+            previous.next = self
+
+    async def wait(self) -> None:
+        """Waits until every earlier turn of the scope is done."""
+        if self.previous is not None:
+            await self.previous.done.wait()
+
+    def end(self) -> None:
+        """Ends this turn; safe to call more than once."""
+        self.ended = True
+        turn = self
+        while (turn is not None and turn.ended and not turn.done.is_set()
+               and (turn.previous is None or turn.previous.done.is_set())):
+            turn.done.set()
+            turn.previous = None
+            turn = turn.next
+
+
+class DedupTurns:
+    """
+    Orders deduplication by task order instead of by which question call finishes first.
+    Turns are handed out per scope in the order next() is called; a block waits for the
+    earlier turns of its scope, deduplicates its questions, then ends its own turn.
+    """
+
+    def __init__(self):
+        self.last: Dict[str, DedupTurn] = {}
+
+    def next(self, scope: str) -> DedupTurn:
+        turn = DedupTurn(self.last.get(scope))
+        self.last[scope] = turn
+        return turn
+
+    @staticmethod
+    def start(coro: Coroutine, turn: Optional[DedupTurn]) -> asyncio.Task:
+        """
+        Runs coro as a task that ends turn when it finishes. A task cancelled before it starts never
+        runs the coroutine's own cleanup, and later blocks of the scope would otherwise wait forever.
+        """
+        task = asyncio.create_task(coro)
+        if turn is not None:
+            task.add_done_callback(lambda _: turn.end())
+        return task
+
+
+def check_turns(blocks: int = 20, seed: int = 0, rounds: int = 50) -> None:
+    """
+    Checks that blocks deduplicate in turn order, also when a block is cancelled before it
+    starts or fails before its turn comes.
+    """
+    rng = random.Random(seed)
+
+    async def block(index: int, turn: DedupTurn, order: List[int], fail: bool) -> None:
+        try:
+            await asyncio.sleep(rng.random() / 1000)
+            if fail:
+                return
+            await turn.wait()
+            order.append(index)
+        finally:
+            turn.end()
+
+    async def run() -> None:
+        turns = DedupTurns()
+        order: List[int] = []
+        cancelled, failed = rng.sample(range(blocks), 2)
+        tasks = []
+        for i in range(blocks):
+            turn = turns.next("scope")
+            tasks.append(DedupTurns.start(block(i, turn, order, i == failed), turn))
+        # Cancelled before the event loop ever runs it, like a work queue item whose lease was lost.
+        tasks[cancelled].cancel()
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=10)
+        expected = [i for i in range(blocks) if i not in (cancelled, failed)]
+        if order != expected:
+            raise AssertionError(f"Blocks deduplicated in order {order}, expected {expected}.")
+
+    for _ in range(rounds):
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    check_turns()
+    print("Dedup turn check passed.")
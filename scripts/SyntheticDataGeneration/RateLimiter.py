@@ -0,0 +1,188 @@
+import asyncio
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Mapping
+
+from SyntheticDataGeneration.Utils import Utils
+
+class TokenBucket:
+    """
+    Refills at per_minute / 60 units per second up to capacity. reserve() always
+    succeeds and may leave the bucket in debt; the returned value is how long the
+    caller has to wait for the debt to be repaid. Callers must hold the owner's lock.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def clamp(self, remaining: float, now: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.tokens, remaining)
+
+class RateLimiter:
+    """
+    Per-provider request/token buckets plus an AIMD concurrency limit, shared by
+    every APIClient (and so every worker) that talks to the same provider.
+
+    The concurrency limit grows by roughly one slot per window of successful
+    calls and is halved on 429/503 responses or timeouts. A Retry-After from the
+    provider pauses all callers until it expires; the buckets then pace them back
+    in instead of letting them retry at once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        completion_token_estimate: int = 500,
+        poll_interval: float = 0.05
+    ):
+        self.name = name
+        self.lock = threading.Lock()
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency_limit = float(self.max_concurrency)
+        self.completion_token_estimate = completion_token_estimate
+        self.poll_interval = poll_interval
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+
+    @classmethod
+    def from_config(cls, name: str, config: Mapping, max_concurrency: int) -> "RateLimiter":
+        return cls(
+            name,
+            requests_per_minute=config.get("requests_per_minute"),
+            tokens_per_minute=config.get("tokens_per_minute"),
+            max_concurrency=config.get("max_concurrency", max_concurrency),
+            min_concurrency=config.get("min_concurrency", 1),
+            completion_token_estimate=config.get("completion_token_estimate", 500)
+        )
+
+    def estimate_tokens(self, prompt: str) -> int:
+        # Roughly four characters per token; good enough for pacing.
+        return len(prompt) // 4 + self.completion_token_estimate
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Waits for a concurrency slot, any provider-imposed pause, and bucket capacity."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                pause = self.paused_until - now
+                if pause <= 0 and self.in_flight < int(self.concurrency_limit):
+                    self.in_flight += 1
+                    wait = 0.0
+                    if self.request_bucket:
+                        wait = max(wait, self.request_bucket.reserve(1, now))
+                    if self.token_bucket:
+                        wait = max(wait, self.token_bucket.reserve(estimated_tokens, now))
+                    break
+            await asyncio.sleep(pause if pause > 0 else self.poll_interval)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                # Cancelled before the request went out: give back the slot and the reserved capacity.
+                with self.lock:
+                    now = time.monotonic()
+                    if self.request_bucket:
+                        self.request_bucket.adjust(1, now)
+                self.release(estimated_tokens, actual_tokens=0)
+                raise
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int] = None, headers: Optional[Mapping] = None) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if self.token_bucket and actual_tokens is not None:
+                self.token_bucket.adjust(estimated_tokens - actual_tokens, now)
+            if headers:
+                self._observe_headers(headers, now)
+
+    def on_success(self) -> None:
+        with self.lock:
+            # Additive increase: about +1 slot per limit-sized window of successes.
+            self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1.0 / self.concurrency_limit)
+
+    def on_throttle(self, retry_after: Optional[float], reason: str) -> None:
+        with self.lock:
+            now = time.monotonic()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            # Multiplicative decrease, at most once per cool-down so one burst of 429s counts once.
+            if now - self._last_decrease >= max(1.0, retry_after or 0.0):
+                self.concurrency_limit = max(float(self.min_concurrency), self.concurrency_limit / 2)
+                self._last_decrease = now
+                Utils.logger.warning(
+                    f"[{self.name}] {reason}; concurrency limit reduced to {int(self.concurrency_limit)}"
+                    + (f", pausing {retry_after:.2f}s." if retry_after else ".")
+                )
+
+    def _observe_headers(self, headers: Mapping, now: float) -> None:
+        remaining_requests = _to_float(headers.get("x-ratelimit-remaining-requests"))
+        if self.request_bucket and remaining_requests is not None:
+            self.request_bucket.clamp(remaining_requests, now)
+        remaining_tokens = _to_float(headers.get("x-ratelimit-remaining-tokens"))
+        if self.token_bucket and remaining_tokens is not None:
+            self.token_bucket.clamp(remaining_tokens, now)
+
+    @staticmethod
+    def retry_after_seconds(headers: Optional[Mapping]) -> Optional[float]:
+        """Reads retry-after-ms, Retry-After (seconds or HTTP date) or the x-ratelimit-reset-* durations."""
+        if not headers:
+            return None
+        retry_after_ms = _to_float(headers.get("retry-after-ms"))
+        if retry_after_ms is not None:
+            return retry_after_ms / 1000.0
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            seconds = _to_float(retry_after)
+            if seconds is not None:
+                return seconds
+            try:
+                return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+        resets = [_parse_duration(headers.get(h)) for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+        resets = [r for r in resets if r is not None]
+        return max(resets) if resets else None
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    # OpenAI reset headers look like "1s", "6m0s" or "250ms".
+    if not value:
+        return None
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return _to_float(value)
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(n) * scale[unit] for n, unit in parts)
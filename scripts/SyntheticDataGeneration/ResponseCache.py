@@ -0,0 +1,153 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from SyntheticDataGeneration.Utils import Utils
+
+class ResponseCache:
+    """
+    Content-addressed store of LLM responses in a single SQLite file.
+
+    Entries are keyed by provider, model, generation options, the prompt hash
+    and an optional salt, so the same prompt is answered once no matter which
+    group, iteration or run asks for it. When the stored responses grow past
+    max_bytes the least recently used entries are evicted.
+
+    The total size is kept in the database by triggers, so eviction is right
+    when several processes write to the same file. With shared=True (worker
+    mode) the rollback journal is used instead of WAL, which SQLite does not
+    support for a file that several hosts open on a network filesystem.
+
+    Hits do not write: their access times are kept in memory and written in
+    batches of touch_batch, with the next put, or on close. Coroutines use
+    aget/aput, which run the SQLite calls on a worker thread so that a lock
+    wait never stalls the event loop.
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int = 1024 * 1024 * 1024, shared: bool = False, touch_batch: int = 256):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.lock = threading.Lock()
+        # key -> last access time of hits not yet written to the database
+        self._touched: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path), timeout=60, check_same_thread=False)
+        self.conn.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)")
+        self.conn.execute("INSERT OR IGNORE INTO cache_size VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM responses))")
+        self.conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses "
+            "BEGIN UPDATE cache_size SET bytes = bytes + NEW.size WHERE id = 0; END"
+        )
+        self.conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses "
+            "BEGIN UPDATE cache_size SET bytes = bytes - OLD.size WHERE id = 0; END"
+        )
+        self.conn.commit()
+
+    def total_bytes(self) -> int:
+        return self.conn.execute("SELECT bytes FROM cache_size WHERE id = 0").fetchone()[0]
+
+    @staticmethod
+    def make_key(provider: str, model: str, options: Dict[str, Any], prompt: str, salt: str = "") -> str:
+        return Utils.get_hash(json.dumps(
+            [provider, model, options, Utils.get_hash(prompt), salt],
+            sort_keys=True, ensure_ascii=False
+        ))
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._write_touches()
+            return row[0]
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, response: str) -> None:
+        await asyncio.to_thread(self.put, key, response)
+
+    def _write_touches(self) -> None:
+        """Writes the pending access times in one transaction. Callers must hold self.lock."""
+        if not self._touched:
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._apply_touches()
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def _apply_touches(self) -> None:
+        # Access times are only an eviction hint, so a batch lost to an error is not retried.
+        touched, self._touched = self._touched, {}
+        self.conn.executemany(
+            "UPDATE responses SET last_access = MAX(last_access, ?) WHERE key = ?", [(t, k) for k, t in touched.items()]
+        )
+
+    def put(self, key: str, response: str) -> None:
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            # One write transaction, so the size seen by the eviction includes every other writer's entries.
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Delete and insert rather than INSERT OR REPLACE, whose implicit delete does not fire the size trigger.
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.execute(
+                    "INSERT INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, response, size, time.time())
+                )
+                # Before any eviction, so that recently read entries are not evicted as stale.
+                self._apply_touches()
+                if self.total_bytes() > self.max_bytes:
+                    self._evict()
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def _evict(self) -> None:
+        # Drop least recently used entries until the cache is back under 90% of its budget.
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        total = self.total_bytes()
+        while total > target:
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 1000").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= target:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+            total = self.total_bytes()
+        Utils.logger.info(f"Response cache evicted {evicted} entries ({total} bytes remaining).")
+
+    def close(self) -> None:
+        with self.lock:
+            try:
+                self._write_touches()
+            finally:
+                self.conn.close()
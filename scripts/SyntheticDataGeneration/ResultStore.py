@@ -0,0 +1,283 @@
+import queue
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Tuple, Iterator
+
+from SyntheticDataGeneration.FileManager import FileManager
+from SyntheticDataGeneration.Utils import Utils
+
+# (group_name, q_seed_idx, instr_idx)
+QuestionKey = Tuple[str, int, int]
+# (group_name, q_seed_idx, instr_idx, question_number, answer_instruction_hash)
+AnswerKey = Tuple[str, int, int, int, str]
+
+class ResultStore(ABC):
+    """Where generated questions, answers and their prompts are kept."""
+
+    @abstractmethod
+    def get_questions(self, key: QuestionKey) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def put_questions(self, key: QuestionKey, text: str, prompt: str) -> None:
+        ...
+
+    @abstractmethod
+    def answer_hash(self, key: AnswerKey, current_hash: str) -> Optional[str]:
+        """Returns the prompt hash stored with an answer, or None if the answer does not exist yet."""
+
+    @abstractmethod
+    def put_answer(self, key: AnswerKey, text: str, prompt: str, prompt_hash: str) -> None:
+        ...
+
+    def flush(self) -> None:
+        """Waits until every result written so far is stored."""
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def create(
+        global_config: Dict, output_base_path: Path, file_manager: FileManager, shared: bool = False, read_only: bool = False
+    ) -> "ResultStore":
+        """read_only stores only look results up and never create or change files (used by --plan)."""
+        backend = global_config.get("output_backend", "files")
+        output_dir = output_base_path / "qa_generation_output"
+        if backend == "sqlite":
+            db_path = output_base_path / global_config.get("output_db", "qa_generation_output/results.sqlite")
+            return SqliteResultStore(
+                db_path, store_prompts=global_config.get("store_debug_prompts", True), shared=shared, read_only=read_only
+            )
+        if backend != "files":
+            Utils.logger.warning(f"Unknown output_backend '{backend}'; using files.")
+        return FileResultStore(output_dir, file_manager, read_only=read_only)
+
+class FileResultStore(ResultStore):
+    """The original layout: one file per question block, answer, answer .meta and debug prompt."""
+
+    def __init__(self, output_dir: Path, file_manager: FileManager, read_only: bool = False):
+        self.file_manager = file_manager
+        self.read_only = read_only
+        self.questions_dir = output_dir / "questions"
+        self.answers_dir = output_dir / "answers"
+        self.debug_dir = output_dir / "debug"
+        if not read_only:
+            for d in [self.questions_dir, self.answers_dir, self.debug_dir]:
+                d.mkdir(parents=True, exist_ok=True)
+
+    def question_paths(self, key: QuestionKey) -> Tuple[Path, Path]:
+        group_name, q_seed_idx, instr_idx = key
+        out_filename = f"questions_{group_name}_seed{q_seed_idx}_instr{instr_idx}.txt"
+        debug_filename = f"debug_{group_name}_seed{q_seed_idx}_instr{instr_idx}_questions.txt"
+        return self.questions_dir / out_filename, self.debug_dir / debug_filename
+
+    def answer_paths(self, key: AnswerKey) -> Tuple[Path, Path, Path]:
+        group_name, q_seed_idx, instr_idx, question_number, ans_instr_hash = key
+        stem = f"{group_name}_seed{q_seed_idx}_instr{instr_idx}_q{question_number}_{ans_instr_hash}"
+        return (
+            self.answers_dir / f"answer_{stem}.txt",
+            self.debug_dir / f"debug_{group_name}_answer_seed{q_seed_idx}_instr{instr_idx}_q{question_number}_{ans_instr_hash}.txt",
+            self.answers_dir / f"answer_{stem}.meta",
+        )
+
+    def get_questions(self, key: QuestionKey) -> Optional[str]:
+        questions_path, _ = self.question_paths(key)
+        if not questions_path.exists():
+            return None
+        return self.file_manager.read_text(questions_path).strip()
+
+    def put_questions(self, key: QuestionKey, text: str, prompt: str) -> None:
+        questions_path, debug_path = self.question_paths(key)
+        self.file_manager.write_text(questions_path, text)
+        self.file_manager.write_text(debug_path, prompt)
+
+    def answer_hash(self, key: AnswerKey, current_hash: str) -> Optional[str]:
+        answer_file_path, _, meta_file_path = self.answer_paths(key)
+        if not answer_file_path.exists():
+            return None
+        if not meta_file_path.exists():
+            # Answers written before .meta files existed are treated as current.
+            if not self.read_only:
+                self.file_manager.write_text(meta_file_path, current_hash)
+            return current_hash
+        return self.file_manager.read_text(meta_file_path).strip()
+
+    def put_answer(self, key: AnswerKey, text: str, prompt: str, prompt_hash: str) -> None:
+        answer_file_path, answer_debug_path, meta_file_path = self.answer_paths(key)
+        self.file_manager.write_text(answer_file_path, text)
+        self.file_manager.write_text(answer_debug_path, prompt)
+        self.file_manager.write_text(meta_file_path, prompt_hash)
+
+class SqliteResultStore(ResultStore):
+    """
+    All results in one SQLite file, keyed by (group, seed, instr) for questions
+    and (group, seed, instr, q, answer-instruction hash) for answers.
+
+    Writes are queued to a background thread that commits them in batches;
+    results waiting in the queue are still visible to readers. A failed batch is
+    logged and the writer carries on; the first error is raised again by
+    flush() and close(), so lost results never go unnoticed. Reads can wait on
+    another process's lock, so coroutines call them through asyncio.to_thread.
+    With shared=True (worker mode) the rollback journal is used instead of WAL,
+    which SQLite does not support for a file that several hosts open on a
+    network filesystem.
+    """
+
+    def __init__(self, db_path: Path, store_prompts: bool = True, batch_size: int = 500, flush_interval: float = 0.5,
+                 shared: bool = False, read_only: bool = False):
+        self.db_path = db_path
+        self.store_prompts = store_prompts
+        self.shared = shared
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        if read_only:
+            # Open an existing file without writing to it; a missing file is an empty store.
+            self.conn = sqlite3.connect(
+                f"{db_path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False
+            ) if db_path.exists() else None
+        else:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = self.connect(db_path, shared)
+        self.read_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self._pending_questions: Dict[QuestionKey, str] = {}
+        self._pending_answers: Dict[AnswerKey, str] = {}
+        self._queue: "queue.Queue" = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._writer = threading.Thread(target=self._write_loop, name="ResultStoreWriter", daemon=True)
+        if not read_only:
+            self._writer.start()
+
+    @staticmethod
+    def connect(db_path: Path, shared: bool = False) -> sqlite3.Connection:
+        # A long busy timeout lets several worker processes share the file.
+        conn = sqlite3.connect(str(db_path), timeout=60, check_same_thread=False)
+        conn.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS questions ("
+            "group_name TEXT NOT NULL, seed INTEGER NOT NULL, instr INTEGER NOT NULL, text TEXT NOT NULL, prompt TEXT, "
+            "PRIMARY KEY (group_name, seed, instr)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "group_name TEXT NOT NULL, seed INTEGER NOT NULL, instr INTEGER NOT NULL, q INTEGER NOT NULL, "
+            "answer_instruction_hash TEXT NOT NULL, text TEXT NOT NULL, prompt_hash TEXT NOT NULL, prompt TEXT, "
+            "PRIMARY KEY (group_name, seed, instr, q, answer_instruction_hash)) WITHOUT ROWID"
+        )
+        conn.commit()
+        return conn
+
+    def get_questions(self, key: QuestionKey) -> Optional[str]:
+        with self.pending_lock:
+            if key in self._pending_questions:
+                return self._pending_questions[key]
+        if self.conn is None:
+            return None
+        with self.read_lock:
+            row = self.conn.execute(
+                "SELECT text FROM questions WHERE group_name = ? AND seed = ? AND instr = ?", key
+            ).fetchone()
+        return row[0].strip() if row else None
+
+    def put_questions(self, key: QuestionKey, text: str, prompt: str) -> None:
+        with self.pending_lock:
+            self._pending_questions[key] = text
+        self._queue.put(("questions", key, (text, prompt if self.store_prompts else None)))
+
+    def answer_hash(self, key: AnswerKey, current_hash: str) -> Optional[str]:
+        with self.pending_lock:
+            if key in self._pending_answers:
+                return self._pending_answers[key]
+        if self.conn is None:
+            return None
+        with self.read_lock:
+            row = self.conn.execute(
+                "SELECT prompt_hash FROM answers WHERE group_name = ? AND seed = ? AND instr = ? AND q = ? AND answer_instruction_hash = ?",
+                key
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_answer(self, key: AnswerKey, text: str, prompt: str, prompt_hash: str) -> None:
+        with self.pending_lock:
+            self._pending_answers[key] = prompt_hash
+        self._queue.put(("answers", key, (text, prompt_hash, prompt if self.store_prompts else None)))
+
+    def _write_loop(self) -> None:
+        try:
+            conn = self.connect(self.db_path, self.shared)
+        except Exception as e:
+            Utils.logger.error(f"Result store writer could not open {self.db_path}: {e}")
+            self._error = e
+            return
+        stopping = False
+        while not stopping:
+            # Items are write tuples, flush markers (Events) or None to stop.
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and isinstance(batch[-1], tuple):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            writes = [item for item in batch if isinstance(item, tuple)]
+            try:
+                with conn:
+                    for table, key, values in writes:
+                        if table == "questions":
+                            conn.execute("INSERT OR REPLACE INTO questions VALUES (?, ?, ?, ?, ?)", key + values)
+                        else:
+                            conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)", key + values)
+            except Exception as e:
+                # Keep the failed results readable from memory for the rest of the run.
+                Utils.logger.error(f"Result store failed to write {len(writes)} results to {self.db_path}: {e}")
+                if self._error is None:
+                    self._error = e
+            else:
+                with self.pending_lock:
+                    for table, key, _ in writes:
+                        pending = self._pending_questions if table == "questions" else self._pending_answers
+                        pending.pop(key, None)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+        conn.close()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f"Results could not be written to {self.db_path}.") from self._error
+
+    def flush(self) -> None:
+        """Waits until queued writes are committed; raises if any write failed."""
+        done = threading.Event()
+        self._queue.put(done)
+        while self._writer.is_alive() and not done.wait(1.0):
+            pass
+        self._raise_error()
+
+    def close(self) -> None:
+        """Flushes queued writes and stops the writer thread; raises if any write failed."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        if self.conn is not None:
+            with self.read_lock:
+                self.conn.close()
+        self._raise_error()
+
+    @staticmethod
+    def iter_questions(conn: sqlite3.Connection) -> Iterator[Tuple[str, int, int, str]]:
+        yield from conn.execute("SELECT group_name, seed, instr, text FROM questions ORDER BY group_name, seed, instr")
+
+    @staticmethod
+    def iter_answers(conn: sqlite3.Connection, key: QuestionKey) -> Iterator[Tuple[int, str]]:
+        yield from conn.execute(
+            "SELECT q, text FROM answers WHERE group_name = ? AND seed = ? AND instr = ? ORDER BY q, answer_instruction_hash", key
+        )
@@ -0,0 +1,162 @@
+from typing import Optional, Dict, Any, Tuple
+
+from SyntheticDataGeneration.TaskScheduler import TaskScheduler
+from SyntheticDataGeneration.TokenCounter import TokenCounter
+from SyntheticDataGeneration.Utils import Utils
+
+class RunPlanner:
+    """
+    Predicts the API calls, tokens and wall time of a run without calling a provider.
+    Planning only reads: give it an engine created with read_only=True so that no
+    cache, output directory or .meta file is created.
+
+    Prompt tokens are counted from the real combined file content. Question blocks
+    that already exist in the result store are parsed, and only their stale
+    answers are counted; for missing blocks questions_per_block questions are
+    assumed (by default the average of the existing blocks, or 10).
+
+    Each call is assumed to take latency seconds when given, otherwise
+    base_latency + prompt tokens / prompt_tps + completion tokens / completion_tps.
+    Wall time is the slowest of each provider and model's concurrency and its
+    requests_per_minute / tokens_per_minute limits.
+    """
+
+    def __init__(
+        self,
+        engine,
+        questions_per_block: Optional[float] = None,
+        latency: Optional[float] = None,
+        base_latency: float = 0.5,
+        prompt_tps: float = 2000.0,
+        completion_tps: float = 40.0,
+        question_tokens: int = 200,
+        answer_tokens: int = 400
+    ):
+        self.engine = engine
+        self.questions_per_block = questions_per_block
+        self.latency = latency
+        self.base_latency = base_latency
+        self.prompt_tps = prompt_tps
+        self.completion_tps = completion_tps
+        self.question_tokens = question_tokens
+        self.answer_tokens = answer_tokens
+        self.counter = TokenCounter.get(engine.config.get("global", {}).get("tokenizer", "cl100k_base"))
+        self._content_tokens: Dict[str, int] = {}
+
+    def _call_seconds(self, prompt_tokens: float, completion_tokens: float) -> float:
+        if self.latency is not None:
+            return self.latency
+        return self.base_latency + prompt_tokens / self.prompt_tps + completion_tokens / self.completion_tps
+
+    def _count_content(self, content: str) -> int:
+        if content not in self._content_tokens:
+            self._content_tokens[content] = self.counter.count(content)
+        return self._content_tokens[content]
+
+    def plan(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        engine = self.engine
+        question_key = TaskScheduler.key_for(engine.question_api_client)
+        answer_key = TaskScheduler.key_for(engine.answer_api_client)
+        totals: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for key, api_client in ((question_key, engine.question_api_client), (answer_key, engine.answer_api_client)):
+            totals.setdefault(key, {
+                "question_calls": 0, "answer_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "call_seconds": 0.0, "rate_limiter": api_client.rate_limiter
+            })
+
+        def add(key, stage, calls, prompt_tokens, completion_tokens):
+            entry = totals[key]
+            entry[f"{stage}_calls"] += calls
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["call_seconds"] += calls * self._call_seconds(prompt_tokens / max(calls, 1), completion_tokens / max(calls, 1))
+
+        existing_blocks = existing_questions = 0
+        # Prompt tokens of every answer call of one missing question block, per assumed question.
+        missing_blocks = 0
+        missing_answer_prompt_tokens = 0
+        missing_answer_calls = 0
+
+        # A scratch deduplicator, so planning leaves the engine's dedup state as it was.
+        for processor in engine.create_processors(scheduler=None, scratch_dedup=True):
+            for window, content in processor.prepare():
+                content_tokens = self._count_content(content)
+                answer_overheads = {
+                    instruction: self.counter.count(window.build_answer_prompt("", instruction, ""))
+                    for instruction in window.all_answer_instructions
+                }
+                for q_seed_idx, instr_idx, seed_text, instruction in window.question_tasks():
+                    text_block = window.result_store.get_questions(window.question_key(q_seed_idx, instr_idx))
+                    if text_block is None:
+                        overhead = self.counter.count(window.build_question_prompt(seed_text, instruction, "", window.file_list))
+                        add(question_key, "question", 1, content_tokens + overhead, self.question_tokens)
+                        missing_blocks += 1
+                        missing_answer_calls += len(answer_overheads)
+                        # Assume a question of about 20 tokens.
+                        missing_answer_prompt_tokens += sum(content_tokens + o + 20 for o in answer_overheads.values())
+                        continue
+                    existing_blocks += 1
+                    for q_num, q_text in window.unique_questions(text_block):
+                        existing_questions += 1
+                        for answer_instruction in window.all_answer_instructions:
+                            final_prompt = window.build_answer_prompt(q_text, answer_instruction, content)
+                            stored = window.result_store.answer_hash(
+                                window.answer_key(q_seed_idx, instr_idx, q_num, answer_instruction), Utils.get_hash(final_prompt)
+                            )
+                            if stored == Utils.get_hash(final_prompt):
+                                continue
+                            add(answer_key, "answer", 1, content_tokens + answer_overheads[answer_instruction] + self.counter.count(q_text),
+                                self.answer_tokens)
+
+        questions_per_block = self.questions_per_block
+        if questions_per_block is None:
+            questions_per_block = existing_questions / existing_blocks if existing_blocks else 10
+            if engine.question_api_client.max_questions:
+                questions_per_block = min(questions_per_block, engine.question_api_client.max_questions)
+        self.assumed_questions_per_block = questions_per_block
+        if missing_answer_calls:
+            calls = round(missing_answer_calls * questions_per_block)
+            add(answer_key, "answer", calls, missing_answer_prompt_tokens * questions_per_block, calls * self.answer_tokens)
+
+        concurrency_for = self.engine.create_scheduler()
+        for key, entry in totals.items():
+            concurrency = concurrency_for.limits.get(key, concurrency_for.default_concurrency)
+            entry["concurrency"] = concurrency
+            entry["wall_seconds"] = entry["call_seconds"] / concurrency
+            entry["bound"] = "concurrency"
+
+        # Rate limits are per provider, shared by every model key that uses the same limiter.
+        for limiter in {id(e["rate_limiter"]): e["rate_limiter"] for e in totals.values() if e["rate_limiter"]}.values():
+            entries = [e for e in totals.values() if e["rate_limiter"] is limiter]
+            calls = sum(e["question_calls"] + e["answer_calls"] for e in entries)
+            tokens = sum(e["prompt_tokens"] + e["completion_tokens"] for e in entries)
+            for bucket, amount, bound in ((limiter.request_bucket, calls, "requests_per_minute"), (limiter.token_bucket, tokens, "tokens_per_minute")):
+                if bucket is None:
+                    continue
+                seconds = amount / bucket.rate
+                for e in entries:
+                    if seconds > e["wall_seconds"]:
+                        e["wall_seconds"] = seconds
+                        e["bound"] = bound
+        return totals
+
+    @staticmethod
+    def _duration(seconds: float) -> str:
+        hours, rem = divmod(int(seconds), 3600)
+        minutes, secs = divmod(rem, 60)
+        return f"{hours}h {minutes:02d}m {secs:02d}s"
+
+    def report(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        totals = self.plan()
+        Utils.logger.info(f"Run plan (assuming {self.assumed_questions_per_block:.1f} questions per new question block):")
+        for (provider, model), entry in totals.items():
+            Utils.logger.info(
+                f"  {provider}:{model}: {entry['question_calls']} question calls, {entry['answer_calls']} answer calls, "
+                f"{entry['prompt_tokens']:,.0f} prompt tokens, ~{entry['completion_tokens']:,.0f} completion tokens, "
+                f"{entry['concurrency']} concurrent -> {self._duration(entry['wall_seconds'])} (bound by {entry['bound']})."
+            )
+        calls = sum(e["question_calls"] + e["answer_calls"] for e in totals.values())
+        tokens = sum(e["prompt_tokens"] + e["completion_tokens"] for e in totals.values())
+        wall = max((e["wall_seconds"] for e in totals.values()), default=0.0)
+        Utils.logger.info(f"Total: {calls:,} API calls, ~{tokens:,.0f} tokens, projected wall time {self._duration(wall)}.")
+        return totals
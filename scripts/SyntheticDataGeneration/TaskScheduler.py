@@ -0,0 +1,138 @@
+import asyncio
+from typing import Optional, List, Dict, Any, Tuple, Callable, Awaitable
+
+from SyntheticDataGeneration.ApiClient import APIClient
+from SyntheticDataGeneration.Utils import Utils
+
+class TaskScheduler:
+    """
+    Engine-wide work queue for question and answer tasks.
+
+    Tasks are queued per (provider, model). Each queue is drained by a fixed
+    number of worker coroutines, so the worker count is the concurrency cap
+    for that provider and model no matter how many groups submit work.
+
+    Queues are bounded: submit waits for room, which keeps the number of
+    queued tasks (and the prompts they reference) proportional to the cap.
+    Answer tasks are dequeued before question tasks so that finished
+    questions drain through the pipeline before new ones are started.
+
+    Within a stage, tasks that share an affinity key (the large file content
+    their prompts start with) are dequeued back-to-back, oldest key first, so
+    consecutive requests can reuse the provider's KV/prompt cache.
+    """
+
+    ANSWER = 0
+    QUESTION = 1
+
+    def __init__(self, default_concurrency: int, report_interval: float = 10.0, queue_factor: int = 4):
+        self.default_concurrency = max(1, default_concurrency)
+        self.report_interval = report_interval
+        self.queue_factor = max(1, queue_factor)
+        self.limits: Dict[Tuple[str, str], int] = {}
+        self.queues: Dict[Tuple[str, str], asyncio.Queue] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+        self.completed = 0
+        self._sequence = 0
+        self._affinity_ranks: Dict[str, int] = {}
+        self._workers = []
+        self._reporter: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key_for(api_client: APIClient) -> Tuple[str, str]:
+        return (api_client.provider, api_client.model)
+
+    def set_limit(self, provider: str, model: str, concurrency: int) -> None:
+        """Overrides the default cap for one provider and model. Must be called before the first submit."""
+        self.limits[(provider.lower(), model)] = max(1, concurrency)
+
+    def _queue_for(self, key: Tuple[str, str]) -> asyncio.Queue:
+        queue = self.queues.get(key)
+        if queue is None:
+            limit = self.limits.get(key, self.default_concurrency)
+            queue = asyncio.PriorityQueue(maxsize=limit * self.queue_factor)
+            self.queues[key] = queue
+            self.in_flight[key] = 0
+            for i in range(limit):
+                self._workers.append(asyncio.create_task(self._worker(key, queue), name=f"{key[0]}:{key[1]}:{i}"))
+            Utils.logger.info(f"Scheduler: {limit} workers for provider '{key[0]}' model '{key[1]}'.")
+        return queue
+
+    async def submit(
+        self, api_client: APIClient, stage: int, affinity: str, func: Callable[..., Awaitable[Any]], *args
+    ) -> asyncio.Future:
+        """
+        Queues func(*args) against the cap of api_client's provider and model,
+        waiting for queue space if necessary. Returns a future for the result.
+        """
+        if self._reporter is None and self.report_interval > 0:
+            self._reporter = asyncio.create_task(self._report())
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        rank = self._affinity_ranks.setdefault(affinity, self._sequence)
+        await self._queue_for(self.key_for(api_client)).put((stage, rank, self._sequence, future, func, args))
+        return future
+
+    async def run(
+        self, api_client: APIClient, stage: int, affinity: str, func: Callable[..., Awaitable[Any]], *args
+    ) -> Any:
+        """Submits func(*args) and waits for its result."""
+        return await (await self.submit(api_client, stage, affinity, func, *args))
+
+    async def _worker(self, key: Tuple[str, str], queue: asyncio.Queue) -> None:
+        while True:
+            _, _, _, future, func, args = await queue.get()
+            if future.cancelled():
+                # Its submitter gave up on it (e.g. a work queue lease was lost).
+                queue.task_done()
+                continue
+            self.in_flight[key] += 1
+            try:
+                result = await func(*args)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.in_flight[key] -= 1
+                self.completed += 1
+                queue.task_done()
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self.queues.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth(),
+            "in_flight": sum(self.in_flight.values()),
+            "completed": self.completed,
+            "per_model": {
+                f"{provider}:{model}": {"queued": self.queues[(provider, model)].qsize(), "in_flight": self.in_flight[(provider, model)]}
+                for provider, model in self.queues
+            },
+        }
+
+    def gauges(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """Queue depth and in-flight samples per provider and model, for Metrics. Safe to call from other threads."""
+        samples = []
+        for (provider, model), queue in list(self.queues.items()):
+            labels = {"provider": provider, "model": model}
+            samples.append(("qa_queue_depth", labels, queue.qsize()))
+            samples.append(("qa_in_flight", labels, self.in_flight.get((provider, model), 0)))
+        return samples
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            stats = self.stats()
+            Utils.logger.info(
+                f"Scheduler: queue depth {stats['queue_depth']}, in flight {stats['in_flight']}, completed {stats['completed']}."
+            )
+
+    async def close(self) -> None:
+        for task in self._workers + ([self._reporter] if self._reporter else []):
+            task.cancel()
+        await asyncio.gather(*self._workers, *([self._reporter] if self._reporter else []), return_exceptions=True)
+        self._workers = []
+        self._reporter = None
@@ -23,4 +23,17 @@ class TextParser:
             cleaned = re.sub(r'\*+', '', cleaned).strip()
             if '?' in cleaned:
                 questions.append(cleaned)
-        return questions
\ No newline at end of file
+        return questions
+
+    @staticmethod
+    def truncate_questions(question_text: str, max_questions: int) -> str:
+        """Cuts question_text after the line holding its max_questions-th question, as parse_questions counts them."""
+        count = 0
+        end = 0
+        for line in question_text.splitlines(keepends=True):
+            end += len(line)
+            if TextParser.parse_questions(line):
+                count += 1
+                if count >= max_questions:
+                    return question_text[:end].rstrip()
+        return question_text
@@ -0,0 +1,71 @@
+import threading
+from typing import Dict, List
+
+from SyntheticDataGeneration.Utils import Utils
+
+# Optional tokenizer backends; without either, tokens are estimated from the text length.
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    from transformers import AutoTokenizer
+except ImportError:
+    AutoTokenizer = None
+
+# tiktoken's encodings; without tiktoken these are estimated rather than looked up on the Hugging Face hub.
+TIKTOKEN_ENCODINGS = {"gpt2", "r50k_base", "p50k_base", "p50k_edit", "cl100k_base", "o200k_base"}
+
+class TokenCounter:
+    """
+    Counts tokens with a fast tokenizer and maps them back to character offsets
+    so text can be cut on token boundaries.
+
+    name is a tiktoken encoding (e.g. cl100k_base) or a Hugging Face tokenizer
+    name or path. Loaded tokenizers are shared per name through get().
+    """
+
+    _instances: Dict[str, "TokenCounter"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, name: str):
+        self.name = name
+        self.encoding = None
+        self.hf_tokenizer = None
+        try:
+            if tiktoken is not None and name in tiktoken.list_encoding_names():
+                self.encoding = tiktoken.get_encoding(name)
+            elif name in TIKTOKEN_ENCODINGS:
+                Utils.logger.warning(f"tiktoken is not installed for encoding '{name}'; estimating four characters per token.")
+            elif AutoTokenizer is not None:
+                self.hf_tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+            else:
+                Utils.logger.warning(f"No tokenizer library available for '{name}'; estimating four characters per token.")
+        except Exception as e:
+            # Encodings and tokenizers are downloaded on first use, which fails offline.
+            Utils.logger.warning(f"Could not load tokenizer '{name}' ({e}); estimating four characters per token.")
+
+    @classmethod
+    def get(cls, name: str) -> "TokenCounter":
+        with cls._instances_lock:
+            if name not in cls._instances:
+                cls._instances[name] = cls(name)
+            return cls._instances[name]
+
+    def token_offsets(self, text: str) -> List[int]:
+        """Returns the character offset at which each token of text starts."""
+        if self.encoding is not None:
+            _, offsets = self.encoding.decode_with_offsets(self.encoding.encode(text, disallowed_special=()))
+            return offsets
+        if self.hf_tokenizer is not None:
+            encoded = self.hf_tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+            return [start for start, _ in encoded["offset_mapping"]]
+        return list(range(0, len(text), 4))
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        if self.hf_tokenizer is not None:
+            return len(self.hf_tokenizer(text, add_special_tokens=False)["input_ids"])
+        return (len(text) + 3) // 4
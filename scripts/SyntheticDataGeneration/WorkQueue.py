@@ -0,0 +1,147 @@
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, List, Dict
+
+from SyntheticDataGeneration.Utils import Utils
+
+class WorkQueue:
+    """
+    Shared SQLite queue of work items that several processes or hosts take turns on.
+
+    A worker leases items for lease_seconds and keeps the lease alive with
+    heartbeat() while it works on them. An item whose lease expires (its
+    worker crashed or stalled) is leased again by the next worker that asks,
+    and complete() only counts when the caller still holds the lease. Items
+    that failed or lost their lease max_attempts times are marked failed.
+
+    Items belong to a run_id, so workers started with a different config or
+    input keep their items apart in the same file. Leases compare wall clock
+    time, so hosts' clocks must agree to well within lease_seconds.
+
+    The default rollback journal is used instead of WAL so that the file also
+    works on a shared volume mounted by several hosts (which must support
+    POSIX file locks).
+    """
+
+    def __init__(
+        self, db_path: Path, run_id: str, lease_seconds: float = 300.0, max_attempts: int = 3, worker_id: Optional[str] = None
+    ):
+        self.db_path = db_path
+        self.run_id = run_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or self.new_worker_id()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode; every change runs in an explicit BEGIN IMMEDIATE transaction.
+        self.conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS work_items ("
+            "run_id TEXT NOT NULL, item_id TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending', "
+            "owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, updated REAL, "
+            "PRIMARY KEY (run_id, item_id)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS work_items_state ON work_items (run_id, state, lease_expires)")
+
+    @staticmethod
+    def new_worker_id() -> str:
+        return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    def _transaction(self, func, *args):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(*args)
+            self.conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, item_ids: List[str]) -> int:
+        """Adds the items that are not in the queue yet. Returns how many were added."""
+        def insert():
+            before = self.conn.total_changes
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO work_items (run_id, item_id, updated) VALUES (?, ?, ?)",
+                ((self.run_id, item_id, now) for item_id in item_ids)
+            )
+            return self.conn.total_changes - before
+        return self._transaction(insert)
+
+    def lease(self, limit: int) -> List[str]:
+        """Leases up to limit pending or expired items to this worker."""
+        def take():
+            now = time.time()
+            # Items whose worker kept dying on them are not handed out again.
+            self.conn.execute(
+                "UPDATE work_items SET state = 'failed', owner = NULL, updated = ? "
+                "WHERE run_id = ? AND state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.run_id, now, self.max_attempts)
+            )
+            rows = self.conn.execute(
+                "SELECT item_id, state FROM work_items WHERE run_id = ? "
+                "AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) LIMIT ?",
+                (self.run_id, now, limit)
+            ).fetchall()
+            for item_id, state in rows:
+                if state == "leased":
+                    Utils.logger.warning(f"Work queue: lease on {item_id} expired; taking it over.")
+            self.conn.executemany(
+                "UPDATE work_items SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? "
+                "WHERE run_id = ? AND item_id = ?",
+                ((self.worker_id, now + self.lease_seconds, now, self.run_id, item_id) for item_id, _ in rows)
+            )
+            return [item_id for item_id, _ in rows]
+        return self._transaction(take)
+
+    def heartbeat(self, item_ids: List[str]) -> List[str]:
+        """Extends the leases on item_ids. Returns the items this worker no longer holds."""
+        def extend():
+            now = time.time()
+            lost = []
+            for item_id in item_ids:
+                cursor = self.conn.execute(
+                    "UPDATE work_items SET lease_expires = ?, updated = ? "
+                    "WHERE run_id = ? AND item_id = ? AND state = 'leased' AND owner = ?",
+                    (now + self.lease_seconds, now, self.run_id, item_id, self.worker_id)
+                )
+                if cursor.rowcount == 0:
+                    lost.append(item_id)
+            return lost
+        return self._transaction(extend)
+
+    def complete(self, item_id: str, succeeded: bool) -> bool:
+        """
+        Marks a leased item done, or returns it to the queue (failed once max_attempts is reached).
+        Returns False if the lease had already been lost.
+        """
+        def finish():
+            if succeeded:
+                state_sql = "'done'"
+            else:
+                state_sql = f"CASE WHEN attempts >= {int(self.max_attempts)} THEN 'failed' ELSE 'pending' END"
+            cursor = self.conn.execute(
+                f"UPDATE work_items SET state = {state_sql}, owner = NULL, lease_expires = NULL, updated = ? "
+                "WHERE run_id = ? AND item_id = ? AND state = 'leased' AND owner = ?",
+                (time.time(), self.run_id, item_id, self.worker_id)
+            )
+            return cursor.rowcount == 1
+        return self._transaction(finish)
+
+    def counts(self) -> Dict[str, int]:
+        rows = self.conn.execute(
+            "SELECT state, COUNT(*) FROM work_items WHERE run_id = ? GROUP BY state", (self.run_id,)
+        ).fetchall()
+        return {state: count for state, count in rows}
+
+    def remaining(self) -> int:
+        """Items that are pending or leased by any worker."""
+        counts = self.counts()
+        return counts.get("pending", 0) + counts.get("leased", 0)
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, Any
+
+
+class DatasetCache:
+    """
+    On-disk cache of tokenized datasets, saved in Arrow format and memory-mapped on load.
+
+    Entries are keyed by the SHA-256 of the training file, the tokenizer (its
+    vocabulary and settings), the chat template and max_seq_length, so runs and
+    hyperparameter sweeps over the same data share one entry. File hashes are
+    remembered by path, size and modification time so that unchanged files are
+    not hashed again.
+    """
+
+    # Bump when the tokenization in train.py changes so old entries are not reused.
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hashes_path = self.cache_dir / "file_hashes.json"
+
+    def file_hash(self, path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        hashes = json.loads(self.hashes_path.read_text()) if self.hashes_path.exists() else {}
+        entry = hashes.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                digest.update(block)
+        hashes[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+        self.hashes_path.write_text(json.dumps(hashes, indent=2))
+        return digest.hexdigest()
+
+    @staticmethod
+    def tokenizer_fingerprint(tokenizer) -> str:
+        backend = getattr(tokenizer, "backend_tokenizer", None)
+        # Fast tokenizers serialize completely; otherwise fall back to the name and vocabulary.
+        identity = backend.to_str() if backend is not None else json.dumps(
+            {"name": tokenizer.name_or_path, "vocab": sorted(tokenizer.get_vocab().items())}
+        )
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def key(self, train_data: str, tokenizer, chat_template: str, max_seq_length: int) -> str:
+        parts: Dict[str, Any] = {
+            "version": self.FORMAT_VERSION,
+            "data": self.file_hash(train_data),
+            "tokenizer": self.tokenizer_fingerprint(tokenizer),
+            "chat_template": chat_template,
+            "chat_template_text": getattr(tokenizer, "chat_template", None),
+            "max_seq_length": max_seq_length,
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+    def load_or_build(self, key: str, build: Callable[[], Any]):
+        """Returns the cached dataset for key, or builds it with build() and stores it."""
+        from datasets import load_from_disk
+
+        entry = self.cache_dir / key
+        if entry.exists():
+            print(f"Loading tokenized dataset from cache {entry}")
+            return load_from_disk(str(entry))
+
+        dataset = build()
+        # Save next to the final location and rename, so an interrupted save never looks like a valid entry.
+        staging = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=self.cache_dir))
+        try:
+            dataset.save_to_disk(str(staging))
+            os.replace(staging, entry)
+        except OSError:
+            # Another run stored the same entry first.
+            shutil.rmtree(staging, ignore_errors=True)
+            if not entry.exists():
+                raise
+        print(f"Saved tokenized dataset to cache {entry}")
+        return load_from_disk(str(entry))
@@ -0,0 +1,271 @@
+"""
+Merges a LoRA adapter into a model one tensor at a time.
+
+The base model's safetensors shards and the adapter weights are memory-mapped;
+every base tensor is read on its own, the adapter's update B @ A * alpha / r is
+added to the weights it targets, and the results are written out in shards of
+at most max_shard_size that are saved one at a time. Peak memory is about one
+output shard, however large the model is. Tensors keep the dtype of the base
+model.
+
+Without an adapter the same engine re-shards a model that already holds merged
+weights, as torchtune writes them.
+
+Run this file directly to check on CPU, with a tiny random Llama, that the
+merged model gives the same logits as the base model with the adapter applied:
+
+    python -m TrainingData.LoraMerge
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+from typing import List, Dict, Any, Optional, Tuple
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+ADAPTER_WEIGHTS = "adapter_model.safetensors"
+# merge_lora.py renames adapter_config.json so that Hugging Face does not load the directory as an adapter.
+ADAPTER_CONFIG_NAMES = ["adapter_config.json", "adapter.config.invalidateCauseHuggingFaceABitch"]
+COPIED_FILES = ["config.json", "generation_config.json"]
+INDEX_NAME = "model.safetensors.index.json"
+OUTPUT_SHARD_RE = re.compile(r"model(-\d+-of-\d+)?\.safetensors")
+LORA_RE = re.compile(r"(.+)\.lora_(A|B|embedding_A|embedding_B)(?:\.default)?(?:\.weight)?")
+
+
+def parse_size(size) -> int:
+    """Parses sizes such as "2GB" or "500MB" into bytes."""
+    text = str(size).strip().upper()
+    for unit, factor in (("KB", 10 ** 3), ("MB", 10 ** 6), ("GB", 10 ** 9), ("TB", 10 ** 12)):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def find_shards(model_dir: str) -> List[str]:
+    """Returns the safetensors weight files of a model directory, without the adapter's."""
+    index_path = os.path.join(model_dir, INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            return sorted(set(json.load(f)["weight_map"].values()))
+    return sorted(name for name in os.listdir(model_dir) if name.endswith(".safetensors") and name != ADAPTER_WEIGHTS)
+
+
+class LoraAdapter:
+    """
+    A LoRA adapter in PEFT format (adapter_config.json and adapter_model.safetensors), as
+    saved by torchtune and Unsloth. The weights stay memory-mapped until a target is merged.
+    """
+
+    def __init__(self, adapter_dir: str):
+        config_path = next((os.path.join(adapter_dir, name) for name in ADAPTER_CONFIG_NAMES
+                            if os.path.exists(os.path.join(adapter_dir, name))), None)
+        if config_path is None:
+            raise FileNotFoundError(f"No adapter_config.json in {adapter_dir}.")
+        self.adapter_dir = adapter_dir
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        if self.config.get("use_dora"):
+            raise ValueError("DoRA adapters cannot be merged by this script.")
+        self.handle = safe_open(os.path.join(adapter_dir, ADAPTER_WEIGHTS), framework="pt")
+
+        # Base weight name -> {"A": key, "B": key, "embedding": bool}, and base weights the adapter replaces outright.
+        self.targets: Dict[str, Dict[str, Any]] = {}
+        self.replacements: Dict[str, str] = {}
+        for key in self.handle.keys():
+            name = key[len("base_model.model."):] if key.startswith("base_model.model.") else key
+            match = LORA_RE.fullmatch(name)
+            if match:
+                module, part = match.groups()
+                target = self.targets.setdefault(f"{module}.weight", {"module": module, "embedding": False})
+                target["embedding"] |= part.startswith("embedding")
+                target[part[-1]] = key
+            elif "lora_" in name:
+                raise ValueError(f"Unsupported adapter tensor {key}.")
+            else:
+                # modules_to_save, e.g. a retrained lm_head.
+                self.replacements[name] = key
+        incomplete = [name for name, target in self.targets.items() if "A" not in target or "B" not in target]
+        if incomplete:
+            raise ValueError(f"Adapter is missing lora_A or lora_B for {incomplete[:5]}.")
+
+    def scale(self, module: str, rank: int) -> float:
+        alpha = self.config.get("lora_alpha", rank)
+        for pattern, value in (self.config.get("alpha_pattern") or {}).items():
+            if re.match(rf"(.*\.)?{pattern}$", module):
+                alpha = value
+                break
+        return alpha / math.sqrt(rank) if self.config.get("use_rslora") else alpha / rank
+
+    def covers(self, name: str) -> bool:
+        return name in self.targets or name in self.replacements
+
+    def apply(self, name: str, tensor: torch.Tensor) -> torch.Tensor:
+        """Returns the base tensor called name with the adapter merged in."""
+        if name in self.replacements:
+            return self.handle.get_tensor(self.replacements[name]).to(tensor.dtype)
+        target = self.targets.get(name)
+        if target is None:
+            return tensor
+        if not tensor.is_floating_point():
+            raise ValueError(f"{name} is quantized ({tensor.dtype}); merge into the unquantized base model instead.")
+        a = self.handle.get_tensor(target["A"]).float()
+        b = self.handle.get_tensor(target["B"]).float()
+        delta = (b @ a) * self.scale(target["module"], a.shape[0])
+        # Embeddings and fan_in_fan_out layers store their weight transposed relative to B @ A.
+        if target["embedding"] or self.config.get("fan_in_fan_out"):
+            delta = delta.T
+        return (tensor.float() + delta).to(tensor.dtype)
+
+
+def check_output_dir(output_dir: str, input_dirs: List[str]):
+    """Rejects an output directory that is, contains or lies inside an input, whose shards it would overwrite."""
+    output = os.path.realpath(output_dir)
+    for input_dir in input_dirs:
+        source = os.path.realpath(input_dir)
+        if os.path.commonpath([output, source]) in (output, source):
+            raise ValueError(f"The merged model directory {output_dir} overlaps the input directory {input_dir}; "
+                             f"choose a separate directory.")
+
+
+def _clear_output(output_dir: str):
+    """Removes model shards left in output_dir by an earlier merge, which the new index would not list."""
+    for name in os.listdir(output_dir):
+        if OUTPUT_SHARD_RE.fullmatch(name) or name == INDEX_NAME:
+            os.remove(os.path.join(output_dir, name))
+
+
+def merge_shards(base_dir: str, output_dir: str, adapter: Optional[LoraAdapter] = None,
+                 max_shard_size: int = 2 * 10 ** 9) -> Dict[str, Any]:
+    """
+    Writes the base model in base_dir, with the adapter merged in when given, to output_dir
+    as safetensors shards of at most max_shard_size bytes (a larger single tensor gets a shard
+    of its own), along with the index and the model config. Returns merge statistics.
+    """
+    check_output_dir(output_dir, [base_dir] + ([adapter.adapter_dir] if adapter is not None else []))
+    shards = find_shards(base_dir)
+    if not shards:
+        raise FileNotFoundError(f"No safetensors weights in {base_dir}.")
+
+    # Check from the shard headers alone that every adapter weight has a target before writing anything.
+    if adapter is not None:
+        names = set()
+        for shard in shards:
+            with safe_open(os.path.join(base_dir, shard), framework="pt") as f:
+                names.update(f.keys())
+        unmatched = sorted((set(adapter.targets) | set(adapter.replacements)) - names)
+        if unmatched:
+            raise ValueError(f"{len(unmatched)} adapter targets are not in the base model, e.g. {unmatched[:5]}.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    _clear_output(output_dir)
+    written: List[Tuple[str, List[str]]] = []
+    buffer: Dict[str, torch.Tensor] = {}
+    buffer_bytes, total_size, merged = 0, 0, 0
+
+    def flush():
+        nonlocal buffer, buffer_bytes
+        name = f"model-{len(written) + 1:05d}.safetensors.partial"
+        save_file(buffer, os.path.join(output_dir, name), metadata={"format": "pt"})
+        written.append((name, list(buffer)))
+        buffer, buffer_bytes = {}, 0
+
+    for shard in shards:
+        with safe_open(os.path.join(base_dir, shard), framework="pt") as f:
+            for name in f.keys():
+                tensor = f.get_tensor(name)
+                if adapter is not None and adapter.covers(name):
+                    tensor = adapter.apply(name, tensor)
+                    merged += 1
+                size = tensor.numel() * tensor.element_size()
+                if buffer and buffer_bytes + size > max_shard_size:
+                    flush()
+                buffer[name] = tensor.contiguous()
+                buffer_bytes += size
+                total_size += size
+    if buffer:
+        flush()
+
+    # The shard count is only known now, so the shards get their final names last.
+    if len(written) == 1:
+        os.replace(os.path.join(output_dir, written[0][0]), os.path.join(output_dir, "model.safetensors"))
+    else:
+        weight_map = {}
+        for number, (partial, names) in enumerate(written, start=1):
+            final = f"model-{number:05d}-of-{len(written):05d}.safetensors"
+            os.replace(os.path.join(output_dir, partial), os.path.join(output_dir, final))
+            weight_map.update({name: final for name in names})
+        with open(os.path.join(output_dir, INDEX_NAME), "w", encoding="utf-8") as f:
+            json.dump({"metadata": {"total_size": total_size}, "weight_map": weight_map}, f, indent=2)
+
+    for name in COPIED_FILES:
+        if os.path.exists(os.path.join(base_dir, name)):
+            shutil.copyfile(os.path.join(base_dir, name), os.path.join(output_dir, name))
+    return {"shards": len(written), "bytes": total_size, "merged_tensors": merged}
+
+
+def verify_merge(seed: int = 0, rank: int = 4, alpha: int = 8) -> float:
+    """
+    Saves a tiny random Llama in several shards and a random adapter, merges them, and returns
+    the largest logit difference between the merged model and the base model with the adapter
+    applied in memory (close to 0 when the merge is correct).
+    """
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(vocab_size=101, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=64)
+    base = LlamaForCausalLM(config).eval()
+    expected = LlamaForCausalLM(config).eval()
+    expected.load_state_dict(base.state_dict())
+
+    with tempfile.TemporaryDirectory() as workdir:
+        base_dir, adapter_dir, output_dir = (os.path.join(workdir, name) for name in ("base", "adapter", "merged"))
+        base.save_pretrained(base_dir, max_shard_size="40KB", safe_serialization=True)
+
+        adapter_tensors = {}
+        state = expected.state_dict()
+        for name, weight in state.items():
+            if not re.search(r"\.(q_proj|v_proj|down_proj)\.weight$", name):
+                continue
+            module = name[:-len(".weight")]
+            a = torch.randn(rank, weight.shape[1]) * 0.1
+            b = torch.randn(weight.shape[0], rank) * 0.1
+            adapter_tensors[f"base_model.model.{module}.lora_A.weight"] = a
+            adapter_tensors[f"base_model.model.{module}.lora_B.weight"] = b
+            weight += (b @ a) * alpha / rank
+        os.makedirs(adapter_dir)
+        save_file(adapter_tensors, os.path.join(adapter_dir, ADAPTER_WEIGHTS))
+        with open(os.path.join(adapter_dir, "adapter_config.json"), "w", encoding="utf-8") as f:
+            json.dump({"peft_type": "LORA", "r": rank, "lora_alpha": alpha,
+                       "target_modules": ["q_proj", "v_proj", "down_proj"]}, f)
+
+        stats = merge_shards(base_dir, output_dir, LoraAdapter(adapter_dir), max_shard_size=parse_size("60KB"))
+        merged = LlamaForCausalLM.from_pretrained(output_dir).eval()
+        input_ids = torch.randint(0, config.vocab_size, (2, 16))
+        with torch.no_grad():
+            max_diff = (merged(input_ids).logits - expected(input_ids).logits).abs().max().item()
+    print(f"Merged {stats['merged_tensors']} tensors into {stats['shards']} shards ({stats['bytes']} bytes); "
+          f"max logit difference {max_diff:.2e}.")
+    return max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the streaming LoRA merge against an in-memory merge on CPU.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+    max_diff = verify_merge(args.seed)
+    if max_diff > args.tolerance:
+        raise SystemExit(f"Merged and expected logits differ by {max_diff:.2e} (tolerance {args.tolerance:.0e}).")
+    print("Merge check passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Batches conversations of similar length up to a budget of padded tokens.
+
+Lengths are rounded up to a multiple of bucket_width and every epoch the
+conversations are ordered by that rounded length, with a fresh random order
+inside each bucket. Batches are cut greedily so that (longest rounded length x
+batch size) stays within max_tokens_per_batch, and the batches are then
+shuffled. Short conversations therefore share large batches, long ones go in
+small batches, and the number of batches only depends on the lengths, so it is
+the same in every epoch (which the learning rate schedule relies on).
+
+The batching is plain Python and can be checked on CPU with synthetic lengths:
+
+    python -m TrainingData.TokenBudgetSampler
+"""
+
+import argparse
+import math
+import random
+from typing import List, Iterator, Dict, Any
+
+
+def round_up(length: int, multiple: int) -> int:
+    return max(multiple, -(-length // multiple) * multiple)
+
+
+def token_budget_batches(lengths: List[int], max_tokens: int, bucket_width: int = 8, seed: int = 0) -> List[List[int]]:
+    """
+    Returns batches of indices into lengths. A batch holds at most max_tokens padded tokens,
+    counting every member at the rounded length of the longest; a conversation longer than
+    the budget gets a batch of its own.
+    """
+    rng = random.Random(seed)
+    rounded = [round_up(length, bucket_width) for length in lengths]
+    tie_break = [rng.random() for _ in lengths]
+    order = sorted(range(len(lengths)), key=lambda i: (rounded[i], tie_break[i]))
+
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for i in order:
+        # Ascending order, so the newcomer is the longest member.
+        if batch and rounded[i] * (len(batch) + 1) > max_tokens:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    rng.shuffle(batches)
+    return batches
+
+
+def batch_stats(lengths: List[int], batches: List[List[int]]) -> Dict[str, Any]:
+    """Batch sizes and the share of real tokens when each batch is padded to its longest member."""
+    sizes = [len(batch) for batch in batches]
+    slots = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return {
+        "batches": len(batches),
+        "min_size": min(sizes, default=0),
+        "mean_size": sum(sizes) / len(sizes) if sizes else 0.0,
+        "max_size": max(sizes, default=0),
+        "efficiency": sum(lengths) / slots if slots else 0.0,
+    }
+
+
+class TokenBudgetBatchSampler:
+    """
+    Batch sampler for a DataLoader (pass it as batch_sampler). Each pass over it is a new
+    epoch with a different order, seeded by seed and the epoch number; set_epoch picks the
+    epoch explicitly.
+    """
+
+    def __init__(self, lengths: List[int], max_tokens: int, bucket_width: int = 8, seed: int = 0):
+        self.lengths = list(lengths)
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.seed = seed
+        self.epoch = 0
+        self._len = len(token_budget_batches(self.lengths, max_tokens, bucket_width, seed))
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = token_budget_batches(self.lengths, self.max_tokens, self.bucket_width, self.seed + self.epoch)
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return self._len
+
+
+def check_batching(conversations: int, max_tokens: int, bucket_width: int, epochs: int, seed: int) -> Dict[str, Any]:
+    """Checks the sampler's invariants on random lengths and returns the stats of the first epoch."""
+    rng = random.Random(seed)
+    lengths = [max(1, int(rng.lognormvariate(math.log(300), 0.6))) for _ in range(conversations)]
+    sampler = TokenBudgetBatchSampler(lengths, max_tokens, bucket_width, seed)
+    orders = []
+    for _ in range(epochs):
+        batches = list(sampler)
+        if len(batches) != len(sampler):
+            raise AssertionError(f"Epoch has {len(batches)} batches, expected {len(sampler)}.")
+        if sorted(i for batch in batches for i in batch) != list(range(conversations)):
+            raise AssertionError("Every conversation must appear exactly once per epoch.")
+        for batch in batches:
+            longest = max(round_up(lengths[i], bucket_width) for i in batch)
+            if len(batch) > 1 and longest * len(batch) > max_tokens:
+                raise AssertionError(f"Batch of {len(batch)} x {longest} tokens exceeds the budget of {max_tokens}.")
+        orders.append(batches)
+    if epochs > 1 and orders[0] == orders[1]:
+        raise AssertionError("Consecutive epochs produced the same batches.")
+    return batch_stats(lengths, orders[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check token-budget batching on random lengths.")
+    parser.add_argument("--conversations", type=int, default=5000)
+    parser.add_argument("--max_tokens_per_batch", type=int, default=8192)
+    parser.add_argument("--bucket_width", type=int, default=8)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    stats = check_batching(args.conversations, args.max_tokens_per_batch, args.bucket_width, args.epochs, args.seed)
+    print(f"{stats['batches']} batches of {stats['min_size']}-{stats['max_size']} conversations "
+          f"(mean {stats['mean_size']:.1f}); {stats['efficiency']:.1%} of padded tokens are real.")
+    print("Batching check passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import resource
+import shutil
+import subprocess
+import tempfile
+import urllib.request
+from pathlib import Path
+from typing import Dict, Any
+
+from SyntheticDataGeneration.QAGenerator import QAGeneratorEngine
+from SyntheticDataGeneration.Utils import Utils
+
+WORDS = ["model", "config", "train", "install", "docker", "script", "dataset", "token", "adapter", "export", "cache", "prompt"]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def read_proc_io() -> Dict[str, int]:
+    """Process I/O counters from /proc (Linux only). syscr/syscw also count socket reads and writes."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f.read().splitlines())}
+    except OSError:
+        return {}
+
+def build_input_tree(base_dir: Path, groups: int, files_per_group: int, file_kb: int, seed: int) -> Dict[str, list]:
+    rng = random.Random(seed)
+    group_files = {}
+    for g in range(groups):
+        names = []
+        for f in range(files_per_group):
+            rel = f"group{g}/file{f}.md"
+            path = base_dir / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            words = []
+            size = 0
+            while size < file_kb * 1024:
+                word = rng.choice(WORDS)
+                words.append(word)
+                size += len(word) + 1
+            path.write_text(" ".join(words), encoding="utf-8")
+            names.append(rel)
+        group_files[f"Group{g}"] = names
+    return group_files
+
+def build_config(args, port: int, group_files: Dict[str, list]) -> Dict[str, Any]:
+    provider = {"provider": args.provider, "model": "mock"}
+    if args.provider == "openai":
+        provider["base_url"] = f"http://127.0.0.1:{port}/v1"
+    return {
+        "global": {
+            "base_dir": "qa_generation_input",
+            "ollama_url": f"http://127.0.0.1:{port}/api/generate",
+            "output_backend": args.backend,
+            "cache": {"enabled": args.cache},
+            "metrics": {"summary_path": "qa_generation_output/run_metrics.json"},
+        },
+        "providers": {"question": dict(provider, max_questions=args.max_questions), "answer": dict(provider)},
+        "batch": {"poll_interval": 0.5},
+        "QuestionInstructionList": [{"name": "Q", "instruction": [f"Question style {i}" for i in range(args.question_instructions)]}],
+        "AnswerInstructionList": [{"name": "A", "instruction": [f"Answer style {i}" for i in range(args.answer_instructions)]}],
+        "GenerateQuestionLists": [{"name": "S", "questions": [f"Based on the following, generate a list of questions about topic {i}." for i in range(args.seeds)]}],
+        "FileHeaders": [{"name": "H", "description": "The file contents for: {file_name}"}],
+        "QuestionPrompt": [{"name": "QP", "description": "{file_content}\n{generate_question}\n{instruction}\n"}],
+        "AnswerPrompt": [{"name": "AP", "description": "{file_content}\n{instruction}\n{question}\n"}],
+        "file_groups": {
+            name: {
+                "iterations": args.iterations, "files": files, "question_prompt": "QP", "generate_question_list": ["S"],
+                "question_instruction_list": ["Q"], "file_header": "H", "answer_prompt": "AP", "answer_instruction_list": ["A"]
+            }
+            for name, files in group_files.items()
+        },
+    }
+
+def start_mock(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, str(Path(__file__).with_name("mock_llm_server.py")), "--port", str(port),
+        "--latency", args.latency, "--error_rate", str(args.error_rate), "--rate_429", str(args.rate_429),
+        "--retry_after", str(args.retry_after), "--questions_per_block", str(args.questions_per_block), "--batch_delay", "0.5"
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock LLM server did not start.")
+
+def histogram(summary: Dict[str, Any], name: str, **labels) -> Dict[str, Any]:
+    for entry in summary["histograms"].get(name, []):
+        if all(entry["labels"].get(k) == v for k, v in labels.items()):
+            return entry
+    return {}
+
+def counter(summary: Dict[str, Any], name: str, **labels) -> float:
+    return sum(
+        entry["value"] for entry in summary["counters"].get(name, [])
+        if all(entry["labels"].get(k) == v for k, v in labels.items())
+    )
+
+def run_benchmark(args) -> Dict[str, Any]:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="qa_bench_"))
+    port = free_port()
+    mock = start_mock(args, port)
+    try:
+        group_files = build_input_tree(workdir / "qa_generation_input", args.groups, args.files_per_group, args.file_kb, args.seed)
+        config = build_config(args, port, group_files)
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+        io_before = read_proc_io()
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        engine = QAGeneratorEngine(config, workdir, args.threads)
+        started = time.monotonic()
+        engine.run(args.mode)
+        elapsed = time.monotonic() - started
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        io_after = read_proc_io()
+
+        summary = engine.metrics.summary()
+        mock_stats = json.loads(urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5).read())
+        output_dir = workdir / "qa_generation_output"
+        output_files = sum(len(files) for _, _, files in os.walk(output_dir))
+        output_bytes = sum(p.stat().st_size for p in output_dir.rglob("*") if p.is_file())
+        tasks = counter(summary, "qa_tasks_total", outcome="generated")
+        latency = histogram(summary, "qa_api_request_seconds", outcome="ok")
+        return {
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "workdir", "keep", "verbose")},
+            "elapsed_seconds": round(elapsed, 3),
+            "tasks_generated": int(tasks),
+            "tasks_failed": int(counter(summary, "qa_tasks_total", outcome="failed")),
+            "tasks_per_second": round(tasks / elapsed, 3) if elapsed else 0.0,
+            "api_latency_p50": latency.get("p50"),
+            "api_latency_p99": latency.get("p99"),
+            "api_retries": int(counter(summary, "qa_api_retries_total")),
+            "mock_requests": mock_stats["requests"],
+            "mock_peak_in_flight": mock_stats["peak_in_flight"],
+            "mock_completion_tokens": mock_stats["completion_tokens"],
+            "mock_cancelled": mock_stats["cancelled"],
+            # ru_maxrss is reported in kilobytes on Linux.
+            "peak_rss_mb": round(usage_after.ru_maxrss / 1024, 1),
+            "fs_block_reads": usage_after.ru_inblock - usage_before.ru_inblock,
+            "fs_block_writes": usage_after.ru_oublock - usage_before.ru_oublock,
+            "read_syscalls": io_after.get("syscr", 0) - io_before.get("syscr", 0),
+            "write_syscalls": io_after.get("syscw", 0) - io_before.get("syscw", 0),
+            "bytes_written": io_after.get("wchar", 0) - io_before.get("wchar", 0),
+            "output_files": output_files,
+            "output_bytes": output_bytes,
+        }
+    finally:
+        mock.terminate()
+        mock.wait()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark QA generation end to end against a local mock LLM server.")
+    parser.add_argument("--provider", choices=["ollama", "openai"], default="ollama")
+    parser.add_argument("--mode", choices=["online", "batch"], default="online", help="batch requires --provider openai")
+    parser.add_argument("--backend", choices=["files", "sqlite"], default="files", help="Result store backend")
+    parser.add_argument("--cache", action="store_true", help="Enable the response cache")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--files_per_group", type=int, default=3)
+    parser.add_argument("--file_kb", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=2)
+    parser.add_argument("--seeds", type=int, default=4)
+    parser.add_argument("--question_instructions", type=int, default=2)
+    parser.add_argument("--answer_instructions", type=int, default=2)
+    parser.add_argument("--questions_per_block", type=int, default=5, help="Questions the mock returns per question prompt")
+    parser.add_argument("--max_questions", type=int, default=None, help="Stream question calls and cut them off after this many questions")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5", help="Mock latency distribution (see mock_llm_server.py)")
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_429", type=float, default=0.0)
+    parser.add_argument("--retry_after", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic input tree")
+    parser.add_argument("--workdir", default=None, help="Directory to run in (default: a temporary directory that is removed)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="Results JSON from an earlier run to compare tasks_per_second against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed tasks_per_second drop versus the baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show the generator's log output")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        Utils.logger.setLevel(logging.WARNING)
+    results = run_benchmark(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        floor = baseline["tasks_per_second"] * (1 - args.tolerance)
+        if results["tasks_per_second"] < floor:
+            print(f"Regression: {results['tasks_per_second']} tasks/s is below {floor:.3f} "
+                  f"({baseline['tasks_per_second']} baseline - {args.tolerance:.0%}).", file=sys.stderr)
+            sys.exit(1)
+        print(f"OK: {results['tasks_per_second']} tasks/s (baseline {baseline['tasks_per_second']}).", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
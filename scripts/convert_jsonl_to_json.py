@@ -1,64 +1,141 @@
+import os
 import json
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_jsonl(input_file, output_file):
-    conversations_list = []
-    
-    # Define a mapping from input roles to the desired output roles.
-    role_map = {
-        "system": "system",
-        "user": "human",
-        "assistant": "gpt"
-    }
-    
-    with open(input_file, "r", encoding="utf-8") as fin:
-        for line in fin:
-            line = line.strip()
+# Define a mapping from input roles to the desired output roles.
+role_map = {
+    "system": "system",
+    "user": "human",
+    "assistant": "gpt"
+}
+
+def convert_conversation(line):
+    """Returns the converted conversation for one JSONL line, or None if the line is skipped."""
+    line = line.strip()
+    if not line:
+        return None  # skip empty lines
+    try:
+        # Load each line as a JSON object
+        data = json.loads(line)
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON for line: {line}\nError: {e}")
+        return None
+
+    # Extract messages and convert their roles
+    messages = data.get("messages", [])
+    converted_messages = []
+    for message in messages:
+        role = message.get("role", "")
+        content = message.get("content", "")
+        new_role = role_map.get(role, role)
+        converted_messages.append({"from": new_role, "value": content})
+
+    # Filter out only "human" and "gpt" messages for alternating check.
+    filtered_messages = [msg for msg in converted_messages if msg["from"] in {"human", "gpt"}]
+
+    # Validate that the conversation strictly alternates:
+    # - Must start with a "human" message.
+    # - Must have an even number of messages (to form complete pairs).
+    # - Every even-indexed message must be from "human" and every odd-indexed from "gpt".
+    if not filtered_messages or len(filtered_messages) % 2 != 0:
+        return None  # Toss out conversation if it does not have complete alternating pairs.
+
+    for i, msg in enumerate(filtered_messages):
+        expected = "human" if i % 2 == 0 else "gpt"
+        if msg["from"] != expected:
+            # Skip this conversation if it doesn't strictly alternate
+            return None
+
+    # Note: This output includes only the alternating messages.
+    return {"conversations": filtered_messages}
+
+def render(conversation, compact):
+    """Serializes one array element exactly as json.dump would inside the top-level list."""
+    if compact:
+        return json.dumps(conversation, ensure_ascii=False, separators=(",", ":"))
+    text = json.dumps(conversation, indent=4, ensure_ascii=False)
+    return "    " + text.replace("\n", "\n    ")
+
+def iter_lines(input_file, start=0, end=None):
+    """Yields the lines that begin inside the byte range [start, end) of input_file."""
+    with open(input_file, "rb") as fin:
+        if start:
+            # Skip the line straddling the boundary; the previous range owns it.
+            fin.seek(start - 1)
+            fin.readline()
+        while end is None or fin.tell() < end:
+            line = fin.readline()
             if not line:
-                continue  # skip empty lines
-            try:
-                # Load each line as a JSON object
-                data = json.loads(line)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON for line: {line}\nError: {e}")
-                continue
-            
-            # Extract messages and convert their roles
-            messages = data.get("messages", [])
-            converted_messages = []
-            for message in messages:
-                role = message.get("role", "")
-                content = message.get("content", "")
-                new_role = role_map.get(role, role)
-                converted_messages.append({"from": new_role, "value": content})
-            
-            # Filter out only "human" and "gpt" messages for alternating check.
-            filtered_messages = [msg for msg in converted_messages if msg["from"] in {"human", "gpt"}]
-            
-            # Validate that the conversation strictly alternates:
-            # - Must start with a "human" message.
-            # - Must have an even number of messages (to form complete pairs).
-            # - Every even-indexed message must be from "human" and every odd-indexed from "gpt".
-            if not filtered_messages or len(filtered_messages) % 2 != 0:
-                continue  # Toss out conversation if it does not have complete alternating pairs.
-            
-            valid = True
-            for i, msg in enumerate(filtered_messages):
-                expected = "human" if i % 2 == 0 else "gpt"
-                if msg["from"] != expected:
-                    valid = False
-                    break
-            
-            if not valid:
-                # Skip this conversation if it doesn't strictly alternate
-                continue
-            
-            # Append the validated conversation. Note: This output includes only the alternating messages.
-            conversations_list.append({"conversations": filtered_messages})
-    
-    # Write the list of valid conversations to the output JSON file.
+                break
+            yield line.decode("utf-8")
+
+def convert_range(task):
+    """Worker entry point: converts one byte range and returns (rendered elements, kept, skipped)."""
+    input_file, start, end, compact = task
+    rendered = []
+    skipped = 0
+    for line in iter_lines(input_file, start, end):
+        conversation = convert_conversation(line)
+        if conversation is None:
+            skipped += line.strip() != ""
+            continue
+        rendered.append(render(conversation, compact))
+    return (",\n" if not compact else ",").join(rendered), len(rendered), skipped
+
+def convert_jsonl(input_file, output_file, workers=1, compact=False, chunk_mb=64):
+    """
+    Streams input_file to a JSON array in output_file without holding the dataset in memory.
+
+    With workers > 1 the file is split into byte ranges of chunk_mb that are converted
+    in separate processes; their output is written back in input order.
+    """
+    separator = "," if compact else ",\n"
+    kept = skipped = 0
+    wrote_any = False
+
     with open(output_file, "w", encoding="utf-8") as fout:
-        json.dump(conversations_list, fout, indent=4, ensure_ascii=False)
+        def write(fragment):
+            nonlocal wrote_any
+            if not fragment:
+                return
+            fout.write(separator if wrote_any else ("[" if compact else "[\n"))
+            fout.write(fragment)
+            wrote_any = True
+
+        if workers > 1:
+            size = os.path.getsize(input_file)
+            chunk_bytes = max(1, int(chunk_mb * 1024 * 1024))
+            tasks = ((input_file, start, min(start + chunk_bytes, size), compact) for start in range(0, size, chunk_bytes))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Keep a bounded window of chunks in flight so memory stays proportional to workers * chunk_mb.
+                pending = deque()
+                for task in tasks:
+                    pending.append(executor.submit(convert_range, task))
+                    if len(pending) >= workers * 2:
+                        fragment, n_kept, n_skipped = pending.popleft().result()
+                        write(fragment)
+                        kept, skipped = kept + n_kept, skipped + n_skipped
+                while pending:
+                    fragment, n_kept, n_skipped = pending.popleft().result()
+                    write(fragment)
+                    kept, skipped = kept + n_kept, skipped + n_skipped
+        else:
+            for line in iter_lines(input_file):
+                conversation = convert_conversation(line)
+                if conversation is None:
+                    skipped += line.strip() != ""
+                    continue
+                write(render(conversation, compact))
+                kept += 1
+
+        if not wrote_any:
+            fout.write("[]")
+        else:
+            fout.write("]" if compact else "\n]")
+
+    print(f"Wrote {kept} conversations to {output_file} ({skipped} skipped).")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -66,6 +143,9 @@ if __name__ == "__main__":
     )
     parser.add_argument("input_file", help="Path to the input JSONL file")
     parser.add_argument("output_file", help="Path to the output JSON file")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to convert the file in parallel (output order is preserved)")
+    parser.add_argument("--chunk_mb", type=float, default=64, help="Size of the byte range given to each worker")
+    parser.add_argument("--compact", action="store_true", help="Write compact JSON instead of indenting with 4 spaces")
     args = parser.parse_args()
-    
-    convert_jsonl(args.input_file, args.output_file)
+
+    convert_jsonl(args.input_file, args.output_file, args.workers, args.compact, args.chunk_mb)
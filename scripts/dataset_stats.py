@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Description:
+    Profiles the token lengths of a training file as train.py sees them: every
+    conversation is formatted with the chat template and tokenized, on several
+    processes while the file is streamed. Prints length percentiles, a
+    histogram, the conversations truncated at --max_seq_length per QA group,
+    and the padding waste at candidate sequence lengths and batch sizes, so
+    that the shortest max_seq_length that truncates nothing can be chosen.
+
+    The QA group comes from the "group" field that parse_qa_data.py writes;
+    conversations without one are reported as "(ungrouped)".
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+from collections import defaultdict
+from itertools import islice
+from typing import List, Dict, Any, Tuple
+
+UNGROUPED = "(ungrouped)"
+PERCENTILES = [50, 90, 95, 99, 99.9, 100]
+
+_tokenizer = None
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Report token lengths, truncation and padding waste of a training file.")
+    parser.add_argument("--train_data", type=str, default="data.jsonl", help="Path to training data file.")
+    parser.add_argument("--base_model", type=str, default="unsloth/Llama-3.2-1B-Instruct-bnb-4bit", help="Base model whose tokenizer is used.")
+    parser.add_argument("--chat_template", type=str, default="llama-3.1",
+                        help="Chat template identifier, as for train.py. Empty uses the tokenizer's own template.")
+    parser.add_argument("--max_seq_length", type=int, default=1024, help="Sequence length the truncation per group is reported for.")
+    parser.add_argument("--seq_lengths", type=int, nargs="+", default=[512, 1024, 2048, 4096],
+                        help="Candidate sequence lengths for the padding report.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="Candidate batch sizes for the padding report.")
+    parser.add_argument("--bins", type=int, default=20, help="Number of histogram bins.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Tokenizer processes.")
+    parser.add_argument("--chunk_size", type=int, default=512, help="Conversations sent to a worker at a time.")
+    parser.add_argument("--seed", type=int, default=1337, help="Seed of the shuffled batch order in the padding report.")
+    parser.add_argument("--output_json", type=str, default="", help="Also write the full report to this file.")
+    return parser.parse_args()
+
+
+def load_tokenizer(base_model, chat_template):
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    if chat_template:
+        from unsloth.chat_templates import get_chat_template
+
+        tokenizer = get_chat_template(tokenizer, chat_template=chat_template)
+    return tokenizer
+
+
+def _init_worker(tokenizer_dir):
+    global _tokenizer
+    from transformers import AutoTokenizer
+
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+
+
+def _measure_chunk(lines: List[str]) -> List[Tuple[str, int]]:
+    """Returns (group, token count) for every conversation in lines, tokenized as in train.py; malformed lines give -1."""
+    groups, texts = [], []
+    for line in lines:
+        try:
+            record = json.loads(line)
+            text = _tokenizer.apply_chat_template(record["messages"], tokenize=False, add_generation_prompt=False)
+        except (ValueError, KeyError, TypeError):
+            groups.append(None)
+            continue
+        groups.append(record.get("group") or UNGROUPED)
+        texts.append(text)
+    lengths = iter(len(ids) for ids in _tokenizer(texts, padding=False, add_special_tokens=False)["input_ids"]) if texts else iter(())
+    return [(UNGROUPED, -1) if group is None else (group, next(lengths)) for group in groups]
+
+
+def read_chunks(path, chunk_size):
+    with open(path, "r", encoding="utf-8") as f:
+        lines = (line for line in f if line.strip())
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def measure(args) -> Tuple[List[str], List[int], int]:
+    """Streams train_data through the tokenizer on args.workers processes. Returns groups, lengths and the malformed line count."""
+    tokenizer = load_tokenizer(args.base_model, args.chat_template)
+    groups, lengths, malformed = [], [], 0
+    # Workers load the templated tokenizer from disk, so they do not import unsloth themselves.
+    with tempfile.TemporaryDirectory() as tokenizer_dir:
+        tokenizer.save_pretrained(tokenizer_dir)
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.workers, initializer=_init_worker, initargs=(tokenizer_dir,)) as pool:
+            for results in pool.imap(_measure_chunk, read_chunks(args.train_data, args.chunk_size)):
+                for group, length in results:
+                    if length < 0:
+                        malformed += 1
+                        continue
+                    groups.append(group)
+                    lengths.append(length)
+    return groups, lengths, malformed
+
+
+def percentile(sorted_values: List[int], pct: float) -> int:
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def histogram(lengths: List[int], bins: int) -> List[Dict[str, int]]:
+    """Equal-width bins, rounded to multiples of 8 tokens, from 0 to the longest length."""
+    longest = max(lengths)
+    width = max(1, -(-longest // bins))
+    if width > 8:
+        width = -(-width // 8) * 8
+    counts = defaultdict(int)
+    for length in lengths:
+        counts[length // width] += 1
+    return [{"start": b * width, "end": (b + 1) * width - 1, "count": counts[b]} for b in range(longest // width + 1)]
+
+
+def truncation_by_group(groups: List[str], lengths: List[int], max_seq_length: int) -> Dict[str, Dict[str, int]]:
+    report: Dict[str, Dict[str, int]] = {}
+    for group, length in zip(groups, lengths):
+        entry = report.setdefault(group, {"conversations": 0, "truncated": 0, "tokens_lost": 0, "longest": 0})
+        entry["conversations"] += 1
+        entry["longest"] = max(entry["longest"], length)
+        if length > max_seq_length:
+            entry["truncated"] += 1
+            entry["tokens_lost"] += length - max_seq_length
+    return report
+
+
+def padded_efficiency(lengths: List[int], batch_size: int) -> float:
+    """Share of real tokens when batches of batch_size conversations, in order, are padded to their longest member."""
+    slots = 0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        slots += max(batch) * len(batch)
+    return sum(lengths) / slots if slots else 0.0
+
+
+def padding_report(lengths: List[int], seq_lengths: List[int], batch_sizes: List[int], seed: int) -> List[Dict[str, Any]]:
+    """
+    For every candidate sequence length: conversations truncated and the padding waste of
+    batches in shuffled order (as the trainer draws them) at every batch size.
+    """
+    shuffled = list(lengths)
+    random.Random(seed).shuffle(shuffled)
+    report = []
+    for seq_length in sorted(seq_lengths):
+        clipped = [min(length, seq_length) for length in shuffled]
+        report.append({
+            "seq_length": seq_length,
+            "truncated": sum(1 for length in lengths if length > seq_length),
+            "padding_waste": {batch_size: 1 - padded_efficiency(clipped, batch_size) for batch_size in sorted(batch_sizes)},
+        })
+    return report
+
+
+def build_report(args, groups: List[str], lengths: List[int], malformed: int) -> Dict[str, Any]:
+    ordered = sorted(lengths)
+    longest = ordered[-1]
+    return {
+        "train_data": args.train_data,
+        "base_model": args.base_model,
+        "chat_template": args.chat_template,
+        "conversations": len(lengths),
+        "malformed_lines": malformed,
+        "tokens": sum(lengths),
+        "mean": sum(lengths) / len(lengths),
+        "percentiles": {str(pct): percentile(ordered, pct) for pct in PERCENTILES},
+        "histogram": histogram(lengths, args.bins),
+        "max_seq_length": args.max_seq_length,
+        "truncation_by_group": truncation_by_group(groups, lengths, args.max_seq_length),
+        "padding": padding_report(lengths, args.seq_lengths, args.batch_sizes, args.seed),
+        # Multiples of 8 keep tensor shapes friendly to the GPU.
+        "shortest_untruncated_seq_length": -(-longest // 8) * 8,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{report['conversations']} conversations, {report['tokens']} tokens "
+          f"(mean {report['mean']:.1f}) in {report['train_data']}")
+    if report["malformed_lines"]:
+        print(f"Skipped {report['malformed_lines']} lines without a readable 'messages' list.")
+
+    print("\nToken length percentiles:")
+    print("  " + "  ".join(f"p{pct}={value}" for pct, value in report["percentiles"].items()))
+
+    print("\nHistogram:")
+    peak = max(b["count"] for b in report["histogram"])
+    for b in report["histogram"]:
+        bar = "#" * (round(50 * b["count"] / peak) if peak else 0)
+        print(f"  {b['start']:>6}-{b['end']:<6} {b['count']:>8}  {bar}")
+
+    truncated = {g: e for g, e in report["truncation_by_group"].items() if e["truncated"]}
+    print(f"\nTruncated at max_seq_length {report['max_seq_length']}: "
+          f"{sum(e['truncated'] for e in truncated.values())} conversations")
+    for group, entry in sorted(truncated.items(), key=lambda item: -item[1]["truncated"]):
+        print(f"  {group}: {entry['truncated']} of {entry['conversations']} "
+              f"(longest {entry['longest']}, {entry['tokens_lost']} tokens lost)")
+
+    batch_sizes = list(report["padding"][0]["padding_waste"]) if report["padding"] else []
+    print("\nPadding waste (share of padded tokens):")
+    print("  " + f"{'seq_length':>10} {'truncated':>10} " + " ".join(f"{f'batch {b}':>9}" for b in batch_sizes))
+    for row in report["padding"]:
+        print("  " + f"{row['seq_length']:>10} {row['truncated']:>10} "
+              + " ".join(f"{row['padding_waste'][b]:>9.1%}" for b in batch_sizes))
+
+    print(f"\nShortest max_seq_length that truncates nothing: {report['shortest_untruncated_seq_length']}")
+
+
+def main():
+    args = parse_arguments()
+    groups, lengths, malformed = measure(args)
+    if not lengths:
+        print(f"No conversations found in {args.train_data}.")
+        return
+    report = build_report(args, groups, lengths, malformed)
+    print_report(report)
+    if args.output_json:
+        with open(args.output_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output_json}")
+
+
+if __name__ == "__main__":
+    main()
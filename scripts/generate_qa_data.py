@@ -10,14 +10,39 @@ import time
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import Process
 
 from SyntheticDataGeneration.QAGenerator import QAGeneratorEngine
+from SyntheticDataGeneration.RunPlanner import RunPlanner
 from SyntheticDataGeneration.Utils import Utils
 
+def run_worker(config: Dict[str, Any], output_base_path: Path, threads: int, index: int) -> None:
+    """Entry point of one local worker process in worker mode."""
+    metrics_config = config.get("global", {}).get("metrics", {})
+    if metrics_config.get("port"):
+        # Local workers serve their metrics on consecutive ports.
+        metrics_config["port"] = int(metrics_config["port"]) + index
+    QAGeneratorEngine(config, output_base_path, threads, shared_storage=True).run("worker")
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Generate QA data for LLM fine-tuning.")
     parser.add_argument("--config", default="generate_qa_config.yaml", help="Path to configuration YAML file")
-    parser.add_argument("--threads", type=int, default=8, help="Max workers for processing all tasks")
+    parser.add_argument("--threads", type=int, default=8, help="Max concurrent requests per provider and model")
+    parser.add_argument("--mode", choices=["online", "batch", "worker"], default="online",
+                        help="online: call the API per request; batch: submit questions, then answers, through the OpenAI Batch API; "
+                             "worker: online, taking question blocks from a work queue shared with other workers")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes to start on this host in worker mode (each with --threads requests per provider and model)")
+    plan = parser.add_argument_group("planning", "Predict calls, tokens and wall time without calling any provider")
+    plan.add_argument("--plan", action="store_true", help="Print the run plan and exit")
+    plan.add_argument("--questions_per_block", type=float, default=None,
+                      help="Questions expected per generated block (default: average of existing blocks, or 10)")
+    plan.add_argument("--latency", type=float, default=None, help="Seconds per call; overrides the token-based latency model")
+    plan.add_argument("--base_latency", type=float, default=0.5, help="Fixed seconds per call in the latency model")
+    plan.add_argument("--prompt_tps", type=float, default=2000.0, help="Prompt tokens processed per second per call")
+    plan.add_argument("--completion_tps", type=float, default=40.0, help="Completion tokens generated per second per call")
+    plan.add_argument("--question_tokens", type=int, default=200, help="Expected completion tokens of a question call")
+    plan.add_argument("--answer_tokens", type=int, default=400, help="Expected completion tokens of an answer call")
     args = parser.parse_args()
 
     config_path = Path(args.config)
@@ -27,8 +52,26 @@ def main() -> None:
 
     config = yaml.safe_load(config_path.read_text(encoding="utf-8"))
     output_base_path = Path(config.get("global", {}).get("output_base_path", "/var/kolo_data"))
-    engine = QAGeneratorEngine(config, output_base_path, args.threads)
-    engine.run()
+    if args.mode == "worker" and args.workers > 1 and not args.plan:
+        processes = [Process(target=run_worker, args=(config, output_base_path, args.threads, i)) for i in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return
+    engine = QAGeneratorEngine(
+        config, output_base_path, args.threads, shared_storage=args.mode == "worker", read_only=args.plan
+    )
+    if args.plan:
+        try:
+            RunPlanner(
+                engine, args.questions_per_block, args.latency, args.base_latency, args.prompt_tps,
+                args.completion_tps, args.question_tokens, args.answer_tokens
+            ).report()
+        finally:
+            engine.result_store.close()
+        return
+    engine.run(args.mode)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
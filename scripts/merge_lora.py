@@ -2,10 +2,17 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 import os
 import argparse
 
+from TrainingData.LoraMerge import LoraAdapter, check_output_dir, find_shards, merge_shards, parse_size
+
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--lora_model", type=str, required=True)
     parser.add_argument("--merged_model", type=str, required=True)
+    # Optional base model directory; when given, the LoRA adapter in --lora_model is merged into it.
+    # Otherwise --lora_model must already hold the merged weights, as torchtune saves them.
+    parser.add_argument("--base_model", type=str, default="")
+    # Largest output shard; the merge holds about one shard in memory.
+    parser.add_argument("--max_shard_size", type=str, default="2GB")
     # Optional quantization parameter; if provided, a separate model file is created.
     parser.add_argument("--quantization", type=str, default="")
     return parser.parse_args()
@@ -46,15 +53,29 @@ def create_modelfile(file_path, from_line):
 def main():
     args = get_args()
 
+    # Writing into an input directory would delete its weights before they are read.
+    check_output_dir(args.merged_model, [args.lora_model] + ([args.base_model] if args.base_model else []))
+
     # Rename the adapter configuration file (if present).
     rename_adapter_config(args.lora_model)
 
-    # Merge LoRA model into a base model and save the merged model.
-    base_model = AutoModelForCausalLM.from_pretrained(args.lora_model)
-    tokenizer = AutoTokenizer.from_pretrained(args.lora_model)
-
+    # Merge LoRA model into a base model and save the merged model, streaming the safetensors
+    # shards so that the whole model never has to fit in memory.
     merged_output = args.merged_model
-    base_model.save_pretrained(merged_output)
+    base_dir = args.base_model or args.lora_model
+    if find_shards(base_dir):
+        adapter = LoraAdapter(args.lora_model) if args.base_model else None
+        stats = merge_shards(base_dir, merged_output, adapter, parse_size(args.max_shard_size))
+        print(f"Wrote {stats['shards']} shards ({stats['bytes'] / 1e9:.2f} GB), {stats['merged_tensors']} tensors merged.")
+    else:
+        # Checkpoints without safetensors weights are loaded whole.
+        base_model = AutoModelForCausalLM.from_pretrained(args.lora_model)
+        base_model.save_pretrained(merged_output)
+
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(args.lora_model)
+    except OSError:
+        tokenizer = AutoTokenizer.from_pretrained(base_dir)
     tokenizer.save_pretrained(merged_output)
     print(f"Model saved to {merged_output}")
 
@@ -0,0 +1,313 @@
+import json
+import math
+import re
+import random
+import argparse
+import threading
+import time
+import uuid
+from typing import Optional, List
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_QUESTIONS = [
+    "How do I install {topic}?",
+    "What does {topic} do when it starts?",
+    "Can you explain how {topic} handles errors?",
+    "Which settings control {topic}?",
+    "Why would {topic} fail on a fresh machine?",
+    "What are the steps to configure {topic} for production?",
+    "How can I extend {topic} with a custom plugin?",
+    "What is the difference between {topic} and its alternatives?",
+]
+TOPICS = ["the model", "the container", "the training script", "the config file", "the converter", "the CLI", "the scheduler", "the cache"]
+
+def parse_latency(spec: str):
+    """
+    Returns a function producing latencies in seconds from a spec such as
+    fixed:0.2, uniform:0.1,0.5, normal:0.3,0.1, lognormal:0.3,0.5 (median, sigma) or exp:0.3.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class MockLLM:
+    """Behaviour and counters shared by all request handlers."""
+
+    def __init__(self, args):
+        self.latency = parse_latency(args.latency)
+        self.error_rate = args.error_rate
+        self.rate_429 = args.rate_429
+        self.retry_after = args.retry_after
+        self.questions_per_block = args.questions_per_block
+        self.question_pattern = re.compile(args.question_pattern)
+        self.answer_text = args.answer_text
+        self.batch_delay = args.batch_delay
+        self.questions = DEFAULT_QUESTIONS
+        if args.questions_file:
+            with open(args.questions_file, "r", encoding="utf-8") as f:
+                self.questions = [line.strip() for line in f if line.strip()]
+        self.lock = threading.Lock()
+        self.stats = {
+            "requests": 0, "errors": 0, "throttled": 0, "in_flight": 0, "peak_in_flight": 0,
+            "completion_tokens": 0, "cancelled": 0
+        }
+        self.files = {}
+        self.batches = {}
+
+    def complete(self, prompt: str) -> str:
+        if self.question_pattern.search(prompt):
+            if self.questions_per_block <= len(self.questions):
+                picks = random.sample(self.questions, self.questions_per_block)
+            else:
+                picks = random.choices(self.questions, k=self.questions_per_block)
+            return "\n".join(
+                f"{i}. {q.format(topic=random.choice(TOPICS))}" for i, q in enumerate(picks, start=1)
+            )
+        return self.answer_text
+
+    @staticmethod
+    def tokens(text: str, limit: Optional[int]) -> List[str]:
+        """Splits text into word "tokens", keeping at most limit of them."""
+        pieces = re.findall(r"\S+\s*", text)
+        return pieces[:limit] if limit else pieces
+
+    def begin(self):
+        """Returns an (HTTP status, body, headers) failure to send instead of a completion, or None."""
+        roll = random.random()
+        with self.lock:
+            self.stats["requests"] += 1
+            if roll < self.rate_429:
+                self.stats["throttled"] += 1
+                return 429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": str(self.retry_after)}
+            if roll < self.rate_429 + self.error_rate:
+                self.stats["errors"] += 1
+                return 500, {"error": {"message": "Internal error", "type": "server_error"}}, {}
+            self.stats["in_flight"] += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+        return None
+
+    def end(self):
+        with self.lock:
+            self.stats["in_flight"] -= 1
+
+def make_handler(mock: MockLLM):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, code, obj=None, headers=None, raw=None):
+            out = raw if raw is not None else json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(out)
+
+        def generate(self, prompt, limit):
+            failure = mock.begin()
+            if failure:
+                self.send(*failure)
+                return None
+            try:
+                started = time.monotonic()
+                time.sleep(mock.latency())
+                pieces = mock.tokens(mock.complete(prompt), limit)
+                with mock.lock:
+                    mock.stats["completion_tokens"] += len(pieces)
+                return "".join(pieces), time.monotonic() - started
+            finally:
+                mock.end()
+
+        def write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def stream(self, prompt, limit, content_type, render, finish):
+            """
+            Sends the completion piece by piece: a fifth of the latency before the first
+            piece (prompt evaluation), the rest spread over the pieces. Stops when the
+            client disconnects, as a real server stops generating.
+            """
+            failure = mock.begin()
+            if failure:
+                self.send(*failure)
+                return
+            try:
+                latency = mock.latency()
+                pieces = mock.tokens(mock.complete(prompt), limit)
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(latency * 0.2)
+                for piece in pieces:
+                    time.sleep(latency * 0.8 / len(pieces))
+                    self.write_chunk(render(piece))
+                    with mock.lock:
+                        mock.stats["completion_tokens"] += 1
+                self.write_chunk(finish(len(pieces), latency))
+                self.write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                with mock.lock:
+                    mock.stats["cancelled"] += 1
+                self.close_connection = True
+            finally:
+                mock.end()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/api/generate":
+                request = json.loads(body)
+                prompt = request["prompt"]
+                limit = (request.get("options") or {}).get("num_predict")
+                stats = lambda tokens, elapsed: {
+                    "prompt_eval_count": len(prompt) // 4, "eval_count": tokens,
+                    "prompt_eval_duration": int(elapsed * 0.2 * 1e9), "total_duration": int(elapsed * 1e9)
+                }
+                if request.get("stream", True):
+                    self.stream(
+                        prompt, limit, "application/x-ndjson",
+                        lambda piece: json.dumps({"model": request.get("model"), "response": piece, "done": False}).encode() + b"\n",
+                        lambda tokens, elapsed: json.dumps(
+                            {"model": request.get("model"), "response": "", "done": True, **stats(tokens, elapsed)}
+                        ).encode() + b"\n"
+                    )
+                    return
+                result = self.generate(prompt, limit)
+                if result:
+                    text, elapsed = result
+                    self.send(200, {"model": request.get("model"), "response": text, "done": True, **stats(len(text) // 4, elapsed)})
+            elif self.path == "/v1/chat/completions":
+                request = json.loads(body)
+                prompt = request["messages"][-1]["content"]
+                limit = request.get("max_tokens") or request.get("max_completion_tokens")
+                completion_id = "chatcmpl-" + uuid.uuid4().hex[:8]
+                if request.get("stream"):
+                    def event(choices, usage=None):
+                        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": request.get("model"), "choices": choices}
+                        if usage:
+                            chunk["usage"] = usage
+                        return b"data: " + json.dumps(chunk).encode() + b"\n\n"
+
+                    def finish(tokens, _):
+                        out = event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                        if (request.get("stream_options") or {}).get("include_usage"):
+                            out += event([], {"prompt_tokens": len(prompt) // 4, "completion_tokens": tokens,
+                                              "total_tokens": len(prompt) // 4 + tokens})
+                        return out + b"data: [DONE]\n\n"
+
+                    self.stream(
+                        prompt, limit, "text/event-stream",
+                        lambda piece: event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}]), finish
+                    )
+                    return
+                result = self.generate(prompt, limit)
+                if result:
+                    text, _ = result
+                    prompt_tokens, completion_tokens = len(prompt) // 4, len(text) // 4
+                    self.send(200, {
+                        "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                        "model": request.get("model"),
+                        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+                    })
+            elif self.path == "/v1/files":
+                message = BytesParser(policy=HTTP).parsebytes(
+                    b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body
+                )
+                data = [part for part in message.iter_parts() if part.get_filename()][0].get_payload(decode=True)
+                file_id = "file-" + uuid.uuid4().hex[:8]
+                mock.files[file_id] = data
+                self.send(200, {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                                "filename": "batch.jsonl", "purpose": "batch", "status": "processed"})
+            elif self.path == "/v1/batches":
+                request = json.loads(body)
+                lines = [json.loads(line) for line in mock.files[request["input_file_id"]].decode("utf-8").splitlines() if line.strip()]
+                output = "\n".join(json.dumps({
+                    "id": "req-" + uuid.uuid4().hex[:8], "custom_id": line["custom_id"],
+                    "response": {"status_code": 200, "body": {"choices": [{"index": 0, "message": {
+                        "role": "assistant", "content": "".join(mock.tokens(
+                            mock.complete(line["body"]["messages"][-1]["content"]), line["body"].get("max_tokens")
+                        ))
+                    }}]}}
+                }) for line in lines).encode("utf-8")
+                output_id = "file-" + uuid.uuid4().hex[:8]
+                mock.files[output_id] = output
+                batch_id = "batch_" + uuid.uuid4().hex[:8]
+                mock.batches[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": request["endpoint"], "input_file_id": request["input_file_id"],
+                    "completion_window": "24h", "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                    "request_counts": {"total": len(lines), "completed": 0, "failed": 0}, "_output_id": output_id, "_started": time.monotonic()
+                }
+                self.send(200, {k: v for k, v in mock.batches[batch_id].items() if not k.startswith("_")})
+            else:
+                self.send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self.send(200, {"models": []})
+            elif self.path == "/stats":
+                with mock.lock:
+                    self.send(200, dict(mock.stats))
+            elif self.path.startswith("/v1/batches/"):
+                batch = mock.batches[self.path.rsplit("/", 1)[1]]
+                if time.monotonic() - batch["_started"] >= mock.batch_delay:
+                    batch["status"] = "completed"
+                    batch["output_file_id"] = batch["_output_id"]
+                    batch["request_counts"]["completed"] = batch["request_counts"]["total"]
+                self.send(200, {k: v for k, v in batch.items() if not k.startswith("_")})
+            elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+                self.send(200, raw=mock.files[self.path.split("/")[3]])
+            else:
+                self.send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    return Handler
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for Ollama /api/generate and the OpenAI chat completions and Batch APIs."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", default="lognormal:0.2,0.5",
+                        help="Latency distribution: fixed:S, uniform:A,B, normal:MEAN,SD, lognormal:MEDIAN,SIGMA or exp:MEAN")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--questions_per_block", type=int, default=5, help="Questions returned for a question prompt")
+    parser.add_argument("--questions_file", default=None, help="Canned questions, one per line ({topic} is filled in)")
+    parser.add_argument("--question_pattern", default=r"list of questions|<question 1>",
+                        help="Regex identifying question generation prompts")
+    parser.add_argument("--answer_text", default="This is a generated answer.", help="Text returned for answer prompts")
+    parser.add_argument("--batch_delay", type=float, default=1.0, help="Seconds before a submitted batch completes")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockLLM(args)))
+    server.daemon_threads = True
+    print(f"Mock LLM server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
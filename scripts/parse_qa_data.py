@@ -1,108 +1,194 @@
 import os
 import json
 import re
-import glob
+import argparse
+import sqlite3
+import yaml
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from SyntheticDataGeneration.ResultStore import SqliteResultStore
 from SyntheticDataGeneration.TextParser import TextParser
 from SyntheticDataGeneration.Utils import Utils  # Import the Utils class with the logger
 
-# Adjust these paths as needed.
-BASE_OUTPUT_DIR = "/var/kolo_data/qa_generation_output"
-QUESTIONS_DIR = os.path.join(BASE_OUTPUT_DIR, "questions")
-ANSWERS_DIR = os.path.join(BASE_OUTPUT_DIR, "answers")
-OUTPUT_FILE = "/app/data.jsonl"
+DEFAULT_OUTPUT_DIR = "/var/kolo_data/qa_generation_output"
+DEFAULT_OUTPUT_FILE = "/app/data.jsonl"
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generate_qa_config.yaml")
 
-def pair_questions_and_answers():
+QUESTION_FILE_RE = re.compile(r"questions_(.+)_seed(\d+)_instr(\d+)\.txt")
+ANSWER_FILE_RE = re.compile(r"answer_(.+)_seed(\d+)_instr(\d+)_q(\d+)_[0-9a-f]+\.txt")
+
+def index_answers(answers_dir):
+    """
+    Scans ANSWERS_DIR once and returns {(group_name, q_seed_idx, instr_idx, question_number): [answer paths]}.
+
+    Expected answer file format: answer_{group_name}_seed{q_seed_idx}_instr{instr_idx}_q{idx}_{hash}.txt
     """
-    Looks for all question files in the QUESTIONS_DIR and then for each question,
-    pairs it with the corresponding answer files from ANSWERS_DIR.
+    index = {}
+    with os.scandir(answers_dir) as entries:
+        for entry in entries:
+            m = ANSWER_FILE_RE.fullmatch(entry.name)
+            if m:
+                key = (m.group(1), int(m.group(2)), int(m.group(3)), int(m.group(4)))
+                index.setdefault(key, []).append(entry.path)
+    for paths in index.values():
+        paths.sort()
+    return index
+
+def read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def make_pair(question, answer, group_name):
+    return {
+        "messages": [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer}
+        ],
+        "group": group_name
+    }
+
+def ordered_map(executor, func, items, window):
+    """Like executor.map, but keeps at most `window` results pending so memory stays bounded."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def pair_questions_and_answers(output_dir, workers=16):
+    """
+    Yields (identifier, question count, QA pairs) for every question file in
+    output_dir/questions, pairing each question with its answer files from
+    output_dir/answers.
 
-    Assumes the new naming convention:
+    Assumes the naming convention:
       - Questions: questions_{group_name}_seed{q_seed_idx}_instr{instr_idx}.txt
       - Answers:   answer_{group_name}_seed{q_seed_idx}_instr{instr_idx}_q{question_number}_{hash}.txt
 
     If there are multiple answer files for a given question, each answer is saved as its own QA pair.
+    Each pair records its file group under "group" so that dataset_stats.py can report per group.
+    Files are read on a thread pool; results come back in question file order.
     """
-    qa_pairs = []
-    group_stats = {}  # { identifier: {'questions': count, 'answers': count} }
-
-    # Process each question file.
-    for q_filename in os.listdir(QUESTIONS_DIR):
-        q_filepath = os.path.join(QUESTIONS_DIR, q_filename)
-        Utils.logger.info(f"Processing question file: {q_filepath}")
+    questions_dir = os.path.join(output_dir, "questions")
+    answer_index = index_answers(os.path.join(output_dir, "answers"))
+    Utils.logger.info(f"Indexed {sum(len(p) for p in answer_index.values())} answer files.")
 
-        # Expect filenames like: questions_{group_name}_seed{q_seed_idx}_instr{instr_idx}.txt
-        m = re.match(r"questions_(.+)_seed(\d+)_instr(\d+)\.txt", q_filename)
+    question_files = []
+    for q_filename in sorted(os.listdir(questions_dir)):
+        m = QUESTION_FILE_RE.fullmatch(q_filename)
         if not m:
             Utils.logger.warning(f"Skipping file with unexpected format: {q_filename}")
             continue
+        question_files.append((q_filename, m.group(1), int(m.group(2)), int(m.group(3))))
 
-        group_name = m.group(1)
-        q_seed_idx = m.group(2)
-        instr_idx = m.group(3)
+    def process(question_file):
+        q_filename, group_name, q_seed_idx, instr_idx = question_file
         identifier = f"{group_name}_seed{q_seed_idx}_instr{instr_idx}"
-
-        # Read file content and extract questions using TextParser.
-        with open(q_filepath, 'r', encoding='utf-8') as f:
-            file_content = f.read()
-        questions = TextParser.parse_questions(file_content)
-        Utils.logger.info(f"Found {len(questions)} questions in file: {q_filename}")
-
-        # Initialize stats for this identifier.
-        group_stats[identifier] = {'questions': len(questions), 'answers': 0}
-
-        # For each question, look for the corresponding answer files using a glob pattern.
-        # Expected answer file format: answer_{group_name}_seed{q_seed_idx}_instr{instr_idx}_q{idx}_{hash}.txt
+        questions = TextParser.parse_questions(read_text(os.path.join(questions_dir, q_filename)))
+        pairs = []
         for idx, question in enumerate(questions, start=1):
-            Utils.logger.info(f"Processing question {idx} in file: {q_filename}")
-            pattern = os.path.join(
-                ANSWERS_DIR,
-                f"answer_{group_name}_seed{q_seed_idx}_instr{instr_idx}_q{idx}_*.txt"
-            )
-            matching_files = glob.glob(pattern)
-            if not matching_files:
+            answer_paths = answer_index.get((group_name, q_seed_idx, instr_idx, idx))
+            if not answer_paths:
                 Utils.logger.warning(f"No answer file found for identifier {identifier}, question {idx}.")
                 continue
+            for answer_path in answer_paths:
+                pairs.append(make_pair(question, read_text(answer_path).strip(), group_name))
+        return identifier, len(questions), pairs
 
-            for answer_filepath in matching_files:
-                Utils.logger.info(f"Processing answer file: {answer_filepath} for question {idx} in file: {q_filename}")
-                with open(answer_filepath, 'r', encoding='utf-8') as af:
-                    answer = af.read().strip()
-                # Each answer file gets its own Q&A pair.
-                qa_pair = {
-                    "messages": [
-                        {"role": "user", "content": question},
-                        {"role": "assistant", "content": answer}
-                    ]
-                }
-                qa_pairs.append(qa_pair)
-                group_stats[identifier]['answers'] += 1
-
-    return qa_pairs, group_stats
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from ordered_map(executor, process, question_files, workers * 4)
+
+def pair_questions_and_answers_from_db(db_path):
+    """
+    Same pairing as pair_questions_and_answers, reading the SQLite result store
+    written by the sqlite output_backend.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        for group_name, q_seed_idx, instr_idx, file_content in SqliteResultStore.iter_questions(conn):
+            identifier = f"{group_name}_seed{q_seed_idx}_instr{instr_idx}"
+            questions = TextParser.parse_questions(file_content)
+            pairs = []
+            answered = set()
+            for idx, answer in SqliteResultStore.iter_answers(conn, (group_name, q_seed_idx, instr_idx)):
+                if idx > len(questions):
+                    continue
+                answered.add(idx)
+                pairs.append(make_pair(questions[idx - 1], answer.strip(), group_name))
+            for idx in range(1, len(questions) + 1):
+                if idx not in answered:
+                    Utils.logger.warning(f"No answer found for identifier {identifier}, question {idx}.")
+            yield identifier, len(questions), pairs
+    finally:
+        conn.close()
+
+def resolve_backend(args):
+    """
+    Returns ("files", None) or ("sqlite", db path) for the run being parsed: --backend and --db
+    win, then global.output_backend and global.output_db from the generation config.
+    """
+    global_config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r', encoding='utf-8') as f:
+            global_config = (yaml.safe_load(f) or {}).get("global", {})
+    elif args.config != DEFAULT_CONFIG:
+        raise FileNotFoundError(f"Configuration file not found: {args.config}")
+
+    backend = args.backend or ("sqlite" if args.db else global_config.get("output_backend", "files"))
+    if backend != "sqlite":
+        return "files", None
+    db_path = args.db
+    if not db_path and global_config.get("output_db"):
+        db_path = os.path.join(global_config.get("output_base_path", "/var/kolo_data"), global_config["output_db"])
+    return "sqlite", db_path or os.path.join(args.output_dir, "results.sqlite")
 
 def main():
-    qa_pairs, group_stats = pair_questions_and_answers()
-    
-    if not qa_pairs:
+    parser = argparse.ArgumentParser(description="Pair generated questions and answers into a JSONL training file.")
+    parser.add_argument("--output_dir", default=DEFAULT_OUTPUT_DIR, help="qa_generation_output directory written by generate_qa_data.py")
+    parser.add_argument("--output_file", default=DEFAULT_OUTPUT_FILE, help="JSONL file to write")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="Generation config whose output_backend and output_db are read")
+    parser.add_argument("--backend", choices=["files", "sqlite"], default=None,
+                        help="Result store to read (default: output_backend from --config, or files)")
+    parser.add_argument("--db", default=None, help="SQLite result store to read; implies --backend sqlite "
+                                                   "(default: output_db from --config, or <output_dir>/results.sqlite)")
+    parser.add_argument("--workers", type=int, default=16, help="Threads used to read question and answer files")
+    args = parser.parse_args()
+
+    backend, db_path = resolve_backend(args)
+    if backend == "sqlite":
+        if not os.path.exists(db_path):
+            Utils.logger.error(f"SQLite result store not found: {db_path}")
+            return
+        Utils.logger.info(f"Reading results from {db_path}")
+        results = pair_questions_and_answers_from_db(db_path)
+    else:
+        results = pair_questions_and_answers(args.output_dir, args.workers)
+
+    total_questions = 0
+    total_answers = 0
+    group_stats = {}  # { identifier: {'questions': count, 'answers': count} }
+    with open(args.output_file, 'w', encoding='utf-8') as out_f:
+        for identifier, question_count, pairs in results:
+            for pair in pairs:
+                out_f.write(json.dumps(pair, ensure_ascii=False) + "\n")
+            group_stats[identifier] = {'questions': question_count, 'answers': len(pairs)}
+            total_questions += question_count
+            total_answers += len(pairs)
+
+    if not total_answers:
         Utils.logger.info("No QA pairs found.")
         return
 
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as out_f:
-        for pair in qa_pairs:
-            json_line = json.dumps(pair, ensure_ascii=False)
-            out_f.write(json_line + "\n")
-
     # Log summary statistics.
-    total_questions = 0
-    total_answers = 0
     Utils.logger.info("Processing Summary:")
     for identifier, stats in group_stats.items():
-        total_questions += stats['questions']
-        total_answers += stats['answers']
         Utils.logger.info(f"  Identifier '{identifier}': {stats['questions']} questions, {stats['answers']} answers processed.")
 
     Utils.logger.info(f"Total: {total_questions} questions and {total_answers} answers processed.")
-    Utils.logger.info(f"Total QA pairs saved to {OUTPUT_FILE}: {len(qa_pairs)}")
+    Utils.logger.info(f"Total QA pairs saved to {args.output_file}: {total_answers}")
 
 if __name__ == "__main__":
     main()
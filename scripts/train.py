@@ -22,15 +22,23 @@ Description:
         --quantization       Quantization type e.g. (q4_k_m)
         --weight_decay       Weight Decay.
         --use_checkpoint     Use latest checkpoint or start over.
+        --dataset_cache_dir  Directory of the tokenized dataset cache.
+        --no_dataset_cache   Always tokenize the training data from scratch.
+        --max_tokens_per_batch  Batch conversations of similar length up to this many padded tokens.
 """
 
 import argparse
+import os
 
 from unsloth import FastLanguageModel, is_bfloat16_supported
 from unsloth.chat_templates import get_chat_template
 from datasets import load_dataset
+from torch.utils.data import DataLoader
 from trl import SFTTrainer
-from transformers import TrainingArguments
+from transformers import TrainingArguments, TrainerCallback
+
+from TrainingData.DatasetCache import DatasetCache
+from TrainingData.TokenBudgetSampler import TokenBudgetBatchSampler, batch_stats, token_budget_batches
 
 
 def parse_arguments():
@@ -55,12 +63,20 @@ def parse_arguments():
     parser.add_argument("--quantization", type=str, default="", help="Quantization type e.g. (q4_k_m)")
     parser.add_argument("--weight_decay", type=float, default=0.0, help="Weight Decay")
     parser.add_argument("--use_checkpoint", action="store_true", help="Use latest checkpoint or start over")
+    parser.add_argument("--dataset_cache_dir", type=str, default="/var/kolo_data/unsloth/dataset_cache",
+                        help="Where tokenized datasets are cached between runs.")
+    parser.add_argument("--no_dataset_cache", action="store_true", help="Tokenize the training data without using the cache.")
+    parser.add_argument("--max_tokens_per_batch", type=int, default=0,
+                        help="Batch conversations of similar length up to this many padded tokens instead of a fixed batch size. "
+                             "batch_size is then the target number of conversations per optimizer step; a step "
+                             "covers max(batch_size, conversations per batch). The loss is normalized by the trained "
+                             "tokens of the whole step, so every token weighs the same whatever the size of its batch.")
 
 
     return parser.parse_args()
 
 
-def formatting_prompts_func(examples, tokenizer):
+def formatting_prompts_func(examples, tokenizer, max_seq_length):
     """
     Formats the prompts from the dataset by applying the chat template
     and tokenizing the resulting texts.
@@ -68,17 +84,70 @@ def formatting_prompts_func(examples, tokenizer):
     Args:
         examples (dict): A dictionary with a key "messages" containing conversation data.
         tokenizer: The tokenizer that includes the chat template method.
+        max_seq_length (int): Length the token ids are truncated to.
 
     Returns:
-        dict: A dictionary with tokenized texts under the key "text".
+        dict: A dictionary with the token ids under the key "input_ids".
     """
     convos = examples["messages"]
     # Apply the chat template to each conversation without tokenizing yet.
     texts = [tokenizer.apply_chat_template(convo, tokenize=False, add_generation_prompt=False)
              for convo in convos]
     # Tokenize the texts.
-    tokenized_texts = tokenizer(texts, padding=False, truncation=True, add_special_tokens=False)
-    return {"text": texts, "input_ids": tokenized_texts["input_ids"]}
+    tokenized_texts = tokenizer(texts, padding=False, truncation=True, max_length=max_seq_length, add_special_tokens=False)
+    return {"input_ids": tokenized_texts["input_ids"]}
+
+def tokenize_dataset(train_data, tokenizer, max_seq_length):
+    """Loads the training data and tokenizes it on all cores."""
+    dataset = load_dataset("json", data_files=train_data, split="train")
+    # Worker processes only pay off for larger datasets.
+    num_proc = max(1, min(os.cpu_count() or 1, len(dataset) // 1000))
+    return dataset.map(
+        lambda ex: formatting_prompts_func(ex, tokenizer=tokenizer, max_seq_length=max_seq_length),
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=dataset.column_names,
+    )
+
+class TokenBudgetTrainer(SFTTrainer):
+    """
+    SFTTrainer that takes its training batches from a batch sampler instead of a fixed batch size.
+
+    Batches hold different numbers of conversations, so the loss must be normalized by the
+    trained tokens of the whole accumulation window rather than averaged per batch; otherwise
+    a batch of a few short conversations would weigh as much as a batch of many. The trainer
+    does this when the model accepts loss kwargs (it is then passed num_items_in_batch).
+    """
+
+    def __init__(self, *args, batch_sampler=None, **kwargs):
+        self.batch_sampler = batch_sampler
+        super().__init__(*args, **kwargs)
+        if batch_sampler is not None and not getattr(self, "model_accepts_loss_kwargs", False):
+            print("Warning: this model's loss is averaged per batch, not per token across the accumulation window, "
+                  "so with --max_tokens_per_batch conversations in small batches weigh more than those in large ones.")
+
+    def get_train_dataloader(self):
+        if self.batch_sampler is None:
+            return super().get_train_dataloader()
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=self.batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+
+class SamplerEpochCallback(TrainerCallback):
+    """Reseeds the batch sampler at the start of every epoch, including the epoch a resumed run starts in."""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.sampler.set_epoch(int(state.epoch or 0))
+
 
 def main():
     args = parse_arguments()
@@ -109,18 +178,51 @@ def main():
     # Update the tokenizer with the chosen chat template.
     tokenizer = get_chat_template(tokenizer, chat_template=args.chat_template)
 
-    # Data Preparation: Load dataset and format the prompts.
-    dataset = load_dataset("json", data_files=args.train_data, split="train")
-    # Use a lambda to pass the tokenizer into our formatting function.
-    dataset = dataset.map(lambda ex: formatting_prompts_func(ex, tokenizer=tokenizer), batched=True)
+    # Data Preparation: Load the tokenized dataset from the cache, or tokenize and cache it.
+    if args.no_dataset_cache:
+        dataset = tokenize_dataset(args.train_data, tokenizer, args.max_seq_length)
+    else:
+        cache = DatasetCache(args.dataset_cache_dir)
+        dataset = cache.load_or_build(
+            cache.key(args.train_data, tokenizer, args.chat_template, args.max_seq_length),
+            lambda: tokenize_dataset(args.train_data, tokenizer, args.max_seq_length),
+        )
+
+    print("Sample data:", tokenizer.decode(dataset[0]["input_ids"]))
+
+    # The dataset is already tokenized, so the trainer must not process it again.
+    trainer_kwargs = {"dataset_kwargs": {"skip_prepare_dataset": True}}
 
-    print("Sample data:", dataset[0])
+    # Optionally batch by a token budget, with gradient accumulation keeping about batch_size conversations per step.
+    per_device_batch_size, gradient_accumulation_steps = args.batch_size, 1
+    if args.max_tokens_per_batch:
+        lengths = [len(ids) for ids in dataset["input_ids"]]
+        batch_sampler = TokenBudgetBatchSampler(lengths, args.max_tokens_per_batch, seed=args.seed)
+        stats = batch_stats(lengths, token_budget_batches(lengths, args.max_tokens_per_batch, seed=args.seed))
+        gradient_accumulation_steps = max(1, round(args.batch_size / stats["mean_size"]))
+        per_device_batch_size = 1  # Ignored for training; the batch sampler sizes the batches.
+        print(
+            f"Token budget: {stats['batches']} batches of {stats['min_size']}-{stats['max_size']} conversations "
+            f"(mean {stats['mean_size']:.1f}) within {args.max_tokens_per_batch} padded tokens; "
+            f"{stats['efficiency']:.1%} of padded tokens are real. Accumulating {gradient_accumulation_steps} "
+            f"batches per step for about {stats['mean_size'] * gradient_accumulation_steps:.1f} conversations per step."
+        )
+        if stats["mean_size"] > args.batch_size:
+            # Accumulation cannot go below one batch, so each step covers max(batch_size, mean_size) conversations.
+            print(f"Warning: batches average {stats['mean_size']:.1f} conversations, more than batch_size {args.batch_size}, "
+                  f"so each optimizer step covers about {stats['mean_size']:.1f}. Lower --max_tokens_per_batch to about "
+                  f"{int(args.max_tokens_per_batch * args.batch_size / stats['mean_size'])} to keep batch_size conversations per step.")
+        if args.max_tokens_per_batch < args.max_seq_length:
+            print(f"Warning: conversations longer than {args.max_tokens_per_batch} tokens are trained in batches of one.")
+        trainer_kwargs["batch_sampler"] = batch_sampler
+        trainer_kwargs["callbacks"] = [SamplerEpochCallback(batch_sampler)]
 
     volume_output_dir = f"/var/kolo_data/unsloth/{args.output_dir}"
 
     # Configure training arguments.
     training_args = TrainingArguments(
-        per_device_train_batch_size=args.batch_size,
+        per_device_train_batch_size=per_device_batch_size,
+        gradient_accumulation_steps=gradient_accumulation_steps,
         warmup_steps=args.warmup_steps,
         num_train_epochs=args.epochs,
         learning_rate=args.learning_rate,
@@ -139,7 +241,7 @@ def main():
     )
 
     # Set up the trainer.
-    trainer = SFTTrainer(
+    trainer = TokenBudgetTrainer(
         model=model,
         tokenizer=tokenizer,
         train_dataset=dataset,
@@ -148,6 +250,7 @@ def main():
         dataset_num_proc=2,
         packing=False,
         args=training_args,
+        **trainer_kwargs,
     )
 
     # Train the model.
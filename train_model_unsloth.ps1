@@ -23,6 +23,8 @@ param (
     [string]$Quantization,
     [double]$WeightDecay,
     [switch]$UseCheckpoint,
+    [int]$MaxTokensPerBatch,
+    [switch]$NoDatasetCache,
     [switch]$FastTransfer
 )
 
@@ -47,6 +49,8 @@ if ($OutputDir) { Write-Host "OutputDir: $OutputDir" }
 if ($Quantization) { Write-Host "Quantization: $Quantization" }
 if ($WeightDecay) { Write-Host "WeightDecay: $WeightDecay" }
 if ($UseCheckpoint) { Write-Host "UseCheckpoint: Enabled" } else { Write-Host "UseCheckpoint: Disabled" }
+if ($MaxTokensPerBatch) { Write-Host "MaxTokensPerBatch: $MaxTokensPerBatch" }
+if ($NoDatasetCache) { Write-Host "DatasetCache: Disabled" } else { Write-Host "DatasetCache: Enabled" }
 if ($FastTransfer) { Write-Host "FastTransfer: Enabled (HF_HUB_ENABLE_HF_TRANSFER=1)" } else { Write-Host "FastTransfer: Disabled (HF_HUB_ENABLE_HF_TRANSFER=0)" }
 # Define container name
 $ContainerName = "kolo_container"
@@ -82,6 +86,8 @@ if ($OutputDir) { $command += " --output_dir '$OutputDir'" }
 if ($Quantization) { $command += " --quantization '$Quantization'" }
 if ($WeightDecay) { $command += " --weight_decay '$WeightDecay'" }
 if ($UseCheckpoint) { $command += " --use_checkpoint" }
+if ($MaxTokensPerBatch) { $command += " --max_tokens_per_batch $MaxTokensPerBatch" }
+if ($NoDatasetCache) { $command += " --no_dataset_cache" }
 
 # Execute the python script inside the container
 try {